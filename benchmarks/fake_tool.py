@@ -0,0 +1,72 @@
+"""A stand-in for the Juju hook tools, backed by a generated model.
+
+install_tools() copies this file into a directory on PATH and links every
+supported hook tool name to it. The tool to emulate is taken from the name
+the script is called by, and the model is read from the JSON file named by
+CHARMING_BENCH_MODEL. Only the standard library is used, to keep the cost of
+a call close to the cost of a real jujuc call.
+"""
+import json
+import os
+import sys
+
+
+def _option(args, name):
+    if name in args:
+        index = args.index(name)
+        value = args[index + 1]
+        del args[index:index + 2]
+        return value
+    return None
+
+
+def _relation_type(relation_id):
+    return relation_id.split(":")[0]
+
+
+def main(argv=sys.argv, environ=os.environ):
+    tool = os.path.basename(argv[0])
+    args = [arg for arg in argv[1:] if not arg.startswith("--format")]
+    if "--help" in args:
+        # Advertise the features probed by charming.juju.capabilities.
+        sys.stdout.write("usage: {} [options]\n  --file\n".format(tool))
+        return 0
+    if tool in ("juju-log", "status-set", "relation-set", "open-port",
+                "close-port"):
+        return 0
+
+    with open(environ["CHARMING_BENCH_MODEL"]) as f:
+        model = json.load(f)
+    relations = model["relations"]
+
+    if tool == "relation-ids":
+        result = sorted(relations.get(args[0], {})) if args else []
+    elif tool == "relation-list":
+        relation_id = _option(args, "-r") or environ["JUJU_RELATION_ID"]
+        units = relations[_relation_type(relation_id)][relation_id]
+        result = sorted(unit for unit in units if unit != model["unit"])
+    elif tool == "relation-get":
+        relation_id = _option(args, "-r") or environ["JUJU_RELATION_ID"]
+        attribute = args[0] if args else "-"
+        unit = args[1] if len(args) > 1 else environ["JUJU_REMOTE_UNIT"]
+        units = relations[_relation_type(relation_id)][relation_id]
+        if unit not in units:
+            return 2
+        result = units[unit]
+        if attribute != "-":
+            result = result.get(attribute)
+    elif tool == "config-get":
+        result = model["config"]
+        if args:
+            result = result.get(args[0])
+    elif tool == "unit-get":
+        result = model["addresses"].get(args[0])
+    else:
+        sys.stderr.write("{}: not supported\n".format(tool))
+        return 1
+    json.dump(result, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
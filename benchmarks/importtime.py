@@ -0,0 +1,78 @@
+"""Measure the cold import time of charming modules.
+
+Usage::
+
+    python -m benchmarks.importtime --module charming.juju.hooks --repeat 10
+
+Every hook runs in a fresh interpreter, so this is paid on every hook. Each
+sample imports the module in a new interpreter run with `python -X
+importtime`, and the median cumulative time is reported along with the
+slowest modules it pulled in.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# The number of slowest imported modules to report.
+TOP_MODULES = 10
+
+
+def parse_importtime(output):
+    """Return a dict of module name to (self, cumulative) microseconds from
+    the stderr of `python -X importtime`."""
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_time), int(cumulative))
+    return times
+
+
+def sample(module):
+    """Import module in a fresh interpreter, return its import times."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stderr=subprocess.PIPE, universal_newlines=True, env=env,
+        check=True)
+    return parse_importtime(process.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="charming.juju.hooks")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    samples = [sample(args.module) for _ in range(args.repeat)]
+    cumulative = sorted(times[args.module][1] for times in samples)
+    self_times = {}
+    for times in samples:
+        for name, (self_time, _) in times.items():
+            self_times.setdefault(name, []).append(self_time)
+    slowest = sorted(
+        ((sorted(values)[len(values) // 2], name)
+         for name, values in self_times.items()), reverse=True)[:TOP_MODULES]
+
+    median = cumulative[len(cumulative) // 2]
+    print("{}: median {:.1f}ms, min {:.1f}ms over {} runs".format(
+        args.module, median / 1000.0, cumulative[0] / 1000.0, args.repeat))
+    for self_time, name in slowest:
+        print("  {:<40} {:7.1f}ms".format(name, self_time / 1000.0))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"module": args.module, "repeat": args.repeat,
+                       "median_us": median, "min_us": cumulative[0],
+                       "modules": len(samples[0]),
+                       "slowest": [[name, us] for us, name in slowest]},
+                      f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
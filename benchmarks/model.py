@@ -0,0 +1,88 @@
+"""Generation of a fake Juju model and of the charm directory it runs in."""
+import json
+import os
+import stat
+import sys
+
+import yaml
+
+TOOLS = ("config-get", "juju-log", "relation-get", "relation-ids",
+         "relation-list", "relation-set", "status-set", "unit-get",
+         "open-port", "close-port")
+
+
+def generate_model(relation_types=2, relation_ids=2, units=20, keys=5,
+                   payload_size=256, config_keys=20):
+    """Return a model with relation_types peer relations, each holding
+    relation_ids relations of units remote units (plus the local unit), each
+    unit setting keys keys of payload_size bytes."""
+    local_unit = "bench/0"
+    relations = {}
+    for type_index in range(relation_types):
+        relation_type = "rel{}".format(type_index)
+        relations[relation_type] = {}
+        for id_index in range(relation_ids):
+            relation_id = "{}:{}".format(relation_type, id_index)
+            service = "remote{}-{}".format(type_index, id_index)
+            members = [local_unit] + [
+                "{}/{}".format(service, unit) for unit in range(units)]
+            relations[relation_type][relation_id] = dict(
+                (unit, dict(("key{}".format(key), "x" * payload_size)
+                            for key in range(keys)))
+                for unit in members)
+            for unit in members:
+                relations[relation_type][relation_id][unit][
+                    "private-address"] = "10.0.0.1"
+    return {
+        "unit": local_unit,
+        "relations": relations,
+        "config": dict(("option{}".format(key), "value{}".format(key))
+                       for key in range(config_keys)),
+        "addresses": {"private-address": "10.0.0.1",
+                      "public-address": "192.0.2.1"},
+    }
+
+
+def install_charm(directory, model):
+    """Write the model, a matching metadata.yaml and the fake hook tools to
+    directory, and return the environment variables of a hook running
+    there."""
+    charm_dir = os.path.join(directory, "charm")
+    tools_dir = os.path.join(directory, "tools")
+    os.makedirs(charm_dir)
+    os.makedirs(tools_dir)
+
+    model_path = os.path.join(directory, "model.json")
+    with open(model_path, "w") as f:
+        json.dump(model, f)
+    metadata = {"name": "bench",
+                "requires": dict((relation_type, {"interface": relation_type})
+                                 for relation_type in model["relations"])}
+    with open(os.path.join(charm_dir, "metadata.yaml"), "w") as f:
+        yaml.safe_dump(metadata, f)
+
+    source = os.path.join(os.path.dirname(__file__), "fake_tool.py")
+    script = os.path.join(tools_dir, "fake-tool")
+    with open(source) as f:
+        body = f.read()
+    with open(script, "w") as f:
+        f.write("#!{}\n".format(sys.executable) + body)
+    os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+    for tool in TOOLS:
+        os.symlink(script, os.path.join(tools_dir, tool))
+
+    relation_type = sorted(model["relations"])[0]
+    relation_id = sorted(model["relations"][relation_type])[0]
+    remote_unit = sorted(
+        unit for unit in model["relations"][relation_type][relation_id]
+        if unit != model["unit"])[0]
+    return {
+        "PATH": tools_dir + os.pathsep + os.environ.get("PATH", ""),
+        "CHARM_DIR": charm_dir,
+        "CHARMING_BENCH_MODEL": model_path,
+        "JUJU_UNIT_NAME": model["unit"],
+        "JUJU_RELATION": relation_type,
+        "JUJU_RELATION_ID": relation_id,
+        "JUJU_REMOTE_UNIT": remote_unit,
+        "JUJU_HOOK_NAME": "{}-relation-changed".format(relation_type),
+    }
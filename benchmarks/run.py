@@ -0,0 +1,216 @@
+"""Time charming against stand-in hook tools.
+
+Usage::
+
+    python -m benchmarks.run --units 50 --output results.json
+    python -m benchmarks.run --units 50 --compare results.json
+
+Every benchmark runs in a fake charm directory, with fake hook tools on PATH
+serving a generated model (see benchmarks.model). Results are written as JSON
+so that runs from different releases can be compared with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.model import generate_model, install_charm
+
+# The format of the results file, bumped on incompatible changes.
+RESULTS_FORMAT = 1
+
+# Benchmarks slower than the baseline by more than this ratio are reported
+# as regressions by --compare.
+REGRESSION_THRESHOLD = 1.2
+
+_benchmarks = []
+
+
+def benchmark(name):
+    """Decorator registering a benchmark function under name.
+
+    The function is called with the model and returns the function to time,
+    so that its setup isn't timed.
+    """
+    def wrapper(function):
+        _benchmarks.append((name, function))
+        return function
+    return wrapper
+
+
+@benchmark("environment.relation_get")
+def bench_relation_get(model):
+    from charming.juju.hookenv import Environment
+    environment = Environment()
+    return lambda: environment.relation_get()
+
+
+@benchmark("environment.get_related_units")
+def bench_get_related_units(model):
+    from charming.juju.hookenv import Environment
+    environment = Environment()
+    return lambda: environment.get_related_units()
+
+
+@benchmark("environment.get_relation_ids")
+def bench_get_relation_ids(model):
+    from charming.juju.hookenv import Environment
+    environment = Environment()
+    return lambda: environment.get_relation_ids()
+
+
+@benchmark("environment.config_get")
+def bench_config_get(model):
+    from charming.juju.hookenv import Environment
+    environment = Environment()
+    return lambda: environment.config_get()
+
+
+@benchmark("hookenv.relations")
+def bench_relations(model):
+    from charming.juju.hookenv import relations
+    return lambda: relations()
+
+
+@benchmark("config.load_save")
+def bench_config_load_save(model):
+    from charming.juju import hookenv
+    from charming.juju.config import Config
+    from charming.juju.hookenv import Environment
+    environment = Environment()
+    Config(environment, model["config"]).save()
+
+    def load_save():
+        config = Config(environment, model["config"])
+        config["counter"] = config.get("counter", 0) + 1
+        config.changed("option0")
+        config.save()
+        del hookenv._atexit[:]
+    return load_save
+
+
+@benchmark("hooks.execute")
+def bench_hooks_execute(model):
+    from charming.juju.hookenv import Environment
+    from charming.juju.hooks import Hooks
+    from charming.juju.log import log
+    from charming.juju.status import status_set
+    hooks = Hooks()
+
+    @hooks.hook(os.environ["JUJU_HOOK_NAME"])
+    def relation_changed():
+        environment = Environment()
+        environment.config_get()
+        for unit in environment.get_related_units():
+            environment.relation_get(unit=unit)
+        environment.relation_set(data={"ready": "true"})
+        log("relation changed")
+        status_set("active", "ready")
+
+    return lambda: hooks.execute([os.environ["JUJU_HOOK_NAME"]])
+
+
+def time_function(function, repeat):
+    """Return the min, median and mean duration of repeat calls of
+    function."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return {"repeat": repeat, "min": durations[0],
+            "median": durations[len(durations) // 2],
+            "mean": sum(durations) / len(durations)}
+
+
+def run_benchmarks(parameters, repeat, selected=None):
+    """Run the benchmarks against a model built from parameters, and return
+    the results."""
+    model = generate_model(**parameters)
+    directory = tempfile.mkdtemp(prefix="charming-bench-")
+    saved_environ = os.environ.copy()
+    results = {}
+    try:
+        os.environ.update(install_charm(directory, model))
+        for name, setup in _benchmarks:
+            if selected and name not in selected:
+                continue
+            results[name] = time_function(setup(model), repeat)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        shutil.rmtree(directory)
+    return {
+        "format": RESULTS_FORMAT,
+        "python": platform.python_version(),
+        "parameters": parameters,
+        "results": results,
+    }
+
+
+def compare(results, baseline):
+    """Return (name, baseline median, median, ratio) tuples for the
+    benchmarks present in both results."""
+    if baseline.get("parameters") != results["parameters"]:
+        sys.stderr.write("warning: comparing runs with different "
+                         "parameters\n")
+    rows = []
+    for name, result in sorted(results["results"].items()):
+        previous = baseline["results"].get(name)
+        if previous:
+            rows.append((name, previous["median"], result["median"],
+                         result["median"] / previous["median"]))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--relation-types", type=int, default=2)
+    parser.add_argument("--relation-ids", type=int, default=2,
+                        help="relation IDs per relation type")
+    parser.add_argument("--units", type=int, default=20,
+                        help="remote units per relation ID")
+    parser.add_argument("--keys", type=int, default=5,
+                        help="relation keys set by each unit")
+    parser.add_argument("--payload-size", type=int, default=256,
+                        help="size of each relation value, in bytes")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--benchmark", action="append",
+                        help="only run this benchmark (can be repeated)")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="compare with this results file")
+    args = parser.parse_args(argv)
+
+    parameters = {"relation_types": args.relation_types,
+                  "relation_ids": args.relation_ids, "units": args.units,
+                  "keys": args.keys, "payload_size": args.payload_size}
+    results = run_benchmarks(parameters, args.repeat, args.benchmark)
+    for name, result in sorted(results["results"].items()):
+        print("{:<32} median {:9.4f}s  min {:9.4f}s  mean {:9.4f}s".format(
+            name, result["median"], result["min"], result["mean"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    regressions = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("")
+        for name, before, after, ratio in compare(results, baseline):
+            flag = ""
+            if ratio > REGRESSION_THRESHOLD:
+                flag = "  REGRESSION"
+                regressions += 1
+            print("{:<32} {:9.4f}s -> {:9.4f}s  x{:.2f}{}".format(
+                name, before, after, ratio, flag))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
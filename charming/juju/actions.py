@@ -1,30 +1,67 @@
 import json
 import os
-import subprocess
+import time
 
-def action_get(key=None):
+from charming.juju.execute import execute_command
+from charming.juju.hookenv import atexit, atfailure
+
+# The maximum size, in bytes, of a single action-set argument. Larger values
+# are split over several keys. Linux refuses arguments above 128KiB.
+MAX_VALUE_BYTES = 32 * 1024
+
+# The maximum size, in bytes, of the arguments of a single action-set call.
+MAX_ARGV_BYTES = 96 * 1024
+
+
+def _utf8_chunks(value, size):
+    """Split value in chunks of at most size bytes once encoded in UTF-8,
+    without splitting multi-byte characters."""
+    data = value.encode("utf-8")
+    chunks = []
+    start = 0
+    while start < len(data):
+        end = min(start + size, len(data))
+        # UTF-8 continuation bytes look like 0b10xxxxxx.
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        if end == start:
+            # A single character bigger than size: send it whole.
+            end = start + 1
+            while end < len(data) and data[end] & 0xC0 == 0x80:
+                end += 1
+        chunks.append(data[start:end].decode("utf-8"))
+        start = end
+    return chunks
+
+
+def action_get(key=None, command_runner=execute_command):
     """Gets the value of an action parameter, or all key/value param pairs"""
     cmd = ['action-get']
     if key is not None:
         cmd.append(key)
     cmd.append('--format=json')
-    action_data = json.loads(subprocess.check_output(cmd).decode('UTF-8'))
+    action_data = json.loads(command_runner(cmd))
     return action_data
 
 
-def action_set(values):
+def action_set(values, command_runner=execute_command):
     """Sets the values to be returned after the action finishes"""
     cmd = ['action-set']
     for k, v in list(values.items()):
         cmd.append('{}={}'.format(k, v))
-    subprocess.check_call(cmd)
+    command_runner(cmd)
 
 
-def action_fail(message):
+def action_fail(message, command_runner=execute_command):
     """Sets the action status to failed and sets the error message.
 
     The results set by action_set are preserved."""
-    subprocess.check_call(['action-fail', message])
+    command_runner(['action-fail', message])
+
+
+def action_log(message, command_runner=execute_command):
+    """Send a progress message to the user of the running action."""
+    command_runner(['action-log', message])
 
 
 def action_name():
@@ -40,3 +77,140 @@ def action_uuid():
 def action_tag():
     """Get the tag for the currently executing action."""
     return os.environ.get('JUJU_ACTION_TAG')
+
+
+def flatten(values, prefix=""):
+    """Flatten nested dicts into a single dict with Juju's dotted keys.
+
+    For instance {"backup": {"size": 3}} becomes {"backup.size": 3}.
+    """
+    flat = {}
+    for key, value in values.items():
+        key = prefix + str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, key + "."))
+        else:
+            flat[key] = value
+    return flat
+
+
+class ActionResults(object):
+    """Accumulates the results of an action and sets them once, at the end of
+    the hook (including when it fails, so that partial results are kept).
+
+    Nested dicts are flattened to dotted keys. The results are spread over as
+    few action-set calls as the argument size limits allow, and a value
+    larger than max_value_bytes is split over the numbered keys
+    "<key>.0", "<key>.1", ... in order.
+
+    Example::
+
+        results = ActionResults()
+        results.set("backup", {"path": path, "size": size})
+        results.set("manifest", manifest_text)
+        # At the end of the hook: action-set backup.path=... backup.size=...
+        # manifest=...
+
+    @param command_runner: The function to run action-set with.
+    @param max_value_bytes: The size above which a value is chunked.
+    @param max_argv_bytes: The maximum size of the arguments of a single
+        action-set call.
+    """
+
+    def __init__(self, command_runner=execute_command,
+                 max_value_bytes=MAX_VALUE_BYTES,
+                 max_argv_bytes=MAX_ARGV_BYTES):
+        self.command_runner = command_runner
+        self.max_value_bytes = max_value_bytes
+        self.max_argv_bytes = max_argv_bytes
+        self.values = {}
+        self._scheduled = False
+
+    def set(self, key, value):
+        """Record a result. A dict value sets all its (nested) keys."""
+        if isinstance(value, dict):
+            self.update(value, prefix=key)
+        else:
+            self.update({key: value})
+
+    def update(self, values, prefix=None):
+        """Record several results at once, optionally under a common key."""
+        self.values.update(flatten(values, prefix + "." if prefix else ""))
+        if not self._scheduled:
+            atexit(self.flush)
+            atfailure(self.flush)
+            self._scheduled = True
+
+    def _arguments(self):
+        """Return the "key=value" arguments to pass to action-set."""
+        arguments = []
+        for key, value in sorted(self.values.items()):
+            value = str(value)
+            size = self.max_value_bytes
+            if len(value.encode("utf-8")) <= size:
+                arguments.append("{}={}".format(key, value))
+                continue
+            for index, chunk in enumerate(_utf8_chunks(value, size)):
+                arguments.append("{}.{}={}".format(key, index, chunk))
+        return arguments
+
+    def flush(self):
+        """Set the accumulated results, with as few action-set calls as
+        possible."""
+        arguments = self._arguments()
+        self.values = {}
+        batch = []
+        batch_size = 0
+        for argument in arguments:
+            size = len(argument.encode("utf-8")) + 1
+            if batch and batch_size + size > self.max_argv_bytes:
+                self.command_runner(['action-set'] + batch)
+                batch, batch_size = [], 0
+            batch.append(argument)
+            batch_size += size
+        if batch:
+            self.command_runner(['action-set'] + batch)
+
+
+class ActionProgress(object):
+    """Reports the progress of a long running action with action-log, at
+    most once every interval seconds.
+
+    Example::
+
+        progress = ActionProgress()
+        for index, table in enumerate(tables):
+            progress.report("Dumping " + table, index, len(tables))
+            dump(table)
+
+    @param command_runner: The function to run action-log with.
+    @param interval: The minimum time, in seconds, between two messages.
+    """
+
+    def __init__(self, command_runner=execute_command, interval=5.0):
+        self.command_runner = command_runner
+        self.interval = interval
+        self._last_report = None
+
+    def report(self, message, done=None, total=None, force=False):
+        """Send message to the user, unless the previous message was sent
+        less than interval seconds ago.
+
+        @param done: The number of steps done so far, if known.
+        @param total: The total number of steps, shown along with done.
+        @param force: Send the message regardless of the previous one.
+        @returns True if the message was sent.
+        """
+        now = time.time()
+        if (not force and self._last_report is not None and
+                now - self._last_report < self.interval):
+            return False
+        self._last_report = now
+        if done is not None:
+            if total:
+                message = "{} ({}/{}, {:.0%})".format(
+                    message, done, total, float(done) / total)
+            else:
+                message = "{} ({})".format(message, done)
+        action_log(message, command_runner=self.command_runner)
+        return True
@@ -0,0 +1,419 @@
+"""asyncio flavoured access to the juju environment.
+
+AsyncEnvironment mirrors the Environment API, but its hook tool methods are
+coroutines, so independent queries can run concurrently::
+
+    env = AsyncEnvironment()
+    public, private, units = await asyncio.gather(
+        env.unit_get("public-address"),
+        env.unit_get("private-address"),
+        env.get_related_units("db:1"))
+
+The rest of the Environment API (changed_units(), get_relation(), flush()...)
+is served synchronously by the Environment it wraps, available as
+AsyncEnvironment.sync for functions expecting an Environment.
+"""
+import asyncio
+import functools
+import json
+import os
+import time
+from subprocess import CalledProcessError, PIPE
+
+from charming.juju.execute import execute_command
+from charming.juju.hookenv import (
+    Environment, _is_missing_relation_data)
+from charming.juju.replay import wrap_runner
+from charming.juju.trace import traced
+
+# The default maximum number of hook tools running at the same time.
+DEFAULT_CONCURRENCY = 16
+
+
+async def async_execute_command(command):
+    """Execute a command without blocking the event loop, and return its
+    output. Raises CalledProcessError if it exits with a non-zero status."""
+    process = await asyncio.create_subprocess_exec(*command, stdout=PIPE)
+    stdout, _ = await process.communicate()
+    output = stdout.decode("utf-8")
+    if process.returncode:
+        raise CalledProcessError(process.returncode, command, output=output)
+    return output
+
+
+def trace_coroutine(tracer, command_runner):
+    """Return a coroutine function recording the calls to command_runner, a
+    coroutine function, in tracer (see CallTracer.wrap)."""
+    from charming.juju.trace import _status, _traced_runners
+
+    async def traced_runner(command):
+        start = time.time()
+        output = None
+        status = -1
+        try:
+            output = await command_runner(command)
+            status = 0
+            return output
+        except Exception as e:
+            status = _status(e)
+            raise
+        finally:
+            tracer.record(command, time.time() - start, output, status)
+    _traced_runners.add(traced_runner)
+    return traced_runner
+
+
+def record_coroutine(recorder):
+    """Return a coroutine function writing the calls to the command runner
+    of recorder, a RecordingRunner, to its transcript."""
+    from charming.juju.replay import _entry, _recorded_runners
+
+    async def recording_runner(command):
+        entry = _entry(command)
+        start = time.time()
+        try:
+            output = await recorder.command_runner(command)
+            entry["stdout"] = output
+            return output
+        except Exception as e:
+            recorder._failed(entry, e)
+            raise
+        finally:
+            entry["duration"] = round(time.time() - start, 6)
+            recorder.transcript.write(entry)
+    _recorded_runners.add(recording_runner)
+    return recording_runner
+
+
+async def execute_hooks(hooks, args):
+    """Execute the handlers hooks registered for the hook named by args[0],
+    one after the other, from within a running event loop.
+
+    Handlers run in the same order, and errors are reported the same way, as
+    with Hooks.execute().
+    """
+    from charming.juju.hooks import _hook_completion, _raise_errors
+    with _hook_completion():
+        handlers = hooks._start(args)
+        if len(handlers) == 1:
+            result = handlers[0].function()
+            if hasattr(result, "__await__"):
+                await result
+            return
+        _raise_errors(await _run_handlers(handlers))
+
+
+async def _run_handlers(handlers):
+    """Run handlers one after the other, in dependency order, awaiting the
+    coroutine functions. Like hooks._run_handlers(), handlers depending on a
+    failed handler are not run.
+
+    @returns A list of (handler name, exception) pairs for the handlers that
+        failed, in registration order.
+    """
+    from charming.juju.hooks import _failed, _order
+    errors = {}
+    failed = set()
+    for handler in _order(handlers):
+        if any(name in failed for name in handler.after):
+            failed.add(handler.name)
+            continue
+        try:
+            result = handler.function()
+            if hasattr(result, "__await__"):
+                await result
+        except (Exception, SystemExit) as error:
+            if _failed(error):
+                errors[handler] = error
+                failed.add(handler.name)
+    return [(handler.name, errors[handler])
+            for handler in handlers if handler in errors]
+
+
+def run(coroutine):
+    """Run coroutine to completion in a new event loop, and return its
+    result."""
+    return asyncio.run(coroutine)
+
+
+def blocking(coroutine_function):
+    """Return a regular command runner running coroutine_function to
+    completion, in a new event loop."""
+    def blocking_runner(command):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine_function(command))
+        # An event loop already runs in this thread: block it, the way
+        # regular command runners do, while another thread runs the command.
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(
+                asyncio.run, coroutine_function(command)).result()
+    return blocking_runner
+
+
+class AsyncEnvironment(object):
+    """
+    The juju environment available to the charm hook, with coroutines for
+    every method running a hook tool.
+
+    Other attributes are looked up on the wrapped Environment. The coroutines
+    read through its hook tool cache, use its relation index once it is
+    built, and go through its relation write buffer.
+
+    @param command_runner: A coroutine function running a command and
+        returning its output, or a regular command runner (for instance a
+        SocketCommandRunner), which is then run in a worker thread.
+    @param concurrency: The maximum number of hook tools running at the same
+        time.
+    @param kwargs: The other parameters of the wrapped Environment.
+    """
+
+    def __init__(self, environment_dict=os.environ,
+                 command_runner=async_execute_command,
+                 concurrency=DEFAULT_CONCURRENCY, **kwargs):
+        if command_runner is async_execute_command:
+            sync_command_runner = execute_command
+        elif asyncio.iscoroutinefunction(command_runner):
+            sync_command_runner = blocking(command_runner)
+        else:
+            sync_command_runner = command_runner
+        self.sync = Environment(
+            environment_dict, command_runner=sync_command_runner, **kwargs)
+        if sync_command_runner is command_runner:
+            self.async_command_runner = self.sync.command_runner
+        else:
+            self.async_command_runner = traced(wrap_runner(
+                command_runner, self.sync.environment))
+        self.concurrency = concurrency
+        self._semaphore = None
+
+    def __getattr__(self, name):
+        if name == "sync":
+            raise AttributeError(name)
+        return getattr(self.sync, name)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__ or name in (
+                "sync", "async_command_runner", "concurrency", "_semaphore"):
+            object.__setattr__(self, name, value)
+        else:
+            # For instance the metadata, or the capabilities.
+            setattr(self.sync, name, value)
+
+    async def _query(self, cmd, tags=()):
+        """Run a read-only hook tool command, going through the cache of the
+        wrapped Environment if caching is enabled."""
+        cache = self.sync.cache
+        if cache is None:
+            return await self._run(cmd)
+        found, result = cache.lookup(cmd)
+        if found:
+            return result
+        result = await self._run(cmd)
+        cache.store(cmd, result, tags)
+        return result
+
+    async def _run(self, cmd):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            if asyncio.iscoroutinefunction(self.async_command_runner):
+                return await self.async_command_runner(cmd)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, functools.partial(self.async_command_runner, cmd))
+
+    async def unit_get(self, attribute):
+        """Get the passed unit's attribute.
+
+        @param attribute: The Attribute to get for the current unit."""
+        cmd = ['unit-get', '--format=json', attribute]
+        try:
+            return json.loads(await self._query(cmd))
+        except ValueError:
+            return None
+
+    async def get_remote_service_name(self, relation_id):
+        """
+        Return the remote's service name for a given relation ID, or None for
+        invalid relation ids.
+        """
+        index = self.sync._relation_index
+        if index is not None and relation_id in index.services:
+            return index.services[relation_id]
+        units = await self.get_related_units(relation_id)
+        if not units:
+            return None
+        return units[0].split('/')[0]  # The name of the service.
+
+    async def get_relation_id(self, relation_name, service_or_unit):
+        """
+        Return the relation ID for the given relation name and service.
+
+        The remote services of all the candidate relation IDs are looked up
+        concurrently.
+        """
+        service_name = service_or_unit.split('/')[0]
+        relids = await self.get_relation_ids(relation_name)
+        services = await asyncio.gather(
+            *[self.get_remote_service_name(relid) for relid in relids])
+        for relid, remote_service in zip(relids, services):
+            if remote_service == service_name:
+                return relid
+        return None  # Relation ID was not found.
+
+    async def relation_get(self, attribute=None, unit=None, relation_id=None):
+        """Get the key-value information the other unit has set on the
+        selected relation, or None if it has not yet done so.
+
+        See Environment.relation_get for the parameters.
+        """
+        result = await self._relation_get_raw(attribute, unit, relation_id)
+        codec = self.sync.codec
+        if codec is None or result is None:
+            return result
+        if attribute is None:
+            return codec.decode(result)
+        if codec.is_chunked(result):
+            settings = await self.relation_get(
+                unit=unit, relation_id=relation_id)
+            return (settings or {}).get(attribute)
+        return codec.decode_value(result)
+
+    async def _relation_get_raw(self, attribute, unit, relation_id):
+        cmd = self._relation_get_command(attribute, unit, relation_id)
+        try:
+            return json.loads(await self._query(
+                cmd, tags=(self._relation_tag(relation_id),)))
+        except ValueError:
+            return None
+        except CalledProcessError as e:
+            if _is_missing_relation_data(e):
+                return None
+            raise
+
+    async def _codec_supported(self, relation_id):
+        """Did every remote unit on relation_id advertise the relation
+        codec?"""
+        from charming.juju.codec import CODEC_KEY, supported_by
+        units = await self.get_related_units(relation_id)
+        return supported_by([
+            await self._relation_get_raw(CODEC_KEY, unit, relation_id)
+            for unit in units])
+
+    async def relation_set(self, relation_id=None, data=None, **kwargs):
+        """Set relation information for the current unit.
+
+        See Environment.relation_set for the parameters.
+        """
+        relation_data = dict(data or {})
+        relation_data.update(kwargs)
+        if self.sync._pending_writes is not None:
+            # Buffered writes only run hook tools when flushed.
+            self.sync.relation_set(relation_id, relation_data)
+            return
+        if self.sync.codec is not None:
+            current = await self._relation_get_raw(
+                None, self.get_local_unit_name(), relation_id)
+            relation_data = self.sync.codec.encode(
+                relation_data, current,
+                await self._codec_supported(relation_id))
+        self._forget_relation(relation_id)
+        loop = asyncio.get_running_loop()
+        accepts_file = await loop.run_in_executor(
+            None, self.capabilities.has, "relation-set-file")
+        cmd, settings_path = self._relation_set_command(
+            relation_id, relation_data, accepts_file)
+        try:
+            await self._run(cmd)
+        finally:
+            if settings_path is not None:
+                os.remove(settings_path)
+
+    async def relation_clear(self, relation_id):
+        """Clears any relation data already set on relation "relation_id",
+        except for the "public-address" and "private-address" fields."""
+        data = await self.relation_get(
+            relation_id=relation_id, unit=self.get_local_unit_name())
+        for entry in data or {}:
+            if entry not in ['public-address', 'private-address']:
+                data[entry] = None
+        await self.relation_set(relation_id=relation_id, data=data)
+
+    async def get_relation_ids(self, relation_type=None):
+        """A list of relation_ids."""
+        relation_type = relation_type or self.get_relation_type()
+        if relation_type is None:
+            return []
+        index = self.sync._relation_index
+        if index is not None and relation_type in index.relation_ids:
+            return list(index.relation_ids[relation_type])
+        result = await self._query(
+            ['relation-ids', '--format=json', relation_type])
+        return json.loads(result or "[]")
+
+    async def get_related_units(self, relation_id=None):
+        """Get a list of unit names related to the caller.
+
+        @param relation_id: If specified, filter the returned list of units and
+            return only units from the given relation ID."""
+        relation_id = relation_id or self.get_current_relation_id()
+        index = self.sync._relation_index
+        if index is not None and relation_id in index.units:
+            return list(index.units[relation_id])
+        cmd = ['relation-list', '--format=json']
+        if relation_id is not None:
+            cmd.extend(('-r', relation_id))
+        return json.loads(await self._query(cmd)) or []
+
+    async def config_get(self, scope=None):
+        """Get the charm configuration, or a single option of it."""
+        cmd = ['config-get']
+        if scope is not None:
+            cmd.append(scope)
+        cmd.append('--format=json')
+        try:
+            return json.loads(await self._query(cmd))
+        except ValueError:
+            return None
+
+    async def is_leader(self):
+        """Does the current unit hold the juju leadership"""
+        return json.loads(await self._run(['is-leader', '--format=json']))
+
+    async def leader_get(self, attribute=None):
+        """Juju leader get value(s)"""
+        cmd = ['leader-get', '--format=json', attribute or '-']
+        return json.loads(await self._run(cmd))
+
+    async def snapshot_relations(self):
+        """Get the relation data of every unit on every relation, as a nested
+        dict of relation type to relation ID to unit name to relation data.
+
+        All the queries of a stage run concurrently, within the concurrency
+        limit.
+        """
+        local_unit = self.get_local_unit_name()
+        relation_types = self.get_relation_types()
+        relation_ids = await asyncio.gather(
+            *[self.get_relation_ids(reltype) for reltype in relation_types])
+        pairs = [(reltype, relid)
+                 for reltype, relids in zip(relation_types, relation_ids)
+                 for relid in relids]
+        remote_units = await asyncio.gather(
+            *[self.get_related_units(relid) for _, relid in pairs])
+        queries = [(reltype, relid, unit)
+                   for (reltype, relid), units in zip(pairs, remote_units)
+                   for unit in [local_unit] + list(units)]
+        results = await asyncio.gather(
+            *[self.relation_get(unit=unit, relation_id=relid)
+              for _, relid, unit in queries])
+
+        relations = dict((reltype, {}) for reltype in relation_types)
+        for reltype, relid in pairs:
+            relations[reltype][relid] = {}
+        for (reltype, relid, unit), data in zip(queries, results):
+            relations[reltype][relid][unit] = data
+        return relations
@@ -0,0 +1,73 @@
+class CommandCache(object):
+    """A memoizing cache for the output of read-only hook tools.
+
+    Results are keyed on the full command line, so two identical queries made
+    during the same hook only fork a hook tool once. Entries can be tagged
+    (for instance with the relation ID they read from) so that writes can
+    invalidate exactly the entries they make stale.
+
+    The cache is meant to live for the duration of a single hook: the
+    Environment holding it is recreated by every hook process.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._tagged = {}
+        import threading
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, command, command_runner, tags=()):
+        """Return the output of command, running it only on a cache miss.
+
+        @param command: The command line to run, as a list.
+        @param command_runner: The function used to run the command when its
+            result is not cached yet.
+        @param tags: Hashable labels to attach to the cached entry, for later
+            use with invalidate().
+        """
+        found, result = self.lookup(command)
+        if found:
+            return result
+        # Errors propagate to the caller and are never cached.
+        result = command_runner(command)
+        self.store(command, result, tags)
+        return result
+
+    def lookup(self, command):
+        """Return a (found, output) tuple for command, counting a hit or a
+        miss. For callers running the command themselves, see store()."""
+        key = tuple(command)
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                return True, self._results[key]
+            self.misses += 1
+        return False, None
+
+    def store(self, command, result, tags=()):
+        """Cache the output of command, see fetch() for the tags."""
+        key = tuple(command)
+        with self._lock:
+            self._results[key] = result
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+
+    def invalidate(self, tag):
+        """Drop every cached entry carrying the given tag."""
+        with self._lock:
+            for key in self._tagged.pop(tag, ()):
+                self._results.pop(key, None)
+
+    def clear(self):
+        """Drop every cached entry. The counters are left untouched."""
+        with self._lock:
+            self._results.clear()
+            self._tagged.clear()
+
+    def stats(self):
+        """Return a dict with the hit and miss counters and the cache size."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._results)}
@@ -0,0 +1,113 @@
+"""A registry of hook tool features, probed once per Juju version.
+
+Finding out whether the running Juju supports a feature usually means
+forking a tool (for instance `relation-set --help`). Capabilities runs each
+probe once and remembers the result in the charm directory, keyed by the
+Juju version, so later hooks don't fork any probe at all.
+"""
+import os
+
+from charming.juju.statefile import load_json, write_json_atomic
+
+CAPABILITIES_FILE_NAME = '.juju-capabilities'
+
+JUJUD_GLOB = '/var/lib/juju/tools/machine-*/jujud'
+
+_probes = {}
+
+
+def probe(name):
+    """Decorator registering a function as the probe for a capability.
+
+    The function is called with a command runner and must return a value that
+    can be serialized to JSON, usually a boolean.
+    """
+    def wrapper(function):
+        _probes[name] = function
+        return function
+    return wrapper
+
+
+@probe("relation-set-file")
+def relation_set_accepts_file(command_runner):
+    """relation-set --file was introduced in Juju 1.23.2."""
+    return "--file" in command_runner(["relation-set", "--help"])
+
+
+class Capabilities(object):
+    """The capabilities of the Juju running the current hook.
+
+    @param charm_dir: The directory to persist probe results in, or None to
+        keep them in memory only.
+    @param command_runner: The function used to run the probes.
+    @param environment_dict: The hook environment.
+    """
+
+    def __init__(self, charm_dir, command_runner, environment_dict=os.environ):
+        self.path = None
+        if charm_dir:
+            self.path = os.path.join(charm_dir, CAPABILITIES_FILE_NAME)
+        self.command_runner = command_runner
+        self.environment = environment_dict
+        self._state = None
+
+    def _jujud(self):
+        import glob
+        paths = glob.glob(JUJUD_GLOB)
+        return paths[0] if paths else None
+
+    def _cache_key(self):
+        """Identify the running Juju without forking anything."""
+        version = self.environment.get("JUJU_VERSION")
+        if version:
+            return "version:{}".format(version)
+        jujud = self._jujud()
+        if jujud is None:
+            return None
+        stat = os.stat(jujud)
+        return "jujud:{}:{}:{}".format(jujud, stat.st_mtime, stat.st_size)
+
+    def _load(self):
+        if self._state is None:
+            key = self._cache_key()
+            state = None
+            if self.path is not None:
+                state = load_json(self.path)
+            if not state or state.get("key") != key:
+                state = {"key": key, "features": {}}
+            self._state = state
+        return self._state
+
+    def _save(self):
+        if self.path is None or self._state["key"] is None:
+            return
+        try:
+            write_json_atomic(self.path, self._state)
+        except (IOError, OSError):
+            pass  # Not being able to cache a probe result isn't fatal.
+
+    def juju_version(self):
+        """Full version string (eg. '1.23.3.1-trusty-amd64')"""
+        version = self.environment.get("JUJU_VERSION")
+        if version:
+            return version
+        state = self._load()
+        if "version" not in state:
+            jujud = self._jujud()
+            if jujud is None:
+                raise OSError("jujud not found in {}".format(JUJUD_GLOB))
+            import subprocess
+            # Per https://bugs.launchpad.net/juju-core/+bug/1455368/comments/1
+            state["version"] = subprocess.check_output(
+                [jujud, 'version'], universal_newlines=True).strip()
+            self._save()
+        return state["version"]
+
+    def has(self, name):
+        """Return the result of the probe registered under name, running it
+        only if it wasn't run before for this Juju version."""
+        features = self._load()["features"]
+        if name not in features:
+            features[name] = _probes[name](self.command_runner)
+            self._save()
+        return features[name]
@@ -0,0 +1,149 @@
+"""Declared hook handler inputs, and tracking of their changes across hooks.
+
+A handler can declare the inputs it depends on: config keys, relation data
+or leader settings. The dispatcher then only runs it when the content of one
+of its inputs changed since its last successful run::
+
+    @hooks.hook("config-changed", inputs=[ConfigInput("port", "vhost")])
+    def render_site():
+        ...
+"""
+import hashlib
+import json
+import os
+
+from charming.juju.statefile import load_json, write_json_atomic
+
+INPUTS_FILE_NAME = ".charming-handler-inputs"
+RELATION_DIGESTS_FILE_NAME = ".charming-relation-digests"
+
+
+class ConfigInput(object):
+    """The values of some config keys (all keys if none are given)."""
+
+    def __init__(self, *keys):
+        self.keys = sorted(keys)
+        self.name = "config:" + ",".join(self.keys)
+
+    def read(self, environment):
+        config = environment.config_get() or {}
+        if not self.keys:
+            return config
+        return dict((key, config.get(key)) for key in self.keys)
+
+
+class RelationInput(object):
+    """The data remote units set on every relation of a relation type,
+    restricted to some keys if any are given."""
+
+    def __init__(self, relation_name, *keys):
+        self.relation_name = relation_name
+        self.keys = sorted(keys)
+        self.name = "relation:{}:{}".format(relation_name, ",".join(self.keys))
+
+    def read(self, environment):
+        # Only query the relations of this type, not every relation of the
+        # charm.
+        value = {}
+        for relation_id in environment.get_relation_ids(self.relation_name):
+            value[relation_id] = {}
+            for unit in environment.get_related_units(relation_id):
+                data = dict(environment.relation_get(
+                    unit=unit, relation_id=relation_id) or {})
+                if self.keys:
+                    data = dict((key, data.get(key)) for key in self.keys)
+                value[relation_id][unit] = data
+        return value
+
+
+class LeaderInput(object):
+    """The leader settings, restricted to some keys if any are given."""
+
+    def __init__(self, *keys):
+        self.keys = sorted(keys)
+        self.name = "leader:" + ",".join(self.keys)
+
+    def read(self, environment):
+        settings = json.loads(environment.command_runner(
+            ['leader-get', '--format=json', '-'])) or {}
+        if not self.keys:
+            return settings
+        return dict((key, settings.get(key)) for key in self.keys)
+
+
+def digest(value):
+    """Return a content hash of a JSON serializable value."""
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def handler_id(function):
+    """Return the name handler digests are recorded under."""
+    return "{}.{}".format(function.__module__, getattr(
+        function, "__qualname__", function.__name__))
+
+
+class InputTracker(object):
+    """Compares the inputs of handlers with the digests recorded after their
+    last successful run.
+
+    New digests are only recorded by commit(), which the hooks framework
+    runs at the end of a successful hook. Without a charm directory to keep
+    them in, nothing is recorded and every handler runs.
+    """
+
+    def __init__(self, environment):
+        self.environment = environment
+        charm_dir = environment.get_charm_dir()
+        self.path = (
+            os.path.join(charm_dir, INPUTS_FILE_NAME) if charm_dir else None)
+        self._recorded = load_json(self.path, {}) if self.path else {}
+        self._pending = {}
+
+    def changed(self, name, inputs):
+        """Return True if any of the inputs changed since the handler
+        recorded under name last ran successfully (or if it never did)."""
+        digests = dict((handler_input.name,
+                        digest(handler_input.read(self.environment)))
+                       for handler_input in inputs)
+        self._pending[name] = digests
+        return self._recorded.get(name) != digests
+
+    def commit(self):
+        """Record the digests of the inputs seen by this hook."""
+        if not self._pending or self.path is None:
+            return
+        self._recorded.update(self._pending)
+        self._pending = {}
+        write_json_atomic(self.path, self._recorded)
+
+
+class RelationDigests(object):
+    """Digests of the data remote units set on relations, as recorded at the
+    end of the last successful hook.
+
+    @param path: The file to persist the digests in, or None to keep them in
+        memory only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._recorded = load_json(path, {}) if path else {}
+        self.observed = {}
+
+    def recorded(self, relation_id):
+        """Return the recorded {unit: digest} of relation_id."""
+        return self._recorded.get(relation_id, {})
+
+    def observe(self, relation_id, digests):
+        """Remember the {unit: digest} of relation_id seen by this hook."""
+        self.observed[relation_id] = digests
+
+    def commit(self):
+        """Record the digests observed by this hook."""
+        if not self.observed:
+            return
+        self._recorded.update(self.observed)
+        self.observed = {}
+        if self.path:
+            write_json_atomic(self.path, self._recorded)
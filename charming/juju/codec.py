@@ -0,0 +1,166 @@
+"""Compression and chunking of large relation values.
+
+Values above a size threshold are compressed and base64-encoded, and the
+encoded values too large for a single key are split over chunk keys. Every
+encoded value starts with a marker carrying a format version, so that:
+
+    - plain values set by units not using the codec are read as they are;
+    - values encoded with an unknown (newer) format are left untouched
+      rather than misread.
+
+Both sides of a relation must use the codec to read the encoded values, so
+it is opt-in, see Environment's relation_codec parameter. A unit using the
+codec advertises it by setting the CODEC_KEY key to VERSION on the relations
+it writes to, and only encodes the values it writes to a relation once
+every remote unit on it advertised the codec: until then, values are
+written as they are.
+
+Values that can't be decoded, because they are corrupted or would
+decompress to more than max_size characters, are returned as they are
+stored.
+"""
+import base64
+import binascii
+import zlib
+
+MARKER = "charming-codec:"
+VERSION = "1"
+CODEC_KEY = "charming-codec"
+COMPRESSED = MARKER + VERSION + ":z:"
+CHUNKED = MARKER + VERSION + ":chunks:"
+CHUNK_KEY = "{}.charming-chunk-{}"
+
+
+def chunk_key(key, index):
+    """Return the name of the key holding chunk index of key's value."""
+    return CHUNK_KEY.format(key, index)
+
+
+def is_chunk_key(key):
+    return ".charming-chunk-" in key
+
+
+def _chunk_count(value):
+    """Return the number of chunks a chunked value head announces, or None
+    if value isn't a valid head."""
+    if not isinstance(value, str) or not value.startswith(CHUNKED):
+        return None
+    try:
+        return int(value[len(CHUNKED):])
+    except ValueError:
+        return None
+
+
+def supported_by(advertised):
+    """Can values be encoded for remote units that advertised the given
+    CODEC_KEY values (one per unit, None when not set)?"""
+    return bool(advertised) and all(value == VERSION for value in advertised)
+
+
+class RelationCodec(object):
+    """Encodes and decodes relation settings.
+
+    @param threshold: The size, in characters, above which values are
+        compressed. Values that don't get smaller are stored as they are.
+    @param chunk_size: The maximum size, in characters, of an encoded value
+        stored in a single key.
+    @param max_size: The maximum size, in bytes, a value is decompressed to.
+        Larger values are returned as they are stored.
+    """
+
+    def __init__(self, threshold=1024, chunk_size=64 * 1024,
+                 max_size=16 * 1024 * 1024):
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+
+    def encode_value(self, value):
+        """Return the encoded version of a single string value."""
+        if len(value) <= self.threshold and not value.startswith(MARKER):
+            return value
+        compressed = COMPRESSED + base64.b64encode(
+            zlib.compress(value.encode("utf-8"))).decode("ascii")
+        if len(compressed) >= len(value) and not value.startswith(MARKER):
+            return value
+        return compressed
+
+    def decode_value(self, value):
+        """Return the original version of a single, non chunked, value, or
+        the value itself if it can't be decoded."""
+        if not isinstance(value, str) or not value.startswith(COMPRESSED):
+            return value
+        try:
+            payload = base64.b64decode(value[len(COMPRESSED):])
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(payload, self.max_size)
+            if decompressor.unconsumed_tail:
+                return value
+            return data.decode("utf-8")
+        except (binascii.Error, zlib.error, UnicodeDecodeError):
+            return value
+
+    def is_chunked(self, value):
+        """Is value the head of a value split over chunk keys?"""
+        return isinstance(value, str) and value.startswith(CHUNKED)
+
+    def encode(self, settings, current=None, supported=True):
+        """Return the relation settings to write for settings, advertising
+        the codec if it isn't yet.
+
+        @param settings: The {key: value} to set. A None value unsets the key.
+        @param current: The raw settings currently set on the relation, used
+            to unset the chunk keys that would otherwise be left stale.
+        @param supported: Whether the remote units advertised the codec (see
+            supported_by()). If not, values are written as they are.
+        """
+        current = current or {}
+        encoded = {}
+        if current.get(CODEC_KEY) != VERSION:
+            encoded[CODEC_KEY] = VERSION
+        for key, value in settings.items():
+            previous = current.get(key)
+            old_chunks = _chunk_count(previous) or 0
+            new_chunks = 0
+            if value is None:
+                encoded[key] = None
+            elif not supported:
+                encoded[key] = "{}".format(value)
+            else:
+                value = self.encode_value("{}".format(value))
+                if len(value) > self.chunk_size:
+                    chunks = [value[start:start + self.chunk_size]
+                              for start in range(
+                                  0, len(value), self.chunk_size)]
+                    new_chunks = len(chunks)
+                    encoded[key] = CHUNKED + str(new_chunks)
+                    for index, chunk in enumerate(chunks):
+                        encoded[chunk_key(key, index)] = chunk
+                else:
+                    encoded[key] = value
+            for index in range(new_chunks, old_chunks):
+                encoded[chunk_key(key, index)] = None
+        return encoded
+
+    def decode(self, settings):
+        """Return the original version of raw relation settings, with the
+        chunked values reassembled and the chunk and CODEC_KEY keys left
+        out."""
+        decoded = {}
+        for key, value in settings.items():
+            if is_chunk_key(key) or key == CODEC_KEY:
+                continue
+            if self.is_chunked(value):
+                count = _chunk_count(value)
+                if count is None:
+                    decoded[key] = value
+                    continue
+                chunks = [settings.get(chunk_key(key, index))
+                          for index in range(count)]
+                if None in chunks:
+                    # Partially written or removed; there is nothing
+                    # sensible to return.
+                    value = None
+                else:
+                    value = "".join(chunks)
+            decoded[key] = self.decode_value(value)
+        return decoded
@@ -1,9 +1,58 @@
-import copy
 import json
 import os
-import subprocess
 
-from charming.juju.hookenv import Environment
+import six
+
+from charming.juju.hookenv import Environment, atexit
+from charming.juju.statefile import write_atomic
+
+# The values that can't be changed in place, and so are unchanged as long as
+# the Config holds the object it loaded.
+_IMMUTABLE_TYPES = six.string_types + six.integer_types + (float, type(None))
+
+
+class ConfigChanges(object):
+    """The differences between the config saved by the previous hook and the
+    config of the current one, computed once.
+
+    @param previous: The config saved by the previous hook, or None if there
+        is none.
+    @param current: The config of the current hook.
+    @param config_keys: The keys of previous that config-get returned, as
+        opposed to the values stored by the charm itself. None if unknown,
+        in which case every key of previous is taken as a config key.
+    """
+
+    def __init__(self, previous, current, config_keys=None):
+        self._previous = previous
+        if previous is None:
+            self.added = frozenset(current)
+            self.removed = frozenset()
+            self._changed = self.added
+            return
+        self.added = frozenset(key for key in current if key not in previous)
+        if config_keys is None:
+            config_keys = previous
+        self.removed = frozenset(
+            key for key in config_keys
+            if key in previous and key not in current)
+        self._changed = self.added | frozenset(
+            key for key, value in current.items()
+            if key in previous and previous[key] != value)
+
+    def changed_keys(self):
+        """Return the sorted keys added or whose value changed."""
+        return sorted(self._changed)
+
+    def __contains__(self, key):
+        return key in self._changed
+
+    def previous(self, key):
+        """Return the previous value of key, or None if it had none."""
+        if self._previous is None:
+            return None
+        return self._previous.get(key)
+
 
 class Config(dict):
     """A dictionary representation of the charm's config.yaml, with some
@@ -44,11 +93,18 @@ class Config(dict):
 
     """
     CONFIG_FILE_NAME = '.juju-persistent-config'
+    # The saved entry listing the keys config-get returned, which tells them
+    # apart from the values stored by the charm.
+    CONFIG_KEYS_KEY = '__config_keys__'
 
     def __init__(self, environment=None, *args, **kw):
         super(Config, self).__init__(*args, **kw)
         self.implicit_save = True
         self._prev_dict = None
+        self._saved_text = None
+        self._config_keys = sorted(self)
+        self._loaded = dict(self)
+        self.changes = ConfigChanges(None, self)
         self.environment = environment or Environment()
 
         self.path = os.path.join(
@@ -73,10 +129,18 @@ class Config(dict):
         """
         self.path = path or self.path
         with open(self.path) as f:
-            self._prev_dict = json.load(f)
-        for k, v in copy.deepcopy(self._prev_dict).items():
+            self._saved_text = f.read()
+        self._prev_dict = json.loads(self._saved_text)
+        # Missing from configs saved by older versions.
+        config_keys = self._prev_dict.pop(self.CONFIG_KEYS_KEY, None)
+        self.changes = ConfigChanges(self._prev_dict, self, config_keys)
+        import copy
+        for k, v in self._prev_dict.items():
             if k not in self:
-                self[k] = v
+                # Copied, so that changing the value in place during the hook
+                # leaves the previous value alone.
+                self[k] = copy.deepcopy(v)
+        self._loaded = dict(self)
 
     def changed(self, key):
         """Return True if the current value for this key is different from
@@ -85,16 +149,20 @@ class Config(dict):
         """
         if self._prev_dict is None:
             return True
-        return self.previous(key) != self.get(key)
+        value = self.get(key)
+        if (key in self and key in self._loaded and
+                self._loaded[key] is value and
+                isinstance(value, _IMMUTABLE_TYPES)):
+            # Untouched since loaded: the changes were computed then.
+            return key in self.changes
+        return self.previous(key) != value
 
     def previous(self, key):
         """Return previous value for this key, or None if there
         is no previous value.
 
         """
-        if self._prev_dict:
-            return self._prev_dict.get(key)
-        return None
+        return self.changes.previous(key)
 
     def save(self):
         """Save this config to disk.
@@ -107,28 +175,33 @@ class Config(dict):
         To disable automatic saves, set ``implicit_save=False`` on this
         instance.
 
+        The file is replaced atomically, keeping its mode, and not written at
+        all if its content wouldn't change.
         """
-        with open(self.path, 'w') as f:
-            json.dump(self, f)
+        data = dict(self)
+        data[self.CONFIG_KEYS_KEY] = self._config_keys
+        text = json.dumps(data, sort_keys=True)
+        if text == self._saved_text:
+            return
+        write_atomic(self.path, text)
+        self._saved_text = text
 
     def _implicit_save(self):
         if self.implicit_save:
             self.save()
 
 
-def config(scope=None):
-    """Juju charm configuration"""
-    config_cmd_line = ['config-get']
-    if scope is not None:
-        config_cmd_line.append(scope)
-    config_cmd_line.append('--format=json')
-    try:
-        config_data = json.loads(
-            subprocess.check_output(config_cmd_line).decode('UTF-8'))
-        if scope is not None:
-            return config_data
-        return Config(config_data)
-    except ValueError:
-        return None
+def config(scope=None, environment=None):
+    """Juju charm configuration
+
+    @param scope: If provided, return only the value of this option.
+    @param environment: The Environment to read the configuration from. Pass
+        one with caching enabled to share config-get results within a hook.
+    """
+    environment = environment or Environment()
+    config_data = environment.config_get(scope)
+    if scope is not None or config_data is None:
+        return config_data
+    return Config(environment, config_data)
 
 
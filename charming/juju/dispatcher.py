@@ -0,0 +1,476 @@
+"""A resident, per unit, hook dispatcher.
+
+Starting Python and importing a charm makes up most of the run time of
+short hooks such as update-status. When CHARMING_DISPATCHER is set to "1"
+in the hook environment, Hooks.execute() hands the hook over to a long lived
+dispatcher process instead of running it, starting the dispatcher first if
+needed. Hook entry points can go one step further and skip importing the
+charm altogether::
+
+    #!/usr/bin/env python3
+    from charming.juju.dispatcher import main
+    main("hooks/hooks.py")
+
+The dispatcher imports the charm once. For every hook, it receives the
+argv, environment, working directory and stdio file descriptors of the hook
+process over a Unix socket in the charm directory, and forks a child running
+the hook in that context: nothing a hook does leaks into the next one. The
+exit code of the child is sent back, and becomes the exit code of the hook.
+The child is killed if the hook process goes away.
+
+The dispatcher exits when a module it loaded changed on disk (the next hook
+starts a fresh one), and after being idle for IDLE_TIMEOUT seconds. Whenever
+the dispatcher can't be used, the hook runs in-process as usual.
+
+The charm script must only call Hooks.execute() under an
+``if __name__ == "__main__":`` guard, and must not build Environment objects
+at import time, since the import happens once, in the dispatcher.
+"""
+import json
+import os
+import struct
+import sys
+import time
+
+DISPATCHER_ENV_KEY = "CHARMING_DISPATCHER"
+SOCKET_FILE_NAME = ".charming-dispatcher.sock"
+LOG_FILE_NAME = ".charming-dispatcher.log"
+
+# The time, in seconds, after which an idle dispatcher exits.
+IDLE_TIMEOUT = 3600
+
+# The time, in seconds, to wait for a new dispatcher to accept connections.
+START_TIMEOUT = 10
+
+# The file descriptors forwarded to the dispatcher: stdin, stdout and stderr.
+STDIO = (0, 1, 2)
+
+_HEADER = struct.Struct("!I")
+
+# Set in the dispatcher and its children, where hooks run in-process.
+serving = False
+
+
+class DispatcherError(Exception):
+    """Raised when talking to the dispatcher failed."""
+
+
+def enabled(environment_dict=os.environ):
+    """Should hooks be handed over to the dispatcher?"""
+    return environment_dict.get(DISPATCHER_ENV_KEY) == "1" and not serving
+
+
+def socket_path(charm_dir):
+    return os.path.join(charm_dir, SOCKET_FILE_NAME)
+
+
+def _send_message(sock, message, fds=()):
+    import array
+    import socket
+    data = json.dumps(message).encode("utf-8")
+    data = _HEADER.pack(len(data)) + data
+    ancillary = []
+    if fds:
+        ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                      array.array("i", fds))]
+    sent = sock.sendmsg([data], ancillary)
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def _receive_message(sock, max_fds=0):
+    """Return the message read from sock, and the file descriptors sent
+    along with it."""
+    import array
+    import socket
+    fds = array.array("i")
+    data, ancdata, _, _ = sock.recvmsg(
+        65536, socket.CMSG_SPACE(max_fds * fds.itemsize) if max_fds else 0)
+    for level, kind, payload in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[:len(payload) - (
+                len(payload) % fds.itemsize)])
+    if len(data) < _HEADER.size:
+        raise DispatcherError("Truncated message")
+    size, = _HEADER.unpack(data[:_HEADER.size])
+    data = data[_HEADER.size:]
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise DispatcherError("Truncated message")
+        data += chunk
+    return json.loads(data.decode("utf-8")), list(fds)
+
+
+# Client side
+
+
+def dispatch(args, script=None, environment_dict=os.environ):
+    """Run the hook named by args[0] in the dispatcher of the charm, starting
+    it if needed.
+
+    @param args: The argv of the hook.
+    @param script: The charm script the dispatcher imports. Defaults to the
+        running __main__ module.
+    @returns The exit code of the hook, or None if the dispatcher could not
+        be used and the hook must run in-process. Once the dispatcher accepted
+        the hook, it is never run again: if the dispatcher goes away before
+        replying, the hook fails.
+    """
+    charm_dir = environment_dict.get("CHARM_DIR")
+    if script is None:
+        script = getattr(sys.modules.get("__main__"), "__file__", None)
+    if not charm_dir or not script:
+        return None
+    # Hooks are usually symlinks to the same script.
+    script = os.path.realpath(script)
+    path = socket_path(charm_dir)
+    request = {"argv": list(args), "env": dict(environment_dict),
+               "cwd": os.getcwd(), "script": script}
+    for _ in range(2):
+        try:
+            reply = _request(path, request)
+        except DispatcherError as e:
+            # The hook may have run, or be partly done: running it again
+            # could repeat its side effects.
+            sys.stderr.write("{}\n".format(e))
+            return 1
+        if reply is None or reply.get("restart"):
+            # Not running, or running stale code: start a new dispatcher.
+            if not _start_dispatcher(script, path, environment_dict):
+                return None
+            continue
+        return reply.get("status")
+    return None
+
+
+def _request(path, request):
+    """Send request to the dispatcher listening on path, and return its
+    reply, or None if the dispatcher didn't accept the request.
+
+    @raises DispatcherError: If the dispatcher accepted the request but went
+        away without replying.
+    """
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+            for stream in (sys.stdout, sys.stderr):
+                stream.flush()
+            _send_message(sock, request, STDIO)
+            reply, _ = _receive_message(sock)
+        except (OSError, ValueError, DispatcherError):
+            return None  # Not accepted: the hook didn't run.
+        if not reply.get("accepted"):
+            return reply
+        try:
+            reply, _ = _receive_message(sock)
+        except (OSError, ValueError, DispatcherError):
+            raise DispatcherError(
+                "The hook dispatcher went away while running the hook")
+        return reply
+    finally:
+        sock.close()
+
+
+def _start_dispatcher(script, path, environment_dict):
+    """Start a dispatcher for script listening on path, and wait until it
+    accepts connections. Return False if it didn't in time."""
+    import subprocess
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(environment_dict)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [package_root] + [entry for entry in sys.path if entry])
+    charm_dir = os.path.dirname(path)
+    with open(os.path.join(charm_dir, LOG_FILE_NAME), "a") as log_file:
+        subprocess.Popen(
+            [sys.executable, "-m", "charming.juju.dispatcher", script, path],
+            env=env, cwd=charm_dir, stdin=subprocess.DEVNULL,
+            stdout=log_file, stderr=log_file, start_new_session=True)
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        if _is_listening(path):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _is_listening(path):
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        # An empty request: the dispatcher drops the connection.
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def main(script, args=None):
+    """Entry point of hooks run through the dispatcher, without importing the
+    charm in the hook process.
+
+    @param script: The path of the charm script defining the Hooks, relative
+        to the charm directory.
+    @param args: The argv of the hook, defaults to sys.argv.
+    """
+    args = sys.argv if args is None else args
+    charm_dir = os.environ.get("CHARM_DIR", "")
+    script = os.path.join(charm_dir, script)
+    status = None
+    if enabled():
+        status = dispatch(args, script)
+    if status is None:
+        run_script(script, args)
+        status = 0
+    sys.exit(status)
+
+
+def run_script(script, args):
+    """Run script as the __main__ module, with args as its argv.
+
+    Unlike runpy.run_path(), which sets argv[0] to the script path, this
+    keeps the hook name in argv[0] for Hooks.execute() to read.
+    """
+    sys.argv = list(args)
+    with open(script) as f:
+        code = compile(f.read(), script, "exec")
+    namespace = {"__name__": "__main__", "__file__": script,
+                 "__builtins__": __builtins__}
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    exec(code, namespace)
+
+
+# Dispatcher side
+
+
+def _reset_hook_state():
+    """Forget the process wide state that depends on the hook environment,
+    inherited from the dispatcher, once a child has the environment of its
+    hook."""
+    from charming.juju import execute, replay, trace, unitdata
+    execute._runner = None
+    trace._tracer = None
+    replay._replay_runner = None
+    replay._transcripts.clear()
+    unitdata._storage = None
+
+
+class Dispatcher(object):
+    """Runs the hooks of a charm script in forked children.
+
+    @param script: The path of the charm script defining the Hooks.
+    @param path: The path of the Unix socket to listen on.
+    @param idle_timeout: The time, in seconds, after which the dispatcher
+        exits if no hook ran.
+    """
+
+    def __init__(self, script, path, idle_timeout=IDLE_TIMEOUT):
+        self.script = script
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.hooks = None
+        self._mtimes = {}
+        self._listener = None
+
+    def load(self):
+        """Import the charm script and find its Hooks."""
+        global serving
+        import runpy
+        from charming.juju.hooks import Hooks
+        serving = True
+        sys.path.insert(0, os.path.dirname(self.script))
+        namespace = runpy.run_path(
+            self.script, run_name="__charming_dispatcher__")
+        for value in namespace.values():
+            if isinstance(value, Hooks):
+                self.hooks = value
+                break
+        else:
+            raise DispatcherError("No Hooks found in " + self.script)
+        self._mtimes = self._module_mtimes()
+
+    def _module_mtimes(self):
+        paths = set([self.script])
+        for module in list(sys.modules.values()):
+            path = getattr(module, "__file__", None)
+            if path:
+                paths.add(path)
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                pass
+        return mtimes
+
+    def stale(self):
+        """Did any of the loaded modules change since they were loaded?"""
+        for path, mtime in self._mtimes.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _listen(self):
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self.path)
+        except OSError:
+            if _is_listening(self.path):
+                raise  # Another dispatcher is running.
+            os.remove(self.path)
+            sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        sock.listen(8)
+        sock.settimeout(self.idle_timeout)
+        return sock
+
+    def serve(self):
+        """Run hooks until idle for idle_timeout seconds, or until the charm
+        code changed."""
+        import socket
+        self._listener = self._listen()
+        try:
+            while True:
+                try:
+                    connection, _ = self._listener.accept()
+                except socket.timeout:
+                    return
+                connection.settimeout(None)
+                try:
+                    if not self.handle(connection):
+                        return
+                finally:
+                    connection.close()
+        finally:
+            self._close()
+
+    def _close(self):
+        """Stop listening, so that a new dispatcher can take over."""
+        if self._listener is None:
+            return
+        self._listener.close()
+        self._listener = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def handle(self, connection):
+        """Run the hook requested on connection. Return False if the
+        dispatcher must exit."""
+        try:
+            request, fds = _receive_message(connection, len(STDIO))
+        except (OSError, ValueError, DispatcherError):
+            return True  # A liveness check, or a broken client.
+        try:
+            if self.stale() or request.get("script") != self.script:
+                # Stop listening first: the client starts a new dispatcher
+                # as soon as it gets the reply.
+                self._close()
+                _send_message(connection, {"restart": True})
+                return False
+            try:
+                # From here on, the client never runs the hook itself.
+                _send_message(connection, {"accepted": True})
+            except OSError:
+                return True  # The hook process went away.
+            status = self.run_hook(request, fds, connection)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        try:
+            _send_message(connection, {"status": status})
+        except OSError:
+            pass  # The hook process went away.
+        return True
+
+    def run_hook(self, request, fds, connection=None):
+        """Run a hook in a forked child, and return its exit code.
+
+        @param connection: The connection to the hook process. If it goes
+            away, for instance because Juju killed it, the child is killed
+            too.
+        """
+        import select
+        import signal
+        sys.stdout.flush()
+        sys.stderr.flush()
+        exited, exiting = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(exited)
+                status = self._child(request, fds)
+            finally:
+                os._exit(status)
+        # The read end becomes readable when the child exits.
+        os.close(exiting)
+        watched = [exited]
+        if connection is not None:
+            watched.append(connection)
+        try:
+            while True:
+                readable, _, _ = select.select(watched, [], [], 1.0)
+                if connection in readable:
+                    # The client only sends data before the hook runs:
+                    # this is the end of the connection.
+                    watched.remove(connection)
+                    os.kill(pid, signal.SIGTERM)
+                if exited in readable:
+                    _, wait_status = os.waitpid(pid, 0)
+                    break
+                # Processes the hook forked may keep the pipe open.
+                waited, wait_status = os.waitpid(pid, os.WNOHANG)
+                if waited:
+                    break
+        finally:
+            os.close(exited)
+        if os.WIFEXITED(wait_status):
+            return os.WEXITSTATUS(wait_status)
+        return 128 + os.WTERMSIG(wait_status)
+
+    def _child(self, request, fds):
+        """Run the hook in the context of the client, and return its exit
+        code."""
+        for target, fd in zip(STDIO, fds):
+            os.dup2(fd, target)
+        os.environ.clear()
+        os.environ.update(request["env"])
+        _reset_hook_state()
+        os.chdir(request["cwd"])
+        sys.argv = request["argv"]
+        try:
+            self.hooks.execute(sys.argv)
+            status = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                status = e.code or 0
+            else:
+                sys.stderr.write("{}\n".format(e.code))
+                status = 1
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        return status
+
+
+if __name__ == "__main__":
+    # Use the charming.juju.dispatcher module the charm code sees, rather
+    # than this __main__ copy of it.
+    from charming.juju import dispatcher as module
+    instance = module.Dispatcher(os.path.realpath(sys.argv[1]), sys.argv[2])
+    instance.load()
+    instance.serve()
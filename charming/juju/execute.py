@@ -1,12 +1,39 @@
-import subprocess
+from charming.juju.replay import wrap_runner
+from charming.juju.trace import _traced_runners, traced
 
-def execute_command(command, command_runner=subprocess.check_output):
+# The hook tool runner, wrapped as the hook environment says. Reset by
+# dispatcher children, which get the environment of their own hook.
+_runner = None
+
+
+def execute_command(command, command_runner=None):
     """Execute a shell command and return the output to the caller.
 
+    Unless a command_runner is given, the call is traced, recorded or served
+    from a transcript as the hook environment says (see charming.juju.trace
+    and charming.juju.replay).
+
     @param command: A list of executable + arguments, as expected in the
         subprocess module. Example: ["/usr/bin/ls", "-ali"].
     @param command_runner: The command running function to use, mos.tly useful
         for injection at test time. Defaults to subprocess.check_output"""
-    return command_runner(command, universal_newlines=True).decode("UTF-8")
+    if command_runner is None:
+        return _hook_tool_runner()(command)
+    return command_runner(command, universal_newlines=True)
+
+
+def _hook_tool_runner():
+    global _runner
+    if _runner is None:
+        _runner = traced(wrap_runner(_check_output))
+    return _runner
+
+
+def _check_output(command):
+    import subprocess
+    return subprocess.check_output(command, universal_newlines=True)
 
 
+# It goes through the wrapped runner: Environment and the other users of
+# the wrappers must not wrap it again.
+_traced_runners.add(execute_command)
@@ -0,0 +1,340 @@
+"""A minimal implementation of Go's encoding/gob wire format.
+
+The unit agent serves hook tools through Go's net/rpc package, which frames
+its messages with encoding/gob. Only the subset needed to speak to it is
+implemented here: booleans, integers, floats, strings, byte slices, slices,
+arrays, maps and structs. Interface values and types with custom encoders are
+not supported.
+
+Structs are described with Struct and Slice instances and encoded from (and
+decoded to) plain dicts keyed on field names.
+
+See https://golang.org/pkg/encoding/gob/ for the format specification.
+"""
+import struct
+
+# Predefined type IDs.
+BOOL = 1
+INT = 2
+UINT = 3
+FLOAT = 4
+BYTES = 5
+STRING = 6
+COMPLEX = 7
+INTERFACE = 8
+_WIRE_TYPE = 16
+_ARRAY_TYPE = 17
+_COMMON_TYPE = 18
+_SLICE_TYPE = 19
+_STRUCT_TYPE = 20
+_FIELD_TYPE = 21
+_FIELD_TYPE_SLICE = 22
+_MAP_TYPE = 23
+
+_FIRST_USER_ID = 65
+
+
+class GobError(Exception):
+    """Raised when a gob stream cannot be encoded or decoded."""
+
+
+class Struct(object):
+    """The description of a Go struct type.
+
+    @param name: The name of the type, for information only.
+    @param fields: A list of (field name, field type) pairs, in declaration
+        order. Field types are predefined type IDs, Slice or Struct instances.
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = tuple(fields)
+
+
+class Slice(object):
+    """The description of a Go slice type whose elements have type elem."""
+
+    def __init__(self, elem):
+        self.elem = elem
+        self.name = "[]{}".format(getattr(elem, "name", elem))
+
+
+def encode_uint(value):
+    """Encode an unsigned integer the way gob does."""
+    if value < 0x80:
+        return bytearray((value,))
+    data = bytearray()
+    while value:
+        data.insert(0, value & 0xff)
+        value >>= 8
+    data.insert(0, 256 - len(data))
+    return data
+
+
+def encode_int(value):
+    """Encode a signed integer the way gob does."""
+    if value < 0:
+        return encode_uint((~value << 1) | 1)
+    return encode_uint(value << 1)
+
+
+def _encode_bytes(value):
+    return encode_uint(len(value)) + bytearray(value)
+
+
+def _encode_string(value):
+    return _encode_bytes(value.encode("utf-8"))
+
+
+def _encode_fields(fields):
+    """Encode a struct from (field index, encoded value) pairs, skipping the
+    fields whose value is None."""
+    data = bytearray()
+    previous = -1
+    for index, encoded in fields:
+        if encoded is None:
+            continue
+        data += encode_uint(index - previous)
+        data += encoded
+        previous = index
+    data.append(0)
+    return data
+
+
+class _Reader(object):
+    """Reads gob primitives out of a single message."""
+
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.position = 0
+
+    def read(self, count):
+        end = self.position + count
+        if end > len(self.data):
+            raise GobError("unexpected end of message")
+        chunk = self.data[self.position:end]
+        self.position = end
+        return chunk
+
+    def read_uint(self):
+        first = self.read(1)[0]
+        if first < 0x80:
+            return first
+        value = 0
+        for byte in self.read(256 - first):
+            value = (value << 8) | byte
+        return value
+
+    def read_int(self):
+        value = self.read_uint()
+        if value & 1:
+            return ~(value >> 1)
+        return value >> 1
+
+
+class Encoder(object):
+    """Writes gob values to a stream.
+
+    Type definitions are only sent the first time a type is used, so an
+    Encoder must be used for exactly one stream.
+
+    @param write: A function writing bytes to the underlying stream.
+    """
+
+    def __init__(self, write):
+        self._write = write
+        self._ids = {}
+        self._next_id = _FIRST_USER_ID
+
+    def encode(self, struct_type, value):
+        """Write the dict value as an instance of the Struct struct_type."""
+        self._send_type(struct_type)
+        message = encode_int(self._ids[struct_type])
+        message += self._encode_struct(struct_type, value)
+        self._send(message)
+
+    def _send(self, message):
+        self._write(bytes(encode_uint(len(message)) + message))
+
+    def _type_id(self, gob_type):
+        if isinstance(gob_type, int):
+            return gob_type
+        return self._ids[gob_type]
+
+    def _send_type(self, gob_type):
+        if isinstance(gob_type, int) or gob_type in self._ids:
+            return
+        type_id = self._ids[gob_type] = self._next_id
+        self._next_id += 1
+        if isinstance(gob_type, Struct):
+            for _, field_type in gob_type.fields:
+                self._send_type(field_type)
+        else:
+            self._send_type(gob_type.elem)
+
+        common = _encode_fields([
+            (0, _encode_string(gob_type.name) if gob_type.name else None),
+            (1, encode_int(type_id))])
+        if isinstance(gob_type, Struct):
+            fields = encode_uint(len(gob_type.fields))
+            for name, field_type in gob_type.fields:
+                fields += _encode_fields([
+                    (0, _encode_string(name)),
+                    (1, encode_int(self._type_id(field_type)))])
+            wire_type = _encode_fields(
+                [(2, _encode_fields([(0, common), (1, fields)]))])
+        else:
+            wire_type = _encode_fields([(1, _encode_fields([
+                (0, common), (1, encode_int(self._type_id(gob_type.elem)))]))])
+        self._send(encode_int(-type_id) + wire_type)
+
+    def _encode_value(self, gob_type, value):
+        if gob_type == BOOL:
+            return encode_uint(1 if value else 0)
+        if gob_type == INT:
+            return encode_int(value)
+        if gob_type == UINT:
+            return encode_uint(value)
+        if gob_type == FLOAT:
+            return encode_uint(
+                struct.unpack("<Q", struct.pack(">d", value))[0])
+        if gob_type == BYTES:
+            return _encode_bytes(value)
+        if gob_type == STRING:
+            return _encode_string(value)
+        if isinstance(gob_type, Slice):
+            data = encode_uint(len(value))
+            for item in value:
+                data += self._encode_value(gob_type.elem, item)
+            return data
+        if isinstance(gob_type, Struct):
+            return self._encode_struct(gob_type, value)
+        raise GobError("cannot encode values of type {!r}".format(gob_type))
+
+    def _encode_struct(self, struct_type, value):
+        fields = []
+        for index, (name, field_type) in enumerate(struct_type.fields):
+            field_value = value.get(name)
+            # Zero values are not transmitted.
+            if not field_value and not isinstance(field_type, Struct):
+                continue
+            fields.append(
+                (index, self._encode_value(field_type, field_value or {})))
+        return _encode_fields(fields)
+
+
+class Decoder(object):
+    """Reads gob values from a stream.
+
+    @param read: A function reading exactly the given number of bytes from
+        the underlying stream.
+    """
+
+    def __init__(self, read):
+        self._read = read
+        self._types = {
+            _WIRE_TYPE: ("struct", (
+                ("ArrayT", _ARRAY_TYPE), ("SliceT", _SLICE_TYPE),
+                ("StructT", _STRUCT_TYPE), ("MapT", _MAP_TYPE))),
+            _ARRAY_TYPE: ("struct", (
+                ("CommonType", _COMMON_TYPE), ("Elem", INT), ("Len", INT))),
+            _COMMON_TYPE: ("struct", (("Name", STRING), ("Id", INT))),
+            _SLICE_TYPE: ("struct", (
+                ("CommonType", _COMMON_TYPE), ("Elem", INT))),
+            _STRUCT_TYPE: ("struct", (
+                ("CommonType", _COMMON_TYPE), ("Field", _FIELD_TYPE_SLICE))),
+            _FIELD_TYPE: ("struct", (("Name", STRING), ("Id", INT))),
+            _FIELD_TYPE_SLICE: ("slice", _FIELD_TYPE),
+            _MAP_TYPE: ("struct", (
+                ("CommonType", _COMMON_TYPE), ("Key", INT), ("Elem", INT))),
+        }
+
+    def decode(self):
+        """Return the next value of the stream.
+
+        Structs are returned as dicts holding the transmitted fields only:
+        fields holding their zero value are absent.
+        """
+        while True:
+            message = _Reader(self._read(self._read_length()))
+            type_id = message.read_int()
+            if type_id < 0:
+                self._types[-type_id] = self._decode_wire_type(message)
+                continue
+            if self._kind(type_id)[0] != "struct":
+                # Top-level non-struct values are sent as a singleton field.
+                message.read_uint()
+            return self._decode_value(message, type_id)
+
+    def _read_length(self):
+        first = bytearray(self._read(1))[0]
+        if first < 0x80:
+            return first
+        return _Reader(bytearray((first,)) + bytearray(
+            self._read(256 - first))).read_uint()
+
+    def _kind(self, type_id):
+        if type_id < _WIRE_TYPE:
+            return ("builtin",)
+        try:
+            return self._types[type_id]
+        except KeyError:
+            raise GobError("undefined type ID {}".format(type_id))
+
+    def _decode_wire_type(self, message):
+        wire_type = self._decode_value(message, _WIRE_TYPE)
+        if "StructT" in wire_type:
+            return ("struct", tuple(
+                (field.get("Name", ""), field.get("Id", 0))
+                for field in wire_type["StructT"].get("Field", ())))
+        if "SliceT" in wire_type:
+            return ("slice", wire_type["SliceT"].get("Elem"))
+        if "ArrayT" in wire_type:
+            return ("slice", wire_type["ArrayT"].get("Elem"))
+        if "MapT" in wire_type:
+            return ("map", wire_type["MapT"].get("Key"),
+                    wire_type["MapT"].get("Elem"))
+        raise GobError("unsupported type definition")
+
+    def _decode_value(self, message, type_id):
+        if type_id == BOOL:
+            return message.read_uint() != 0
+        if type_id == INT:
+            return message.read_int()
+        if type_id == UINT:
+            return message.read_uint()
+        if type_id == FLOAT:
+            return self._decode_float(message)
+        if type_id == BYTES:
+            return bytes(message.read(message.read_uint()))
+        if type_id == STRING:
+            return message.read(message.read_uint()).decode("utf-8")
+        if type_id == COMPLEX:
+            return complex(
+                self._decode_float(message), self._decode_float(message))
+        kind = self._kind(type_id)
+        if kind[0] == "struct":
+            value = {}
+            index = -1
+            while True:
+                delta = message.read_uint()
+                if delta == 0:
+                    return value
+                index += delta
+                if index >= len(kind[1]):
+                    raise GobError("field index out of range")
+                name, field_type = kind[1][index]
+                value[name] = self._decode_value(message, field_type)
+        if kind[0] == "slice":
+            return [self._decode_value(message, kind[1])
+                    for _ in range(message.read_uint())]
+        if kind[0] == "map":
+            value = {}
+            for _ in range(message.read_uint()):
+                key = self._decode_value(message, kind[1])
+                value[key] = self._decode_value(message, kind[2])
+            return value
+        raise GobError("cannot decode values of type ID {}".format(type_id))
+
+    def _decode_float(self, message):
+        return struct.unpack(">d", struct.pack("<Q", message.read_uint()))[0]
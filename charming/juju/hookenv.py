@@ -23,16 +23,21 @@
 #  Christopher Glass <tribaal@ubuntu.com>
 
 from __future__ import print_function
-from distutils.version import LooseVersion
-import glob
 import os
 import json
-import yaml
-import subprocess
-import tempfile
-from subprocess import CalledProcessError
 
+# Every hook is a fresh interpreter, so modules that are only needed by some
+# code paths (yaml, tempfile, subprocess, distutils...) are imported where
+# they are used rather than here. See charming/juju/tests/test_imports.py.
+
+from charming.juju.cache import CommandCache
+from charming.juju.capabilities import Capabilities
 from charming.juju.execute import execute_command
+from charming.juju.metadata import (
+    METADATA_FILE_NAME, MetadataIndex, load_metadata)
+from charming.juju.replay import wrap_runner
+from charming.juju.snapshot import DEFAULT_WORKERS, snapshot_relations
+from charming.juju.trace import traced
 
 
 class UnregisteredHookError(Exception):
@@ -40,6 +45,29 @@ class UnregisteredHookError(Exception):
     pass
 
 
+class HookExecutionError(Exception):
+    """Raised when several handlers of a hook failed.
+
+    The errors attribute holds (handler name, exception) pairs, in the order
+    the handlers were registered in.
+    """
+
+    def __init__(self, errors):
+        super(HookExecutionError, self).__init__(
+            "{} hook handlers failed: {}".format(
+                len(errors), ", ".join(
+                    "{} ({!r})".format(name, error)
+                    for name, error in errors)))
+        self.errors = errors
+
+
+def _is_missing_relation_data(error):
+    """Is error the one relation-get fails with when asked for data of a
+    unit that isn't on the relation?"""
+    from subprocess import CalledProcessError
+    return isinstance(error, CalledProcessError) and error.returncode == 2
+
+
 
 class Environment(object):
     """
@@ -54,10 +82,43 @@ class Environment(object):
     remote_unit_name_key = "JUJU_REMOTE_UNIT"
 
     def __init__(self, environment_dict=os.environ,
-                 command_runner=execute_command):
+                 command_runner=execute_command, cache=False,
+                 buffer_writes=False, relation_codec=None):
         self.environment = environment_dict.copy()
-        self.command_runner = command_runner
+        self.command_runner = traced(wrap_runner(command_runner))
         self.metadata = None
+        self._metadata_index = None
+        self._relation_snapshot = None
+        self._relation_digests = None
+        self._relation_index = None
+        # Opt-in memoization of read-only hook tools, for the life of the hook.
+        self.cache = CommandCache() if cache else None
+        # Opt-in write-behind of relation-set, flushed at the end of the hook.
+        self._pending_writes = {} if buffer_writes else None
+        self._flush_scheduled = False
+        # Opt-in compression and chunking of large relation values (see
+        # charming.juju.codec).
+        self.codec = relation_codec
+        self.capabilities = Capabilities(
+            self.get_charm_dir(), self.command_runner, self.environment)
+
+    def _query(self, cmd, tags=()):
+        """Run a read-only hook tool command, going through the cache if
+        caching is enabled."""
+        if self.cache is None:
+            return self.command_runner(cmd)
+        return self.cache.fetch(cmd, self.command_runner, tags=tags)
+
+    def _relation_tag(self, relation_id):
+        """The cache tag for data read from (or written to) relation_id."""
+        return ("relation", relation_id or self.get_current_relation_id())
+
+    def cache_stats(self):
+        """Return the hit/miss counters of the hook tool cache, or None if
+        caching is disabled."""
+        if self.cache is None:
+            return None
+        return self.cache.stats()
 
     def get_charm_dir(self):
         """Return the root directory of the current charm"""
@@ -66,15 +127,23 @@ class Environment(object):
     def get_metadata(self):
         """Get the current charm metadata.yaml contents as a python object"""
         if self.metadata is None:
-            metadata_path = os.path.join(self.get_charm_dir(), "metadata.yaml")
-            with open(metadata_path, "r") as md:
-                self.metadata = yaml.safe_load(md)
+            self.metadata = load_metadata(self.get_charm_dir())
         return self.metadata
 
+    def get_metadata_index(self):
+        """Get the MetadataIndex of the current charm metadata"""
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex(self.get_metadata())
+        return self._metadata_index
+
     def charm_name(self):
         """Get the name of the current charm as is specified on metadata.yaml"""
         return self.get_metadata().get('name')
 
+    def get_relation_types(self):
+        """Get a list of relation types supported by this charm"""
+        return list(self.get_metadata_index().relation_types)
+
 
     def unit_get(self, attribute):
         """Get the passed unit's attribute.
@@ -82,7 +151,7 @@ class Environment(object):
         @param attribute: The Attribute to get for the current unit."""
         cmd = ['unit-get', '--format=json', attribute]
         try:
-            result = self.command_runner(cmd)
+            result = self._query(cmd)
             return json.loads(result)
         except ValueError:
             return None
@@ -124,11 +193,39 @@ class Environment(object):
         """
         return self.environment.get(self.remote_unit_name_key)
 
+    def get_relation_index(self, max_workers=DEFAULT_WORKERS):
+        """Return the RelationIndex of the relations of the charm (see
+        charming.juju.relations), mapping relation IDs to their remote units
+        and service, and remote services to relation IDs.
+
+        The index is built once per hook, with one relation-ids call per
+        relation type and one relation-list call per relation ID, and is then
+        used by the relation lookup methods.
+        """
+        if self._relation_index is None:
+            from charming.juju.relations import build_relation_index
+            self._relation_index = build_relation_index(self, max_workers)
+        return self._relation_index
+
+    def _lookup_index(self):
+        """Return the RelationIndex, or None if the charm metadata listing
+        the relation types isn't available (no CHARM_DIR or no
+        metadata.yaml): lookups then query the given relation only."""
+        if self._relation_index is None and self.metadata is None:
+            charm_dir = self.get_charm_dir()
+            if not charm_dir or not os.path.exists(
+                    os.path.join(charm_dir, METADATA_FILE_NAME)):
+                return None
+        return self.get_relation_index()
+
     def get_remote_service_name(self, relation_id):
         """
         Return the remote's service name for a given relation ID, or None for
         invlaide relation ids.
         """
+        index = self._lookup_index()
+        if index is not None and relation_id in index.services:
+            return index.services[relation_id]
         units = self.get_related_units(relation_id)
         if not units:
             return None
@@ -147,6 +244,10 @@ class Environment(object):
             relation ID for.
         """
         service_name = service_or_unit.split('/')[0]
+        index = self._lookup_index()
+        if index is not None and relation_name in index.relation_ids:
+            relation_ids = index.relation_ids_of(relation_name, service_name)
+            return relation_ids[0] if relation_ids else None
         for relid in self.get_relation_ids(relation_name):
             remote_service = self.get_remote_service_name(relid)
             if remote_service == service_name:
@@ -173,7 +274,34 @@ class Environment(object):
         @returns A dict representation of the values set in the relation data,
             or None in case the relation data set is empty.
         """
+        result = self._relation_get_raw(attribute, unit, relation_id)
+        if self.codec is None or result is None:
+            return result
+        if attribute is None:
+            return self.codec.decode(result)
+        if self.codec.is_chunked(result):
+            # The chunks are stored under other keys: read them all at once.
+            settings = self.relation_get(unit=unit, relation_id=relation_id)
+            return (settings or {}).get(attribute)
+        return self.codec.decode_value(result)
+
+    def _relation_get_raw(self, attribute, unit, relation_id):
+        """Return the relation data as stored on the relation, without
+        decoding it."""
+        cmd = self._relation_get_command(attribute, unit, relation_id)
+        try:
+            result = self._query(
+                cmd, tags=(self._relation_tag(relation_id),))
+            return json.loads(result)
+        except ValueError:
+            return None
+        except Exception as e:
+            if _is_missing_relation_data(e):
+                return None
+            raise
 
+    def _relation_get_command(self, attribute, unit, relation_id):
+        """Return the relation-get command line for the given query."""
         cmd = ['relation-get', '--format=json']
         if relation_id:
             cmd.append('-r')
@@ -181,15 +309,7 @@ class Environment(object):
         cmd.append(attribute or '-')
         if unit:
             cmd.append(unit)
-        try:
-            result = self.command_runner(cmd)
-            return json.loads(result)
-        except ValueError:
-            return None
-        except CalledProcessError as e:
-            if e.returncode == 2:
-                return None
-            raise
+        return cmd
 
     def relation_set(self, relation_id=None, data=None, **kwargs):
         """Set relation information for the current unit.
@@ -197,18 +317,89 @@ class Environment(object):
         All extra keyword parameters to this function will be appended to the
         data dictionnary.
 
+        When relation writes are buffered, the data is merged with the data
+        already pending for the same relation ID and only published by
+        flush(), which runs automatically at the end of a successful hook.
+
         @param data: A dict representation of the data to set on the relation.
         """
         data = data if data else {}
-        cmd = ['relation-set']
-        help_output = self.command_runner(cmd + ["--help"])
-        accepts_file = "--file" in help_output
+        relation_data = data.copy()
+        relation_data.update(kwargs)
 
+        if self._pending_writes is None:
+            self._write_relation(relation_id, relation_data)
+            return
+        relation_id = relation_id or self.get_current_relation_id()
+        if not self._flush_scheduled:
+            atexit(self.flush)
+            self._flush_scheduled = True
+        self._pending_writes.setdefault(relation_id, {}).update(relation_data)
+
+    def flush(self):
+        """Publish the buffered relation data, with one relation-set per
+        relation ID.
+
+        Keys whose value is already set on the relation are not sent again.
+        This is a no-op unless relation writes are buffered.
+        """
+        if not self._pending_writes:
+            return
+        pending, self._pending_writes = self._pending_writes, {}
+        local_unit = self.get_local_unit_name()
+        for relation_id, relation_data in pending.items():
+            current = self.relation_get(
+                unit=local_unit, relation_id=relation_id) or {}
+            changed = {}
+            for key, value in relation_data.items():
+                if value is not None:
+                    value = "{}".format(value)
+                if current.get(key) != value:
+                    changed[key] = value
+            if changed:
+                self._write_relation(relation_id, changed)
+
+    def _write_relation(self, relation_id, relation_data):
+        """Run relation-set for relation_data on relation_id right away."""
+        if self.codec is not None:
+            current = self._relation_get_raw(
+                None, self.get_local_unit_name(), relation_id)
+            relation_data = self.codec.encode(
+                relation_data, current, self._codec_supported(relation_id))
+        self._forget_relation(relation_id)
+        cmd, settings_path = self._relation_set_command(
+            relation_id, relation_data,
+            self.capabilities.has("relation-set-file"))
+        try:
+            self.command_runner(cmd)
+        finally:
+            if settings_path is not None:
+                os.remove(settings_path)
+
+    def _codec_supported(self, relation_id):
+        """Did every remote unit on relation_id advertise the relation
+        codec?"""
+        from charming.juju.codec import CODEC_KEY, supported_by
+        return supported_by([
+            self._relation_get_raw(CODEC_KEY, unit, relation_id)
+            for unit in self.get_related_units(relation_id)])
+
+    def _forget_relation(self, relation_id):
+        """Drop whatever was read from relation_id, before writing to it."""
+        if self.cache is not None:
+            self.cache.invalidate(self._relation_tag(relation_id))
+        self._relation_snapshot = None
+
+    def _relation_set_command(self, relation_id, relation_data, accepts_file):
+        """Return the relation-set command line for relation_data, and the
+        path of the settings file it reads (or None). The caller must remove
+        the settings file once the command ran.
+        """
+        cmd = ['relation-set']
         if relation_id is not None:
             cmd.extend(('-r', relation_id))
 
-        relation_data = data.copy()
-        relation_data.update(kwargs)
+        relation_data = relation_data.copy()
 
         # Force value to be a string: it always should, but some call sites
         # might pass in things like dicts or numbers.
@@ -217,6 +408,8 @@ class Environment(object):
                 relation_data[key] = "{}".format(value)
 
         if accepts_file:
+            import tempfile
+            import yaml
             # --file was introduced in Juju 1.23.2. Use it by default if
             # available, since otherwise we'll break if the relation data is
             # too big. Ideally we should tell relation-set to read the data
@@ -224,15 +417,13 @@ class Environment(object):
             with tempfile.NamedTemporaryFile(delete=False) as settings_file:
                 settings_file.write(
                     yaml.safe_dump(relation_data).encode("utf-8"))
-            self.command_runner(cmd + ["--file", settings_file.name])
-            os.remove(settings_file.name)
-        else:
-            for key, value in relation_data.items():
-                if value is None:
-                    cmd.append('{}='.format(key))
-                else:
-                    cmd.append('{}={}'.format(key, value))
-            self.command_runner(cmd)
+            return cmd + ["--file", settings_file.name], settings_file.name
+        for key, value in relation_data.items():
+            if value is None:
+                cmd.append('{}='.format(key))
+            else:
+                cmd.append('{}={}'.format(key, value))
+        return cmd, None
 
     def relation_clear(self, relation_id):
         """Clears any relation data already set on relation "relation_id".
@@ -240,8 +431,8 @@ class Environment(object):
         This method preserves the "public-address" and "private-address" fields
         of the relation data, since removing those is undefined behavior.
         """
-        data = self.relation_get(rid=relation_id,
-                                     unit=self.local_unit())
+        data = self.relation_get(relation_id=relation_id,
+                                 unit=self.get_local_unit_name())
         for entry in data:
             if entry not in ['public-address', 'private-address']:
                 data[entry] = None
@@ -252,134 +443,233 @@ class Environment(object):
         relation_type = relation_type or self.get_relation_type()
         if relation_type is None:
             return []
+        index = self._relation_index
+        if index is not None and relation_type in index.relation_ids:
+            return list(index.relation_ids[relation_type])
         relid_cmd_line = ['relation-ids', '--format=json']
         relid_cmd_line.append(relation_type)
-        result = self.command_runner(relid_cmd_line)
-        return json.loads(result or [])
+        result = self._query(relid_cmd_line)
+        return json.loads(result or "[]")
 
     def get_related_units(self, relation_id=None):
         """Get a list of unit names related to the caller.
 
         @param relation_id: If specified, filter the returned list of units and
             return only units from the given relation ID."""
-        relation_id = relation_id or self.get_relation_id()
+        relation_id = relation_id or self.get_current_relation_id()
+        index = self._relation_index
+        if index is not None and relation_id in index.units:
+            return list(index.units[relation_id])
 
         cmd = ['relation-list', '--format=json']
         if relation_id is not None:
             cmd.extend(('-r', relation_id))
-        result = self.command_runner(cmd)
+        result = self._query(cmd)
         return json.loads(result) or []
 
-    # NOTE: FIGURE OUT WTF THIS IS USEFUL FOR
+    def config_get(self, scope=None):
+        """Get the charm configuration, or a single option of it.
+
+        @param scope: If provided, the name of the single option to return.
+        @returns The decoded configuration, or None if it could not be read.
+        """
+        cmd = ['config-get']
+        if scope is not None:
+            cmd.append(scope)
+        cmd.append('--format=json')
+        try:
+            return json.loads(self._query(cmd))
+        except ValueError:
+            return None
+
+    def snapshot_relations(self, max_workers=DEFAULT_WORKERS):
+        """Get the relation data of every unit on every relation, as a
+        read-only nested mapping of relation type to relation ID to unit name
+        to relation data.
+
+        The data is fetched in parallel the first time, and reused by later
+        calls until the local unit sets relation data.
+
+        @param max_workers: The maximum number of hook tools to run
+            concurrently while fetching the data.
+        """
+        if self._relation_snapshot is None:
+            self._relation_snapshot = snapshot_relations(
+                self, max_workers=max_workers)
+        return self._relation_snapshot
+
+    def _unit_digests(self, relation_id):
+        """Return the recorded and the current {unit: digest} of the data
+        remote units set on relation_id."""
+        from charming.juju.changes import (
+            RELATION_DIGESTS_FILE_NAME, RelationDigests, digest)
+        if self._relation_digests is None:
+            charm_dir = self.get_charm_dir()
+            path = None
+            if charm_dir:
+                path = os.path.join(charm_dir, RELATION_DIGESTS_FILE_NAME)
+            self._relation_digests = RelationDigests(path)
+            # Digests are only updated once the hook succeeded.
+            atexit(self._relation_digests.commit)
+        digests = self._relation_digests
+        if relation_id not in digests.observed:
+            digests.observe(relation_id, dict(
+                (unit, digest(self.relation_get(
+                    unit=unit, relation_id=relation_id)))
+                for unit in self.get_related_units(relation_id)))
+        return digests.recorded(relation_id), digests.observed[relation_id]
+
+    def changed_units(self, relation_id=None):
+        """Return the remote units whose relation data changed since the end
+        of the last successful hook, including units that just joined.
+
+        @param relation_id: The relation ID to look at. Defaults to the
+            current relation.
+        """
+        relation_id = relation_id or self.get_current_relation_id()
+        recorded, current = self._unit_digests(relation_id)
+        return sorted(unit for unit, unit_digest in current.items()
+                      if recorded.get(unit) != unit_digest)
+
+    def new_units(self, relation_id=None):
+        """Return the remote units that joined since the end of the last
+        successful hook.
+
+        @param relation_id: The relation ID to look at. Defaults to the
+            current relation.
+        """
+        relation_id = relation_id or self.get_current_relation_id()
+        recorded, current = self._unit_digests(relation_id)
+        return sorted(set(current) - set(recorded))
+
+    def departed_units(self, relation_id=None):
+        """Return the remote units that left since the end of the last
+        successful hook.
+
+        @param relation_id: The relation ID to look at. Defaults to the
+            current relation.
+        """
+        relation_id = relation_id or self.get_current_relation_id()
+        recorded, current = self._unit_digests(relation_id)
+        return sorted(set(recorded) - set(current))
+
+    def get_relation(self, relation_id=None):
+        """Return a lazy view of a relation and its units (see
+        charming.juju.relations). No hook tool runs until the units or their
+        data are accessed.
+
+        @param relation_id: The relation ID. Defaults to the current relation.
+        """
+        from charming.juju.relations import Relation
+        return Relation(self, relation_id or self.get_current_relation_id())
+
+    def get_relations(self, relation_type=None):
+        """Return lazy views of the relations of a relation type.
+
+        @param relation_type: Defaults to the type of the current relation.
+        """
+        return [self.get_relation(relation_id)
+                for relation_id in self.get_relation_ids(relation_type)]
+
     def get_relation_for_unit(self, unit=None, rid=None):
-        """Get the json represenation of a unit's relation"""
-        unit = unit or self.get_remote_unit()
-        relation_data = self.relation_get(unit=unit, rid=rid)
-        for key in relation_data:
-            if key.endswith('-list'):
-                relation_data[key] = relation_data[key].split()
-        relation_data['__unit__'] = unit
-        return relation_data
+        """Return the view of a unit's data on a relation.
+
+        @param unit: The unit name. Defaults to the remote unit of the current
+            relation hook.
+        @param rid: The relation ID. Defaults to the current relation.
+        """
+        return self.get_relation(rid).unit(
+            unit or self.get_remote_unit_name())
 
 
 
 
 
-def relation_types():
+def relation_types(environment=None):
     """Get a list of relation types supported by this charm"""
-    rel_types = []
-    md = metadata()
-    for key in ('provides', 'requires', 'peers'):
-        section = md.get(key)
-        if section:
-            rel_types.extend(section.keys())
-    return rel_types
+    environment = environment or Environment()
+    return environment.get_relation_types()
 
 
-def relation_to_interface(relation_name):
+def relation_to_interface(relation_name, environment=None):
     """
     Given the name of a relation, return the interface that relation uses.
 
     :returns: The interface name, or ``None``.
     """
-    return relation_to_role_and_interface(relation_name)[1]
+    return relation_to_role_and_interface(relation_name, environment)[1]
 
 
-def relation_to_role_and_interface(relation_name):
+def relation_to_role_and_interface(relation_name, environment=None):
     """
     Given the name of a relation, return the role and the name of the interface
-    that relation uses (where role is one of ``provides``, ``requires``, or ``peer``).
+    that relation uses (where role is one of ``provides``, ``requires``, or
+    ``peers``).
 
     :returns: A tuple containing ``(role, interface)``, or ``(None, None)``.
     """
-    _metadata = metadata()
-    for role in ('provides', 'requires', 'peer'):
-        interface = _metadata.get(role, {}).get(relation_name, {}).get('interface')
-        if interface:
-            return role, interface
-    return None, None
+    environment = environment or Environment()
+    index = environment.get_metadata_index()
+    return index.relation_to_role_and_interface(relation_name)
 
 
-def role_and_interface_to_relations(role, interface_name):
+def role_and_interface_to_relations(role, interface_name, environment=None):
     """
     Given a role and interface name, return a list of relation names for the
     current charm that use that interface under that role (where role is one
-    of ``provides``, ``requires``, or ``peer``).
+    of ``provides``, ``requires``, or ``peers``).
 
     :returns: A list of relation names.
     """
-    _metadata = metadata()
-    results = []
-    for relation_name, relation in _metadata.get(role, {}).items():
-        if relation['interface'] == interface_name:
-            results.append(relation_name)
-    return results
+    environment = environment or Environment()
+    index = environment.get_metadata_index()
+    return index.role_and_interface_to_relations(role, interface_name)
 
 
-def interface_to_relations(interface_name):
+def interface_to_relations(interface_name, environment=None):
     """
     Given an interface, return a list of relation names for the current
     charm that use that interface.
 
     :returns: A list of relation names.
     """
-    results = []
-    for role in ('provides', 'requires', 'peer'):
-        results.extend(role_and_interface_to_relations(role, interface_name))
-    return results
+    environment = environment or Environment()
+    return environment.get_metadata_index().interface_to_relations(
+        interface_name)
+
 
+def _sync_environment(environment):
+    """Return environment, a new Environment if it is None, or the Environment
+    wrapped by an AsyncEnvironment (see charming.juju.aio)."""
+    if environment is None:
+        return Environment()
+    return getattr(environment, "sync", environment)
 
 
-def relations():
+def relations(environment=None):
     """Get a nested dictionary of relation data for all related units"""
-    rels = {}
-    for reltype in relation_types():
-        relids = {}
-        for relid in relation_ids(reltype):
-            units = {local_unit(): relation_get(unit=local_unit(), rid=relid)}
-            for unit in related_units(relid):
-                reldata = relation_get(unit=unit, rid=relid)
-                units[unit] = reldata
-            relids[relid] = units
-        rels[reltype] = relids
-    return rels
-
-
-def is_relation_made(relation, keys='private-address'):
+    from charming.juju.snapshot import thaw
+    environment = _sync_environment(environment)
+    # A copy of the cached snapshot, that callers may modify or serialize.
+    return thaw(environment.snapshot_relations())
+
+
+def is_relation_made(relation, keys='private-address', environment=None):
     '''
     Determine whether a relation is established by checking for
     presence of key(s).  If a list of keys is provided, they
     must all be present for the relation to be identified as made
     '''
+    environment = _sync_environment(environment)
     if isinstance(keys, str):
         keys = [keys]
-    for r_id in relation_ids(relation):
-        for unit in related_units(r_id):
-            context = {}
-            for k in keys:
-                context[k] = relation_get(k, rid=r_id,
-                                          unit=unit)
-            if None not in context.values():
+    local_unit = environment.get_local_unit_name()
+    snapshot = environment.snapshot_relations()
+    for units in snapshot.get(relation, {}).values():
+        for unit, data in units.items():
+            if unit == local_unit or not data:
+                continue
+            if all(data.get(k) is not None for k in keys):
                 return True
     return False
 
@@ -397,21 +687,22 @@ def translate_exc(from_exc, to_exc):
     return inner_translate_exc1
 
 
-def juju_version():
+def juju_version(environment=None):
     """Full version string (eg. '1.23.3.1-trusty-amd64')"""
-    # Per https://bugs.launchpad.net/juju-core/+bug/1455368/comments/1
-    jujud = glob.glob('/var/lib/juju/tools/machine-*/jujud')[0]
-    return subprocess.check_output([jujud, 'version'],
-                                   universal_newlines=True).strip()
+    environment = environment or Environment()
+    return environment.capabilities.juju_version()
 
 
-def has_juju_version(minimum_version):
+def has_juju_version(minimum_version, environment=None):
     """Return True if the Juju version is at least the provided version"""
-    return LooseVersion(juju_version()) >= LooseVersion(minimum_version)
+    from distutils.version import LooseVersion
+    return (LooseVersion(juju_version(environment)) >=
+            LooseVersion(minimum_version))
 
 
 _atexit = []
 _atstart = []
+_atfailure = []
 
 
 def atstart(callback, *args, **kwargs):
@@ -444,12 +735,24 @@ def atexit(callback, *args, **kwargs):
     _atexit.append((callback, args, kwargs))
 
 
+def atfailure(callback, *args, **kwargs):
+    '''Schedule a callback to run when the hook fails, before the error
+    escapes the hook framework.
+
+    Callbacks are run in the reverse order that they were added.'''
+    _atfailure.append((callback, args, kwargs))
+
+
 def _run_atstart():
     '''Hook frameworks must invoke this before running the main hook body.'''
     global _atstart
-    for callback, args, kwargs in _atstart:
-        callback(*args, **kwargs)
-    del _atstart[:]
+    try:
+        for callback, args, kwargs in _atstart:
+            callback(*args, **kwargs)
+    finally:
+        # A failing callback fails the hook; it must not run again with the
+        # next one.
+        del _atstart[:]
 
 
 def _run_atexit():
@@ -459,6 +762,17 @@ def _run_atexit():
     for callback, args, kwargs in reversed(_atexit):
         callback(*args, **kwargs)
     del _atexit[:]
+    del _atfailure[:]
+
+
+def _run_atfailure():
+    '''Hook frameworks must invoke this when the main hook body, or one of
+    the atexit callbacks, failed. The atexit callbacks are discarded.'''
+    global _atfailure
+    del _atexit[:]
+    for callback, args, kwargs in reversed(_atfailure):
+        callback(*args, **kwargs)
+    del _atfailure[:]
 
 
 #LATER
@@ -475,27 +789,17 @@ def get_execution_environment(environment):
     context['env'] = environment.environment
     return context
 
-# TODO: NOT USEFUL?
-def relations_for_id(relid=None):
-    """Get relations of a specific relation ID"""
-    relation_data = []
-    relid = relid or relation_ids()
-    for unit in related_units(relid):
-        unit_data = relation_for_unit(unit, relid)
-        unit_data['__relid__'] = relid
-        relation_data.append(unit_data)
-    return relation_data
-
-
-# TODO: NOT USEFUL?
-def relations_of_type(reltype=None):
-    """Get relations of a specific type"""
-    relation_data = []
-    reltype = reltype or relation_type()
-    for relid in relation_ids(reltype):
-        for relation in relations_for_id(relid):
-            relation['__relid__'] = relid
-            relation_data.append(relation)
-    return relation_data
+def relations_for_id(relid=None, environment=None):
+    """Get the views of the remote units of a relation ID (see
+    Environment.get_relation)"""
+    environment = environment or Environment()
+    return list(environment.get_relation(relid))
+
+
+def relations_of_type(reltype=None, environment=None):
+    """Get the views of the remote units of every relation of a type"""
+    environment = environment or Environment()
+    return [unit for relation in environment.get_relations(reltype)
+            for unit in relation]
 
 
@@ -1,3 +1,163 @@
+import os
+from contextlib import contextmanager
+
+from charming.juju import dispatcher
+from charming.juju.config import config
+from charming.juju.hookenv import (
+    Environment, HookExecutionError, UnregisteredHookError, _run_atexit,
+    _run_atfailure, _run_atstart, atexit, atfailure)
+from charming.juju.trace import get_tracer
+
+
+@contextmanager
+def _hook_completion():
+    """Run the atexit callbacks once the hook body completed successfully,
+    including when it exits with a zero status, or the atfailure callbacks
+    if it failed."""
+    try:
+        yield
+    except SystemExit as x:
+        if x.code is None or x.code == 0:
+            _complete()
+        else:
+            _run_atfailure()
+        raise
+    except BaseException:
+        _run_atfailure()
+        raise
+    _complete()
+
+
+def _complete():
+    try:
+        _run_atexit()
+    except BaseException:
+        _run_atfailure()
+        raise
+
+
+class _Handler(object):
+    """A registered hook function, the inputs it declared and the names of
+    the functions it must run after."""
+
+    __slots__ = ("function", "inputs", "after")
+
+    def __init__(self, function, inputs=None, after=()):
+        self.function = function
+        self.inputs = inputs
+        self.after = tuple(
+            getattr(name, "__name__", name) for name in after)
+
+    @property
+    def name(self):
+        return self.function.__name__
+
+
+def _call(function):
+    """Call a hook function, running it to completion if it is a coroutine
+    function."""
+    result = function()
+    if hasattr(result, "__await__"):
+        # Only pay for importing asyncio when a hook needs it.
+        from charming.juju.aio import run
+        run(result)
+
+
+def _failed(error):
+    """Is error a failure, as opposed to a successful sys.exit()?"""
+    return not (isinstance(error, SystemExit) and error.code in (None, 0))
+
+
+def _order(handlers):
+    """Return handlers sorted so that each runs after the handlers it depends
+    on, keeping the registration order otherwise."""
+    names = set(handler.name for handler in handlers)
+    done = set()
+    ordered = []
+    pending = list(handlers)
+    while pending:
+        for handler in pending:
+            if all(name in done or name not in names
+                   for name in handler.after):
+                break
+        else:
+            raise ValueError(
+                "Circular dependencies between hook handlers: {}".format(
+                    ", ".join(handler.name for handler in pending)))
+        pending.remove(handler)
+        ordered.append(handler)
+        done.add(handler.name)
+    return ordered
+
+
+def _run_handlers(handlers, workers):
+    """Run handlers, in dependency order, on up to workers threads.
+
+    Handlers depending on a failed handler are not run. Every other handler
+    runs even if an unrelated one failed.
+
+    @returns A list of (handler name, exception) pairs for the handlers that
+        failed, in registration order.
+    """
+    names = set(handler.name for handler in handlers)
+    errors = {}
+    failed = set()
+    finished = set()
+
+    def blocked(handler):
+        return any(name in failed for name in handler.after)
+
+    if workers <= 1:
+        for handler in _order(handlers):
+            if blocked(handler):
+                failed.add(handler.name)
+                continue
+            try:
+                _call(handler.function)
+            except (Exception, SystemExit) as error:
+                # KeyboardInterrupt and the like stop the hook right away.
+                if _failed(error):
+                    errors[handler] = error
+                    failed.add(handler.name)
+    else:
+        from concurrent.futures import (
+            FIRST_COMPLETED, ThreadPoolExecutor, wait)
+        pending = _order(handlers)
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                for handler in list(pending):
+                    if blocked(handler):
+                        pending.remove(handler)
+                        failed.add(handler.name)
+                    elif all(name in finished or name not in names
+                             for name in handler.after):
+                        pending.remove(handler)
+                        future = pool.submit(_call, handler.function)
+                        running[future] = handler
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    handler = running.pop(future)
+                    error = future.exception()
+                    if error is not None and _failed(error):
+                        errors[handler] = error
+                        failed.add(handler.name)
+                    else:
+                        finished.add(handler.name)
+    return [(handler.name, errors[handler])
+            for handler in handlers if handler in errors]
+
+
+def _raise_errors(errors):
+    """Raise the error of a single failed handler as it is, or a
+    HookExecutionError if several failed."""
+    if len(errors) == 1:
+        raise errors[0][1]
+    if errors:
+        raise HookExecutionError(errors)
+
 
 class Hooks(object):
     """A convenient handler for hook functions.
@@ -16,50 +176,161 @@ class Hooks(object):
         def config_changed():
             pass  # your code here
 
+        # several functions can handle the same hook; this one only runs
+        # once config_changed() succeeded
+        @hooks.hook("config-changed", after=[config_changed])
+        def restart():
+            pass  # your code here
+
+        # only run when the given inputs changed since the last successful
+        # run of the function (see charming.juju.changes)
+        @hooks.hook("config-changed", inputs=[ConfigInput("port")])
+        def render_site():
+            pass  # your code here
+
+        # coroutine functions can be registered as well
+        @hooks.hook("db-relation-changed")
+        async def db_relation_changed():
+            pass  # your code here
+
         if __name__ == "__main__":
             # execute a hook based on the name the program is called by
             hooks.execute(sys.argv)
+
+    @param environment: The Environment to read handler inputs from.
+    @param workers: The number of threads running the independent handlers
+        of a hook concurrently. Defaults to 1: handlers run one after the
+        other.
     """
 
-    def __init__(self, config_save=None):
+    def __init__(self, config_save=None, environment=None, workers=1):
         super(Hooks, self).__init__()
         self._hooks = {}
+        self._environment = environment
+        self.workers = workers
 
         # For unknown reasons, we allow the Hooks constructor to override
         # config().implicit_save.
         if config_save is not None:
             config().implicit_save = config_save
 
-    def register(self, name, function):
-        """Register a hook"""
-        self._hooks[name] = function
+    def register(self, name, function, inputs=None, after=()):
+        """Register a hook
 
-    def execute(self, args):
-        """Execute a registered hook based on args[0]"""
+        Several functions can be registered for the same hook; registering
+        the same function again replaces its previous registration.
+
+        @param inputs: A list of the inputs the function depends on (see
+            charming.juju.changes). If provided, the function is skipped
+            unless one of them changed since its last successful run.
+        @param after: The functions (or function names) registered for the
+            same hook that must complete successfully before this one runs.
+        """
+        handlers = self._hooks.setdefault(name, [])
+        handler = _Handler(function, inputs, after)
+        for index, registered in enumerate(handlers):
+            if registered.function is function:
+                handlers[index] = handler
+                return
+        handlers.append(handler)
+
+    def _start(self, args):
+        """Prepare running the hook named by args[0], and return the handlers
+        to run, leaving out those whose inputs didn't change"""
         _run_atstart()
         hook_name = os.path.basename(args[0])
-        if hook_name in self._hooks:
-            try:
-                self._hooks[hook_name]()
-            except SystemExit as x:
-                if x.code is None or x.code == 0:
-                    _run_atexit()
-                raise
-            _run_atexit()
-        else:
+        if hook_name not in self._hooks:
             raise UnregisteredHookError(hook_name)
+        tracer = get_tracer()
+        if tracer is not None:
+            # Registered before the hook body runs, so that it runs after the
+            # callbacks the hook body registers. Failed hooks are reported
+            # too: they are often the slow ones.
+            charm_dir = os.environ.get("CHARM_DIR")
+            atexit(tracer.report, hook_name, charm_dir)
+            atfailure(tracer.report, hook_name, charm_dir, failed=True)
+        handlers = self._hooks[hook_name]
+        tracker = None
+        selected = []
+        for handler in handlers:
+            if handler.inputs:
+                if tracker is None:
+                    tracker = self._input_tracker()
+                if not tracker.changed(
+                        _handler_id(handler.function), handler.inputs):
+                    continue
+            selected.append(handler)
+        return selected
+
+    def _input_tracker(self):
+        from charming.juju.changes import InputTracker
+        tracker = InputTracker(self._environment or Environment(cache=True))
+        # The new digests are only recorded if the hook succeeds.
+        atexit(tracker.commit)
+        return tracker
+
+    def execute(self, args):
+        """Execute the handlers registered for the hook named by args[0]
+
+        Hooks defined as coroutine functions are run to completion in a new
+        event loop. If a single handler fails, its exception is raised; if
+        several do, a HookExecutionError listing them is raised.
+
+        When the resident dispatcher is enabled (see charming.juju.dispatcher)
+        the hook runs in the dispatcher instead, and its exit code is raised
+        as a SystemExit if it isn't 0."""
+        if dispatcher.enabled():
+            status = dispatcher.dispatch(args)
+            if status is not None:
+                if status:
+                    raise SystemExit(status)
+                return
+        with _hook_completion():
+            # Preparing the hook is part of it: the atfailure callbacks run
+            # if an atstart callback or reading the handler inputs fails.
+            handlers = self._start(args)
+            if len(handlers) == 1:
+                # A lone handler's errors, including sys.exit(), propagate
+                # as they are.
+                _call(handlers[0].function)
+                return
+            _raise_errors(_run_handlers(handlers, self.workers))
+
+    def execute_async(self, args):
+        """Return a coroutine executing the handlers registered for the hook
+        named by args[0], one after the other, from within a running event
+        loop (see charming.juju.aio.execute_hooks)."""
+        from charming.juju.aio import execute_hooks
+        return execute_hooks(self, args)
+
+    def hook(self, *hook_names, **kwargs):
+        """Decorator, registering them as hooks
+
+        @param inputs: The inputs the decorated function depends on, see
+            register().
+        @param after: The functions the decorated function runs after, see
+            register().
+        """
+        inputs = kwargs.pop("inputs", None)
+        after = kwargs.pop("after", ())
+        if kwargs:
+            raise TypeError(
+                "hook() got unexpected keyword arguments: {}".format(
+                    ", ".join(sorted(kwargs))))
 
-    def hook(self, *hook_names):
-        """Decorator, registering them as hooks"""
         def wrapper(decorated):
             for hook_name in hook_names:
-                self.register(hook_name, decorated)
+                self.register(hook_name, decorated, inputs, after)
             else:
-                self.register(decorated.__name__, decorated)
+                self.register(decorated.__name__, decorated, inputs, after)
                 if '_' in decorated.__name__:
                     self.register(
-                        decorated.__name__.replace('_', '-'), decorated)
+                        decorated.__name__.replace('_', '-'), decorated,
+                        inputs, after)
             return decorated
         return wrapper
 
 
+def _handler_id(function):
+    from charming.juju.changes import handler_id
+    return handler_id(function)
@@ -0,0 +1,204 @@
+"""Run hook tools by talking to the unit agent directly.
+
+Hook tools such as relation-get or juju-log are thin jujuc shims forwarding
+their arguments to the unit agent over a socket. The SocketCommandRunner does
+the same from python over a single persistent connection, which saves a
+fork/exec of the tool for every call.
+"""
+import os
+import socket
+import sys
+import threading
+from subprocess import CalledProcessError
+
+from charming.juju import gob
+from charming.juju.execute import execute_command
+
+# The hook tools served by the unit agent.
+HOOK_TOOLS = frozenset([
+    "action-fail", "action-get", "action-log", "action-set",
+    "add-metric", "application-version-set", "close-port", "config-get",
+    "is-leader", "juju-log", "juju-reboot", "leader-get", "leader-set",
+    "network-get", "open-port", "opened-ports", "relation-get",
+    "relation-ids", "relation-list", "relation-set", "status-get",
+    "status-set", "storage-add", "storage-get", "storage-list", "unit-get",
+])
+
+JUJUC_METHOD = "Jujuc.Main"
+
+# net/rpc framing.
+RPC_REQUEST = gob.Struct("Request", [
+    ("ServiceMethod", gob.STRING), ("Seq", gob.UINT)])
+RPC_RESPONSE = gob.Struct("Response", [
+    ("ServiceMethod", gob.STRING), ("Seq", gob.UINT), ("Error", gob.STRING)])
+
+# The jujuc request and response payloads.
+JUJUC_REQUEST = gob.Struct("Request", [
+    ("ContextId", gob.STRING), ("Dir", gob.STRING),
+    ("CommandName", gob.STRING), ("Args", gob.Slice(gob.STRING)),
+    ("StdinSet", gob.BOOL), ("Stdin", gob.BYTES)])
+JUJUC_RESPONSE = gob.Struct("ExecResponse", [
+    ("Code", gob.INT), ("Stdout", gob.BYTES), ("Stderr", gob.BYTES)])
+
+
+class JujucError(Exception):
+    """Raised when the unit agent cannot be reached or rejects a request."""
+
+
+class JujucConnectionError(JujucError):
+    """Raised when the unit agent cannot be reached. Nothing was sent to it,
+    so the request can safely be made some other way."""
+
+
+def parse_socket_address(address, network="unix"):
+    """Return the (family, address) pair to connect to the agent socket.
+
+    Unix socket paths starting with "@" live in the abstract namespace.
+    """
+    if network == "tcp":
+        host, port = address.rsplit(":", 1)
+        return socket.AF_INET, (host, int(port))
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+    return socket.AF_UNIX, address
+
+
+class JujucClient(object):
+    """A net/rpc client for the unit agent's jujuc server.
+
+    @param address: The address of the agent socket.
+    @param context_id: The hook context ID the agent handed to this hook.
+    @param network: "unix" or "tcp".
+    @param timeout: Socket timeout in seconds.
+    """
+
+    def __init__(self, address, context_id, network="unix", timeout=None):
+        self.family, self.address = parse_socket_address(address, network)
+        self.context_id = context_id
+        self.timeout = timeout
+        self._socket = None
+        self._encoder = None
+        self._decoder = None
+        self._stream = None
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Open the connection to the agent, if not already open."""
+        if self._socket is not None:
+            return
+        try:
+            sock = socket.socket(self.family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+        except (socket.error, OSError) as e:
+            raise JujucConnectionError(
+                "cannot connect to the agent: {}".format(e))
+        self._socket = sock
+        self._stream = sock.makefile("rb")
+        self._encoder = gob.Encoder(sock.sendall)
+        self._decoder = gob.Decoder(self._read)
+
+    def close(self):
+        """Close the connection to the agent."""
+        if self._socket is not None:
+            self._stream.close()
+            self._socket.close()
+        self._socket = self._stream = None
+        self._encoder = self._decoder = None
+
+    def _read(self, count):
+        data = self._stream.read(count)
+        if len(data) != count:
+            raise JujucError("connection closed by the agent")
+        return data
+
+    def call(self, command_name, args, stdin=None):
+        """Run a hook tool on the agent.
+
+        @returns A (return code, stdout, stderr) tuple, with the outputs as
+            bytes.
+        """
+        request = {
+            "ContextId": self.context_id,
+            "Dir": os.getcwd(),
+            "CommandName": command_name,
+            "Args": list(args),
+            "StdinSet": stdin is not None,
+            "Stdin": stdin or b"",
+        }
+        with self._lock:
+            self.connect()
+            try:
+                self._seq += 1
+                self._encoder.encode(RPC_REQUEST, {
+                    "ServiceMethod": JUJUC_METHOD, "Seq": self._seq})
+                self._encoder.encode(JUJUC_REQUEST, request)
+                header = self._decoder.decode()
+                response = self._decoder.decode()
+            except (socket.error, OSError, gob.GobError, JujucError) as e:
+                # The stream is in an unknown state: start afresh next time.
+                self.close()
+                raise JujucError("agent request failed: {}".format(e))
+        if header.get("Error"):
+            raise JujucError(header["Error"])
+        return (response.get("Code", 0), response.get("Stdout", b""),
+                response.get("Stderr", b""))
+
+
+class SocketCommandRunner(object):
+    """A command_runner sending hook tools to the unit agent over its socket.
+
+    Commands that are not hook tools, or that cannot be sent to the agent
+    (no socket in the environment, connection refused) are run by the
+    fallback runner instead. Once the agent has been found to be unreachable,
+    every later command goes straight to the fallback. Commands are never
+    retried once sent to the agent, since many hook tools (relation-set,
+    leader-set, juju-log...) must not run twice: failures after that point
+    raise JujucError.
+
+    Example::
+
+        environment = Environment(command_runner=SocketCommandRunner())
+
+    @param environment_dict: The hook environment, holding the agent socket
+        address and the hook context ID.
+    @param fallback: The command runner to use when the agent socket can't
+        be used. Defaults to execute_command.
+    """
+
+    def __init__(self, environment_dict=os.environ, fallback=execute_command):
+        self.fallback = fallback
+        self.client = None
+        address = (environment_dict.get("JUJU_AGENT_SOCKET_ADDRESS") or
+                   environment_dict.get("JUJU_AGENT_SOCKET"))
+        context_id = environment_dict.get("JUJU_CONTEXT_ID")
+        if address and context_id:
+            self.client = JujucClient(
+                address, context_id,
+                network=environment_dict.get(
+                    "JUJU_AGENT_SOCKET_NETWORK", "unix"))
+
+    def __call__(self, command):
+        name = command[0]
+        if self.client is None or name not in HOOK_TOOLS:
+            return self.fallback(command)
+        try:
+            code, stdout, stderr = self.client.call(name, command[1:])
+        except JujucConnectionError:
+            self.close()
+            return self.fallback(command)
+        if stderr:
+            # Where the jujuc tool would have written it.
+            sys.stderr.write(stderr.decode("utf-8", "replace"))
+            sys.stderr.flush()
+        output = stdout.decode("utf-8")
+        if code != 0:
+            raise CalledProcessError(code, command, output=output)
+        return output
+
+    def close(self):
+        """Close the agent connection and stop using it."""
+        if self.client is not None:
+            self.client.close()
+        self.client = None
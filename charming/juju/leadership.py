@@ -1,11 +1,23 @@
 import json
 
-from charming.juju.hookenv import Environment
+from charming.juju.hookenv import Environment, translate_exc
+
 
 class Leadership(object):
+    """The leadership status and leader settings of the local unit.
+
+    Both are read once per hook and then served from memory: is-leader and
+    leader-get only run on first use. Writes are diffed against the known
+    settings, so that leader-set only carries the keys actually changed or
+    removed, and doesn't run at all if nothing changed.
+
+    @param environment: The Environment to run the leadership hook tools in.
+    """
 
     def __init__(self, environment=None):
         self.environment = environment or Environment()
+        self._is_leader = None
+        self._settings = None
 
     @translate_exc(from_exc=OSError, to_exc=NotImplementedError)
     def is_leader(self):
@@ -14,31 +26,70 @@ class Leadership(object):
         Uses juju to determine whether the current unit is the leader of its
         peers.
         """
-        cmd = ['is-leader', '--format=json']
-        result = self.environment.command_runner(cmd)
-        return json.loads(result)
+        if self._is_leader is None:
+            cmd = ['is-leader', '--format=json']
+            self._is_leader = json.loads(self.environment.command_runner(cmd))
+        return self._is_leader
 
+    def _load(self):
+        if self._settings is None:
+            cmd = ['leader-get', '--format=json', '-']
+            self._settings = json.loads(
+                self.environment.command_runner(cmd)) or {}
+        return self._settings
 
     @translate_exc(from_exc=OSError, to_exc=NotImplementedError)
     def leader_get(self, attribute=None):
-        """Juju leader get value(s)"""
-        cmd = ['leader-get', '--format=json'] + [attribute or '-']
-        return json.loads(subprocess.check_output(cmd).decode('UTF-8'))
-
-
-@translate_exc(from_exc=OSError, to_exc=NotImplementedError)
-def leader_set(settings=None, **kwargs):
-    """Juju leader set value(s)"""
-    # Don't log secrets.
-    # log("Juju leader-set '%s'" % (settings), level=DEBUG)
-    cmd = ['leader-set']
-    settings = settings or {}
-    settings.update(kwargs)
-    for k, v in settings.items():
-        if v is None:
-            cmd.append('{}='.format(k))
-        else:
-            cmd.append('{}={}'.format(k, v))
-    subprocess.check_call(cmd)
+        """Juju leader get value(s)
+
+        @param attribute: The setting to return. All the settings are returned
+            as a dict if it is None.
+        """
+        settings = self._load()
+        if attribute is None:
+            return dict(settings)
+        return settings.get(attribute)
+
+    @translate_exc(from_exc=OSError, to_exc=NotImplementedError)
+    def leader_set(self, settings=None, **kwargs):
+        """Juju leader set value(s)
+
+        Setting a key to None (or to an empty string) removes it.
+
+        @returns The dict of the settings actually sent to leader-set, with
+            None for the removed keys.
+        """
+        settings = dict(settings or {}, **kwargs)
+        current = self._load()
+        changes = {}
+        for key, value in settings.items():
+            if value is not None:
+                value = str(value)
+            if value in (None, ""):
+                if key in current:
+                    changes[key] = None
+            elif current.get(key) != value:
+                changes[key] = value
+        if not changes:
+            return changes
+        # Don't log secrets.
+        cmd = ['leader-set']
+        for key, value in sorted(changes.items()):
+            cmd.append('{}={}'.format(key, "" if value is None else value))
+        self.environment.command_runner(cmd)
+        for key, value in changes.items():
+            if value is None:
+                current.pop(key, None)
+            else:
+                current[key] = value
+        return changes
+
 
+def leader_set(settings=None, environment=None, **kwargs):
+    """Juju leader set value(s)
 
+    Only the keys whose value differ from the current leader settings are
+    sent to leader-set. Use a Leadership object to share the settings read
+    between several calls.
+    """
+    return Leadership(environment).leader_set(settings, **kwargs)
@@ -1,6 +1,9 @@
+import logging
+
 import six
 
 from charming.juju.execute import execute_command
+from charming.juju.hookenv import atexit, atfailure
 
 # Log levels
 CRITICAL = "CRITICAL"
@@ -25,3 +28,100 @@ def log(message, level=INFO, command_runner=execute_command):
         message = repr(message)
     command += [message]
     command_runner(command)
+
+
+class JujuLogHandler(logging.Handler):
+    """A logging handler sending records to juju-log in batches.
+
+    Records below the handler's level are dropped by logging itself, before
+    any process is spawned. The others are buffered, and written with one
+    multi-line juju-log call per level when capacity records are buffered,
+    when a record arrives more than flush_interval seconds after the oldest
+    buffered one, and at the end of every hook the handler buffered records
+    in, including when it fails (so that ERROR and CRITICAL records are
+    written before the error escapes Hooks.execute).
+
+    The age of the buffered records is only checked when a record is
+    emitted: there is no timer, so records logged before a long quiet
+    operation are written when the next record arrives or when the hook
+    ends. Call flush() before such an operation to write them right away.
+
+    Example::
+
+        logging.getLogger().addHandler(JujuLogHandler(level=logging.INFO))
+
+    @param level: The minimum level of the records to send to juju-log.
+    @param capacity: The number of buffered records triggering a flush.
+    @param flush_interval: The age, in seconds, of the oldest buffered record
+        triggering a flush.
+    @param command_runner: The function to run juju-log with.
+    """
+
+    def __init__(self, level=logging.INFO, capacity=100, flush_interval=5.0,
+                 command_runner=execute_command):
+        logging.Handler.__init__(self, level)
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.command_runner = command_runner
+        self.buffer = []
+        self._scheduled = False
+
+    def emit(self, record):
+        self.acquire()
+        try:
+            if not self._scheduled:
+                # The atexit and atfailure lists are emptied after each
+                # hook, so the flush is registered again for every hook.
+                atexit(self._end_hook)
+                atfailure(self._end_hook)
+                self._scheduled = True
+            self.buffer.append(record)
+            full = len(self.buffer) >= self.capacity
+            stale = (record.created - self.buffer[0].created >=
+                     self.flush_interval)
+        finally:
+            self.release()
+        if full or stale:
+            self.flush()
+
+    def _end_hook(self):
+        """Write the records buffered during the hook that just ended."""
+        self._scheduled = False
+        self.flush()
+
+    def flush(self):
+        """Write the buffered records, with one juju-log call per level."""
+        self.acquire()
+        try:
+            records, self.buffer = self.buffer, []
+        finally:
+            self.release()
+        batches = {}
+        for record in records:
+            batches.setdefault(_juju_level(record.levelno), []).append(record)
+        for level in (CRITICAL, ERROR, WARNING, INFO, DEBUG):
+            if level not in batches:
+                continue
+            try:
+                message = "\n".join(
+                    self.format(record) for record in batches[level])
+                log(message, level=level, command_runner=self.command_runner)
+            except Exception:
+                self.handleError(batches[level][0])
+
+    def close(self):
+        self.flush()
+        logging.Handler.close(self)
+
+
+def _juju_level(levelno):
+    """Return the juju-log level matching a logging level number."""
+    if levelno >= logging.CRITICAL:
+        return CRITICAL
+    if levelno >= logging.ERROR:
+        return ERROR
+    if levelno >= logging.WARNING:
+        return WARNING
+    if levelno >= logging.INFO:
+        return INFO
+    return DEBUG
@@ -0,0 +1,82 @@
+"""Loading and indexing of the charm's metadata.yaml."""
+import json
+import os
+
+from charming.juju.statefile import load_json, write_json_atomic
+
+METADATA_FILE_NAME = "metadata.yaml"
+METADATA_CACHE_FILE_NAME = ".charming-metadata-cache"
+
+# The metadata sections declaring relations, in lookup order.
+ROLES = ("provides", "requires", "peers")
+
+
+def _parse_yaml(path):
+    import yaml
+    # The libyaml based loader is an order of magnitude faster, when present.
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(path, "r") as md:
+        return yaml.load(md, Loader=loader)
+
+
+def load_metadata(charm_dir):
+    """Return the parsed metadata.yaml of the charm in charm_dir.
+
+    The parsed metadata is cached as JSON in the charm directory, keyed on the
+    modification time and size of metadata.yaml, so that hooks don't parse
+    YAML unless the file changed.
+    """
+    path = os.path.join(charm_dir, METADATA_FILE_NAME)
+    cache_path = os.path.join(charm_dir, METADATA_CACHE_FILE_NAME)
+    stat = os.stat(path)
+    key = [stat.st_mtime, stat.st_size]
+    cached = load_json(cache_path)
+    if cached and cached.get("key") == key:
+        return cached["metadata"]
+    metadata = _parse_yaml(path)
+    try:
+        # Only cache metadata that JSON gives back unchanged: for instance,
+        # JSON turns integer keys into strings.
+        if json.loads(json.dumps(metadata)) == metadata:
+            write_json_atomic(cache_path, {"key": key, "metadata": metadata})
+    except (TypeError, ValueError, IOError, OSError):
+        pass  # Not JSON compatible, or read-only charm dir: parse next time.
+    return metadata
+
+
+class MetadataIndex(object):
+    """Constant time lookups of the relations declared in the metadata.
+
+    Roles are the metadata sections relations are declared in: one of
+    ``provides``, ``requires``, or ``peers``.
+    """
+
+    def __init__(self, metadata):
+        self.relation_types = []
+        self._relations = {}
+        self._by_interface = {}
+        self._by_role_and_interface = {}
+        for role in ROLES:
+            for relation_name, relation in (metadata.get(role) or {}).items():
+                interface = (relation or {}).get("interface")
+                self.relation_types.append(relation_name)
+                self._relations.setdefault(relation_name, (role, interface))
+                self._by_interface.setdefault(interface, []).append(
+                    relation_name)
+                self._by_role_and_interface.setdefault(
+                    (role, interface), []).append(relation_name)
+
+    def relation_to_role_and_interface(self, relation_name):
+        """Return the ``(role, interface)`` of a relation, or
+        ``(None, None)``."""
+        return self._relations.get(relation_name, (None, None))
+
+    def role_and_interface_to_relations(self, role, interface_name):
+        """Return the names of the relations using interface_name under
+        role."""
+        return list(self._by_role_and_interface.get(
+            (role, interface_name), ()))
+
+    def interface_to_relations(self, interface_name):
+        """Return the names of the relations using interface_name."""
+        return list(self._by_interface.get(interface_name, ()))
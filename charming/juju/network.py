@@ -1,4 +1,28 @@
+import json
+import os
+from subprocess import CalledProcessError
+
 from charming.juju.hookenv import Environment
+from charming.juju.statefile import load_json, write_json_atomic
+
+# The record of the ports opened by ensure_ports(), used when opened-ports is
+# not available.
+OPENED_PORTS_FILE_NAME = ".charming-opened-ports"
+
+
+def port_spec(port, protocol="tcp"):
+    """Return the canonical "<port>[-<port>]/<protocol>" form of a port.
+
+    @param port: A port number, a (first, last) range, or a string already in
+        the "80", "80/tcp", "8000-8100/udp" or "icmp" forms.
+    @param protocol: The protocol of port, unless it specifies its own.
+    """
+    if isinstance(port, (tuple, list)):
+        port = "{}-{}".format(*port)
+    port = str(port).lower()
+    if port == "icmp" or "/" in port:
+        return port
+    return "{}/{}".format(port, protocol.lower())
 
 
 class Network(object):
@@ -7,29 +31,79 @@ class Network(object):
     current charm.
     """
 
-    def __init__(self, environment):
+    def __init__(self, environment=None):
         self._environment = environment or Environment()
+        self._opened = None
 
     def open_port(self, port, protocol="TCP"):
         """Open a service network port."""
-        cmd = ['open-port']
-        cmd.append('{}/{}'.format(port, protocol))
-        self._environment.command_runner(cmd)
-
+        spec = port_spec(port, protocol)
+        self._environment.command_runner(['open-port', spec])
+        if self._opened is not None:
+            self._opened.add(spec)
 
     def close_port(self, port, protocol="TCP"):
         """Close a service network port"""
-        cmd = ['close-port']
-        cmd.append('{}/{}'.format(port, protocol))
-        self._environment.command_runner(cmd)
+        spec = port_spec(port, protocol)
+        self._environment.command_runner(['close-port', spec])
+        if self._opened is not None:
+            self._opened.discard(spec)
+
+    def _record_path(self):
+        charm_dir = self._environment.get_charm_dir()
+        if charm_dir is None:
+            return None
+        return os.path.join(charm_dir, OPENED_PORTS_FILE_NAME)
+
+    def opened_ports(self):
+        """Return the set of the ports opened by this unit, in their
+        canonical form (see port_spec()).
+
+        The ports are read with opened-ports, or from the record kept by
+        ensure_ports() on older versions of juju.
+        """
+        if self._opened is None:
+            try:
+                output = self._environment.command_runner(
+                    ['opened-ports', '--format=json'])
+                self._opened = set(
+                    port_spec(port) for port in json.loads(output) or [])
+            except (CalledProcessError, OSError, ValueError):
+                path = self._record_path()
+                self._opened = set(load_json(path, []) if path else [])
+        return set(self._opened)
+
+    def ensure_ports(self, ports):
+        """Make the given ports the only ones opened by this unit.
+
+        Only the ports not opened yet are opened, and only the opened ports
+        not listed are closed.
+
+        Example::
+
+            network.ensure_ports({80, "443/tcp", (8000, 8100), "53/udp"})
+
+        @param ports: The ports to open, in any form accepted by port_spec().
+        @returns A (opened, closed) tuple of the sets of ports changed.
+        """
+        wanted = set(port_spec(port) for port in ports)
+        current = self.opened_ports()
+        to_close = current - wanted
+        to_open = wanted - current
+        # Close first: juju refuses to open a range overlapping an opened one.
+        for spec in sorted(to_close):
+            self.close_port(spec)
+        for spec in sorted(to_open):
+            self.open_port(spec)
+        path = self._record_path()
+        if path and (to_open or to_close or not os.path.exists(path)):
+            write_json_atomic(path, sorted(wanted))
+        return to_open, to_close
 
     def unit_public_ip(self):
         """Get this unit's public IP address"""
-        return self.environment.unit_get('public-address')
+        return self._environment.unit_get('public-address')
 
     def unit_private_ip(self):
         """Get this unit's private IP address"""
-        return self.environment.unit_get('private-address')
-
-
-
+        return self._environment.unit_get('private-address')
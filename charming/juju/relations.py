@@ -0,0 +1,173 @@
+"""Lazy, read-only views of relations and of the units on them.
+
+Creating a view doesn't run any hook tool: a Relation only runs
+relation-list when its units are first needed, and a RelationUnit only runs
+relation-get when its data is first accessed. A handler looking at 3 of the
+500 units of a relation only fetches the data of those 3.
+"""
+from types import MappingProxyType
+
+
+class RelationUnit(object):
+    """The relation data a unit set on a relation.
+
+    @param environment: The Environment to read the data from.
+    @param relation_id: The ID of the relation.
+    @param name: The name of the unit.
+    """
+
+    __slots__ = ("environment", "relation_id", "name", "_data")
+
+    def __init__(self, environment, relation_id, name):
+        self.environment = environment
+        self.relation_id = relation_id
+        self.name = name
+        self._data = None
+
+    def __repr__(self):
+        return "<RelationUnit {} on {}>".format(self.name, self.relation_id)
+
+    @property
+    def service(self):
+        """The name of the service the unit belongs to."""
+        return self.name.split("/")[0]
+
+    @property
+    def loaded(self):
+        """Was the data of the unit fetched already?"""
+        return self._data is not None
+
+    @property
+    def data(self):
+        """A read-only mapping of the unit's relation data, empty if the unit
+        did not set any data yet."""
+        if self._data is None:
+            self._data = MappingProxyType(self.environment.relation_get(
+                unit=self.name, relation_id=self.relation_id) or {})
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def get_list(self, key):
+        """Return the whitespace separated items of key (for instance the
+        "-list" keys), or an empty list if it is not set."""
+        value = self.data.get(key)
+        return value.split() if value else []
+
+    def get_int(self, key, default=None):
+        """Return the value of key as an integer, or default if it is not
+        set."""
+        value = self.data.get(key)
+        return default if value in (None, "") else int(value)
+
+
+class Relation(object):
+    """A relation and the units on it.
+
+    Iterating over a Relation yields a RelationUnit for every remote unit.
+
+    @param environment: The Environment to read the relation from.
+    @param relation_id: The ID of the relation, for instance "db:1".
+    """
+
+    __slots__ = ("environment", "relation_id", "_unit_names", "_units")
+
+    def __init__(self, environment, relation_id):
+        self.environment = environment
+        self.relation_id = relation_id
+        self._unit_names = None
+        self._units = {}
+
+    def __repr__(self):
+        return "<Relation {}>".format(self.relation_id)
+
+    @property
+    def relation_type(self):
+        """The name of the relation in the charm metadata."""
+        return self.relation_id.split(":")[0]
+
+    @property
+    def unit_names(self):
+        """The names of the remote units on the relation."""
+        if self._unit_names is None:
+            self._unit_names = tuple(
+                self.environment.get_related_units(self.relation_id))
+        return self._unit_names
+
+    def unit(self, name):
+        """Return the view of a unit's data on the relation. The unit may be
+        a remote unit or the local one."""
+        unit = self._units.get(name)
+        if unit is None:
+            unit = self._units[name] = RelationUnit(
+                self.environment, self.relation_id, name)
+        return unit
+
+    @property
+    def local_unit(self):
+        """The view of the local unit's data on the relation."""
+        return self.unit(self.environment.get_local_unit_name())
+
+    def __iter__(self):
+        for name in self.unit_names:
+            yield self.unit(name)
+
+    def __len__(self):
+        return len(self.unit_names)
+
+    def __contains__(self, name):
+        return name in self.unit_names
+
+
+class RelationIndex(object):
+    """Which relation IDs exist, which units are on them and which remote
+    service they connect to, as seen by a hook.
+
+    @param relation_ids: A {relation type: [relation ID]} dict.
+    @param units: A {relation ID: [remote unit name]} dict.
+    """
+
+    def __init__(self, relation_ids, units):
+        self.relation_ids = dict(
+            (relation_type, tuple(ids))
+            for relation_type, ids in relation_ids.items())
+        self.units = dict(
+            (relation_id, tuple(names))
+            for relation_id, names in units.items())
+        self.services = {}
+        self._by_service = {}
+        for relation_type, ids in self.relation_ids.items():
+            for relation_id in ids:
+                names = self.units.get(relation_id)
+                service = names[0].split("/")[0] if names else None
+                self.services[relation_id] = service
+                if service is not None:
+                    self._by_service.setdefault(
+                        (relation_type, service), []).append(relation_id)
+
+    def relation_ids_of(self, relation_type, service):
+        """Return the IDs of the relations of relation_type with service."""
+        return list(self._by_service.get((relation_type, service), ()))
+
+
+def build_relation_index(environment, max_workers):
+    """Build the RelationIndex of every relation type declared in the charm
+    metadata, running relation-ids and relation-list on a pool of at most
+    max_workers threads."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    relation_types = environment.get_relation_types()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        ids = list(pool.map(environment.get_relation_ids, relation_types))
+        relation_ids = dict(zip(relation_types, ids))
+        all_ids = [relation_id for type_ids in ids for relation_id in type_ids]
+        units = dict(zip(all_ids, pool.map(
+            environment.get_related_units, all_ids)))
+    return RelationIndex(relation_ids, units)
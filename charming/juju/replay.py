@@ -0,0 +1,385 @@
+"""Recording and offline replay of hook tool traffic.
+
+Setting CHARMING_RECORD to a file path in the hook environment appends a
+transcript of every hook tool call made by the hook to that file (relative
+paths are relative to the charm directory): one JSON line per call, with its
+argv, output, exit status and duration, after a line describing the hook
+and its environment. Every hook appends its own segment to the file, which
+is created readable by its owner only: it holds relation data and secrets.
+
+The transcript can then be replayed offline, without Juju: with
+CHARMING_REPLAY set to its path, every hook tool call is served from the
+transcript by a ReplayRunner instead of being run. The command line does
+just that for a charm script, replaying the last recorded run of the hook,
+or the segment given by its index in the transcript::
+
+    python -m charming.juju.replay transcript.jsonl hooks/hooks.py \\
+        config-changed [--latency recorded] [--segment INDEX]
+
+so a slow production hook can be profiled on a laptop, and optimizations
+checked against the exact same tool traffic.
+"""
+import json
+import os
+import sys
+import time
+import weakref
+
+RECORD_ENV_KEY = "CHARMING_RECORD"
+REPLAY_ENV_KEY = "CHARMING_REPLAY"
+REPLAY_LATENCY_ENV_KEY = "CHARMING_REPLAY_LATENCY"
+REPLAY_SEGMENT_ENV_KEY = "CHARMING_REPLAY_SEGMENT"
+
+# The environment variables describing the hook, saved in transcripts.
+HOOK_ENV_PREFIXES = ("JUJU_", "CHARM_DIR")
+
+_replay_runner = None
+_transcripts = {}
+
+# The coroutine functions recording calls (see RecordingRunner.coroutine).
+_recorded_runners = weakref.WeakSet()
+
+
+class ReplayError(LookupError):
+    """Raised when a replayed hook runs a command the transcript doesn't
+    have, or with other --file contents."""
+
+
+def _key(command):
+    """Return the argv of command as recorded, with the paths of temporary
+    files (relation-set --file) left out since they differ on every run."""
+    key = []
+    previous = None
+    for argument in command:
+        key.append("<file>" if previous == "--file" else argument)
+        previous = argument
+    return key
+
+
+def _file_contents(command):
+    """Return the contents of the file command reads its input from
+    (relation-set --file), or None if there is none or it can't be read."""
+    if "--file" not in command[:-1]:
+        return None
+    try:
+        with open(command[command.index("--file") + 1]) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _entry(command):
+    """Return a new transcript entry for command, holding what it reads from
+    its --file argument: the file is gone by the time the call is replayed."""
+    entry = {"argv": _key(command), "status": 0}
+    contents = _file_contents(command)
+    if contents is not None:
+        entry["file"] = contents
+    return entry
+
+
+def _open(path, mode):
+    if mode == "a":
+        # Transcripts hold relation data and secrets: create them readable
+        # by their owner only.
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600))
+    if path.endswith(".gz"):
+        import gzip
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+class Transcript(object):
+    """A transcript file, written to by RecordingRunners.
+
+    @param path: The transcript file, appended to. Compressed with gzip if it
+        ends with ".gz".
+    @param environment_dict: The hook environment, described at the start of
+        the segment of the hook.
+    """
+
+    def __init__(self, path, environment_dict=os.environ):
+        self.path = path
+        self.environment = environment_dict
+        self._file = None
+        import threading
+        self._lock = threading.Lock()
+
+    def write(self, entry):
+        """Append an entry to the transcript."""
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = _open(self.path, "a")
+                self._file.write(json.dumps({
+                    "hook": (self.environment.get("JUJU_HOOK_NAME") or
+                             os.path.basename(sys.argv[0])),
+                    "started": time.time(),
+                    "env": dict((key, value) for key, value in
+                                self.environment.items()
+                                if key.startswith(HOOK_ENV_PREFIXES)),
+                }, separators=(",", ":"), sort_keys=True) + "\n")
+            self._file.write(line)
+            # Keep the transcript of hooks that crash.
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RecordingRunner(object):
+    """A command runner recording every call in a transcript.
+
+    @param transcript: The Transcript to write to, or the path of its file.
+    @param command_runner: The command runner actually running commands.
+    """
+
+    def __init__(self, transcript, command_runner):
+        if not isinstance(transcript, Transcript):
+            transcript = Transcript(transcript)
+        self.transcript = transcript
+        self.command_runner = command_runner
+
+    def __call__(self, command):
+        entry = _entry(command)
+        start = time.time()
+        try:
+            output = self.command_runner(command)
+            entry["stdout"] = output
+            return output
+        except Exception as e:
+            self._failed(entry, e)
+            raise
+        finally:
+            entry["duration"] = round(time.time() - start, 6)
+            self.transcript.write(entry)
+
+    def coroutine(self):
+        """Return a coroutine function recording the calls to command_runner,
+        for command runners that are coroutine functions (see
+        charming.juju.aio)."""
+        from charming.juju.aio import record_coroutine
+        return record_coroutine(self)
+
+    def _failed(self, entry, error):
+        from subprocess import CalledProcessError
+        if isinstance(error, CalledProcessError):
+            entry["status"] = error.returncode
+            entry["stdout"] = error.output
+        elif isinstance(error, OSError):
+            entry["status"] = -1
+            entry["errno"] = error.errno
+
+
+def load_segments(path):
+    """Return the hooks recorded in the transcript at path, in order, as
+    (header, calls) pairs. The header holds the name of the hook ("hook"),
+    its environment ("env") and start time ("started")."""
+    segments = []
+    with _open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "argv" not in entry:
+                segments.append((entry, []))
+            elif segments:
+                segments[-1][1].append(entry)
+            else:
+                # Calls recorded without a header.
+                segments.append(({}, [entry]))
+    return segments
+
+
+def select_segment(segments, hook=None):
+    """Return the index of a segment of segments (see load_segments()).
+
+    @param hook: The index of the segment, or the name of a hook to select
+        its last run. Defaults to the last segment.
+    @raises ReplayError: If there is no such segment.
+    """
+    if hook is None:
+        hook = -1
+    if isinstance(hook, int):
+        if not -len(segments) <= hook < len(segments):
+            raise ReplayError("No segment {} in the transcript".format(hook))
+        return hook % len(segments)
+    for index in reversed(range(len(segments))):
+        if segments[index][0].get("hook") == hook:
+            return index
+    raise ReplayError("No run of {} in the transcript".format(hook))
+
+
+def load_transcript(path, hook=None):
+    """Return the (environment, calls) of one hook of the transcript at path.
+
+    @param hook: The index of the segment of the hook, or its name to select
+        its last run (see select_segment()). Defaults to the last hook.
+    """
+    segments = load_segments(path)
+    header, calls = segments[select_segment(segments, hook)]
+    return header.get("env", {}), calls
+
+
+class ReplayRunner(object):
+    """A command runner serving the calls of a transcript.
+
+    Calls are matched on their argv. When the same command was recorded
+    several times, the recorded results are served in order, the last one
+    being repeated once they are exhausted. Commands that failed when
+    recorded raise the same CalledProcessError (or OSError) again. Commands
+    reading a --file must find the recorded contents in it.
+
+    @param calls: The calls of a transcript, see load_transcript().
+    @param latency: How long each call takes: None for no delay, "recorded"
+        for the recorded durations, a number of seconds, or a function taking
+        the recorded call and returning a number of seconds.
+    """
+
+    def __init__(self, calls, latency=None):
+        self.latency = latency
+        self.calls = []
+        self._results = {}
+        for entry in calls:
+            self._results.setdefault(
+                tuple(entry["argv"]), []).append(entry)
+        self._served = {}
+        import threading
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, latency=None, hook=None):
+        """Return a ReplayRunner serving the calls of one hook of the
+        transcript at path (see load_transcript())."""
+        return cls(load_transcript(path, hook)[1], latency)
+
+    def __call__(self, command):
+        key = tuple(_key(command))
+        with self._lock:
+            results = self._results.get(key)
+            if not results:
+                raise ReplayError(
+                    "Not in the transcript: {}".format(" ".join(command)))
+            served = self._served.get(key, 0)
+            entry = results[min(served, len(results) - 1)]
+            if "file" in entry and entry["file"] != _file_contents(command):
+                raise ReplayError(
+                    "Not the recorded --file contents: {}".format(
+                        " ".join(command)))
+            self._served[key] = served + 1
+            self.calls.append(list(command))
+        self._wait(entry)
+        if entry["status"] == -1:
+            raise OSError(entry.get("errno"), "Recorded failure", command[0])
+        if entry["status"]:
+            from subprocess import CalledProcessError
+            raise CalledProcessError(
+                entry["status"], command, output=entry.get("stdout"))
+        return entry.get("stdout")
+
+    def _wait(self, entry):
+        if self.latency is None:
+            return
+        if self.latency == "recorded":
+            delay = entry.get("duration", 0)
+        elif callable(self.latency):
+            delay = self.latency(entry)
+        else:
+            delay = self.latency
+        if delay > 0:
+            time.sleep(delay)
+
+    def unused(self):
+        """Return the recorded calls that were never served, for instance
+        because an optimization made them unnecessary."""
+        unused = []
+        for key, results in self._results.items():
+            unused.extend(results[self._served.get(key, 0):])
+        return unused
+
+
+def wrap_runner(command_runner, environment_dict=os.environ):
+    """Return command_runner, recording its calls if CHARMING_RECORD is set,
+    or the process wide ReplayRunner if CHARMING_REPLAY is set.
+
+    Runners that are already recorded or replayed, or traced (which only
+    happens after going through this function), are returned as they are.
+    """
+    global _replay_runner
+    from charming.juju.trace import is_traced
+    if (isinstance(command_runner, (RecordingRunner, ReplayRunner)) or
+            command_runner in _recorded_runners or
+            is_traced(command_runner)):
+        return command_runner
+    replay_path = environment_dict.get(REPLAY_ENV_KEY)
+    if replay_path:
+        if _replay_runner is None:
+            latency = environment_dict.get(REPLAY_LATENCY_ENV_KEY)
+            if latency and latency != "recorded":
+                latency = float(latency)
+            segment = environment_dict.get(REPLAY_SEGMENT_ENV_KEY)
+            _replay_runner = ReplayRunner.from_file(
+                replay_path, latency,
+                int(segment) if segment is not None else None)
+        return _replay_runner
+    record_path = environment_dict.get(RECORD_ENV_KEY)
+    if record_path:
+        charm_dir = environment_dict.get("CHARM_DIR")
+        if charm_dir:
+            record_path = os.path.join(charm_dir, record_path)
+        if record_path not in _transcripts:
+            # Shared by all the runners of the process.
+            _transcripts[record_path] = Transcript(
+                record_path, environment_dict)
+        runner = RecordingRunner(_transcripts[record_path], command_runner)
+        import inspect
+        if inspect.iscoroutinefunction(command_runner):
+            return runner.coroutine()
+        return runner
+    return command_runner
+
+
+def main(args=None):
+    """Replay a transcript against a charm script."""
+    import argparse
+    from charming.juju.dispatcher import run_script
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("transcript")
+    parser.add_argument("script", help="The charm script defining the hooks")
+    parser.add_argument("hook", help="The name of the hook to run")
+    parser.add_argument(
+        "--latency", default=None,
+        help='"recorded", or a number of seconds per hook tool call')
+    parser.add_argument(
+        "--charm-dir", default=None,
+        help="The charm directory, instead of the recorded one")
+    parser.add_argument(
+        "--segment", type=int, default=None,
+        help="The index of the hook to replay in the transcript, instead of "
+             "the last run of the hook")
+    options = parser.parse_args(args)
+
+    segments = load_segments(options.transcript)
+    try:
+        index = select_segment(
+            segments,
+            options.hook if options.segment is None else options.segment)
+    except ReplayError as e:
+        parser.error(str(e))
+    os.environ.update(segments[index][0].get("env", {}))
+    os.environ.pop(RECORD_ENV_KEY, None)
+    os.environ[REPLAY_ENV_KEY] = os.path.abspath(options.transcript)
+    os.environ[REPLAY_SEGMENT_ENV_KEY] = str(index)
+    if options.latency:
+        os.environ[REPLAY_LATENCY_ENV_KEY] = options.latency
+    os.environ["CHARM_DIR"] = os.path.abspath(
+        options.charm_dir or os.path.dirname(os.path.dirname(
+            os.path.abspath(options.script))))
+    run_script(options.script, [options.hook])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Bulk, parallel collection of all the relation data visible to a hook."""
+from types import MappingProxyType
+
+# The default number of hook tools run concurrently to build a snapshot.
+DEFAULT_WORKERS = 8
+
+
+def freeze(value):
+    """Return a read-only version of value: dicts become read-only mappings
+    and lists become tuples, recursively."""
+    if isinstance(value, dict):
+        return MappingProxyType(
+            dict((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Return a plain, mutable copy of a value made read-only by freeze()."""
+    if isinstance(value, (dict, MappingProxyType)):
+        return dict((key, thaw(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+def snapshot_relations(environment, max_workers=DEFAULT_WORKERS):
+    """Collect the relation data of every unit on every relation.
+
+    The relation-ids, relation-list and relation-get calls are spread over a
+    pool of at most max_workers threads, one stage at a time.
+
+    @param environment: The Environment to query.
+    @param max_workers: The maximum number of hook tools to run concurrently.
+    @returns A read-only nested mapping of relation type to relation ID to
+        unit name to that unit's relation data (None for units that have not
+        set any data). The local unit is included for every relation ID.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    local_unit = environment.get_local_unit_name()
+    relation_types = environment.get_relation_types()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        relation_ids = list(pool.map(
+            environment.get_relation_ids, relation_types))
+        pairs = [(relation_type, relation_id)
+                 for relation_type, ids in zip(relation_types, relation_ids)
+                 for relation_id in ids]
+        remote_units = list(pool.map(
+            environment.get_related_units,
+            [relation_id for _, relation_id in pairs]))
+
+        pending = []
+        for (relation_type, relation_id), units in zip(pairs, remote_units):
+            for unit in [local_unit] + list(units):
+                future = pool.submit(
+                    environment.relation_get, unit=unit,
+                    relation_id=relation_id)
+                pending.append((relation_type, relation_id, unit, future))
+
+        relations = dict((relation_type, {})
+                         for relation_type in relation_types)
+        for relation_type, relation_id in pairs:
+            relations[relation_type][relation_id] = {}
+        for relation_type, relation_id, unit, future in pending:
+            relations[relation_type][relation_id][unit] = future.result()
+    return freeze(relations)
@@ -0,0 +1,44 @@
+"""Helpers to persist small bits of JSON state in the charm directory."""
+import json
+import os
+import stat
+
+
+def load_json(path, default=None):
+    """Return the decoded contents of the JSON file at path, or default if it
+    doesn't exist or can't be decoded."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_json_atomic(path, data):
+    """Write data as JSON to path atomically (see write_atomic)."""
+    write_atomic(path, json.dumps(data, sort_keys=True))
+
+
+def write_atomic(path, text):
+    """Write text to path atomically.
+
+    The text is written to a temporary file in the same directory which is
+    then renamed over path, so readers never see a partially written file.
+    The file keeps its mode if it exists, and is otherwise created with the
+    mode open() would give it.
+    """
+    import uuid
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_path = os.path.join(directory, ".tmp-" + uuid.uuid4().hex)
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        try:
+            os.fchmod(fd, stat.S_IMODE(os.stat(path).st_mode))
+        except OSError:
+            pass  # A new file: the mode given to os.open() applies.
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.rename(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -1,10 +1,17 @@
-import subprocess
+import errno
 import json
+import time
+from subprocess import CalledProcessError
 
-from charming.juju.utils import log
+from charming.juju.execute import execute_command
+from charming.juju.hookenv import Environment, atexit
+from charming.juju.log import log
 
+# Workload states, from the most to the least severe.
+WORKLOAD_STATES = ['blocked', 'maintenance', 'waiting', 'active']
 
-def status_set(workload_state, message):
+
+def status_set(workload_state, message, command_runner=execute_command):
     """Set the workload state with a message
 
     Use status-set to set the workload state with a message which is visible
@@ -13,26 +20,27 @@ def status_set(workload_state, message):
 
     workload_state -- valid juju workload state.
     message        -- status update message
+    command_runner -- the function to run status-set with.
     """
-    valid_states = ['maintenance', 'blocked', 'waiting', 'active']
-    if workload_state not in valid_states:
+    if workload_state not in WORKLOAD_STATES:
         raise ValueError(
             '{!r} is not a valid workload state'.format(workload_state)
         )
     cmd = ['status-set', workload_state, message]
     try:
-        ret = subprocess.call(cmd)
-        if ret == 0:
-            return
+        command_runner(cmd)
+        return
+    except CalledProcessError:
+        pass
     except OSError as e:
         if e.errno != errno.ENOENT:
             raise
     log_message = 'status-set failed: {} {}'.format(workload_state,
                                                     message)
-    log(log_message, level='INFO')
+    log(log_message, level='INFO', command_runner=command_runner)
 
 
-def status_get():
+def status_get(command_runner=execute_command):
     """Retrieve the previously set juju workload state and message
 
     If the status-get command is not found then assume this is juju < 1.23 and
@@ -41,14 +49,100 @@ def status_get():
     """
     cmd = ['status-get', "--format=json", "--include-data"]
     try:
-        raw_status = subprocess.check_output(cmd)
+        raw_status = command_runner(cmd)
     except OSError as e:
         if e.errno == errno.ENOENT:
             return ('unknown', "")
         else:
             raise
     else:
-        status = json.loads(raw_status.decode("UTF-8"))
+        status = json.loads(raw_status)
         return (status["status"], status["message"])
 
 
+class StatusManager(object):
+    """Aggregates the workload status reported by the components of a charm.
+
+    Each component reports its own state. At the end of a successful hook,
+    the most severe state (blocked > maintenance > waiting > active) is
+    published with a single status-set, along with the messages of the
+    components in that state. Nothing is run if that is already the status
+    of the unit.
+
+    Example::
+
+        status = StatusManager()
+        status.report("db", "waiting", "Waiting for the database")
+        status.report("web", "active", "Serving")
+        # At the end of the hook: status-set waiting "Waiting for the
+        # database"
+
+    @param environment: The Environment to run status-get and status-set in.
+    @param publish_interval: The minimum time, in seconds, between two
+        immediate publications requested with report(..., publish=True).
+    """
+
+    def __init__(self, environment=None, publish_interval=5.0):
+        self.environment = environment or Environment()
+        self.publish_interval = publish_interval
+        self._components = {}
+        self._order = []
+        self._current = None
+        self._last_publish = None
+        self._scheduled = False
+
+    def report(self, component, workload_state, message, publish=False):
+        """Record the state of a component.
+
+        @param publish: If True, publish the aggregated status right away
+            instead of waiting for the end of the hook, unless the previous
+            immediate publication happened less than publish_interval seconds
+            ago. Useful to show progress during long running steps.
+        """
+        if workload_state not in WORKLOAD_STATES:
+            raise ValueError(
+                '{!r} is not a valid workload state'.format(workload_state))
+        if component not in self._components:
+            self._order.append(component)
+        self._components[component] = (workload_state, message)
+        if not self._scheduled:
+            atexit(self.publish)
+            self._scheduled = True
+        if publish:
+            now = time.time()
+            if (self._last_publish is None or
+                    now - self._last_publish >= self.publish_interval):
+                self._last_publish = now
+                self.publish()
+
+    def clear(self, component):
+        """Forget the state reported by a component."""
+        if self._components.pop(component, None) is not None:
+            self._order.remove(component)
+
+    def aggregate(self):
+        """Return the (workload state, message) to publish, or None if no
+        component reported anything."""
+        for state in WORKLOAD_STATES:
+            messages = [self._components[component][1]
+                        for component in self._order
+                        if self._components[component][0] == state]
+            if messages:
+                return state, "; ".join(
+                    message for message in messages if message)
+        return None
+
+    def current(self):
+        """Return the (workload state, message) of the unit, as last read
+        with status-get or set by this manager."""
+        if self._current is None:
+            self._current = status_get(self.environment.command_runner)
+        return self._current
+
+    def publish(self):
+        """Publish the aggregated status, unless it is already set."""
+        status = self.aggregate()
+        if status is None or status == self.current():
+            return
+        status_set(status[0], status[1], self.environment.command_runner)
+        self._current = status
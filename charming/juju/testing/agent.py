@@ -0,0 +1,119 @@
+"""A stand-in for the unit agent's hook tool socket, for use in tests."""
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+
+from charming.juju import gob
+from charming.juju.jujuc import (
+    JUJUC_METHOD, JUJUC_REQUEST, JUJUC_RESPONSE, RPC_REQUEST, RPC_RESPONSE)
+
+_INVALID_REQUEST = gob.Struct("", [])
+
+
+class _AgentRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server.agent
+        decoder = gob.Decoder(self._read)
+        encoder = gob.Encoder(self.wfile.write)
+        while True:
+            try:
+                header = decoder.decode()
+                request = decoder.decode()
+            except EOFError:
+                return
+            server.requests.append(request)
+            response = {"ServiceMethod": header.get("ServiceMethod", ""),
+                        "Seq": header.get("Seq", 0)}
+            if header.get("ServiceMethod") != JUJUC_METHOD:
+                response["Error"] = "rpc: can't find service {}".format(
+                    header.get("ServiceMethod"))
+                encoder.encode(RPC_RESPONSE, response)
+                encoder.encode(_INVALID_REQUEST, {})
+                continue
+            result = server.handler(
+                request.get("CommandName", ""), request.get("Args", []),
+                request.get("Stdin") if request.get("StdinSet") else None)
+            if result is None:
+                return  # Drop the connection without replying.
+            code, stdout, stderr = result
+            encoder.encode(RPC_RESPONSE, response)
+            encoder.encode(JUJUC_RESPONSE, {
+                "Code": code, "Stdout": stdout, "Stderr": stderr})
+            self.wfile.flush()
+
+    def _read(self, count):
+        data = self.rfile.read(count)
+        if len(data) != count:
+            raise EOFError()
+        return data
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn,
+                           socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeAgentServer(object):
+    """Serve hook tool requests over a unix socket, like the unit agent.
+
+    Example::
+
+        def handler(command_name, args, stdin):
+            return 0, b'"10.0.0.1"', b""
+
+        with FakeAgentServer(handler) as agent:
+            runner = SocketCommandRunner(agent.environment())
+            runner(["unit-get", "--format=json", "private-address"])
+
+    @param handler: A function called with the tool name, its arguments and
+        its stdin (or None), returning a (return code, stdout, stderr) tuple
+        with the outputs as bytes, or None to drop the connection without
+        replying.
+    @param context_id: The hook context ID to advertise.
+    """
+
+    def __init__(self, handler, context_id="unit-test-0-1"):
+        self.handler = handler
+        self.context_id = context_id
+        self.requests = []
+        self._directory = tempfile.mkdtemp()
+        self.address = os.path.join(self._directory, "agent.socket")
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._server = _ThreadingUnixServer(
+            self.address, _AgentRequestHandler)
+        self._server.agent = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and remove the socket."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+        self._server = self._thread = None
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def environment(self):
+        """Return the environment variables pointing hooks at this agent."""
+        return {"JUJU_AGENT_SOCKET": self.address,
+                "JUJU_CONTEXT_ID": self.context_id}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+from charming.juju import hookenv
+from charming.juju.actions import ActionProgress, ActionResults, flatten
+
+
+class ActionResultsTest(TestCase):
+
+    def setUp(self):
+        self.addCleanup(hookenv._run_atexit)
+        self.commands = []
+
+    def test_flatten(self):
+        """
+        Nested dicts are flattened to dotted keys.
+        """
+        self.assertEqual(
+            {"backup.path": "/tmp/x", "backup.stats.size": 3, "ok": True},
+            flatten({"backup": {"path": "/tmp/x", "stats": {"size": 3}},
+                     "ok": True}))
+
+    def test_results_are_set_once_at_exit(self):
+        """
+        Results accumulate in memory and are set with a single action-set
+        at the end of the hook.
+        """
+        results = ActionResults(command_runner=self.commands.append)
+        results.set("backup", {"path": "/tmp/x", "size": 3})
+        results.set("outcome", "done")
+        self.assertEqual([], self.commands)
+        hookenv._run_atexit()
+        self.assertEqual(
+            [["action-set", "backup.path=/tmp/x", "backup.size=3",
+              "outcome=done"]],
+            self.commands)
+
+    def test_large_values_are_chunked(self):
+        """
+        Values above max_value_bytes are split over numbered keys, and the
+        arguments are spread over several action-set calls.
+        """
+        results = ActionResults(command_runner=self.commands.append,
+                                max_value_bytes=8, max_argv_bytes=30)
+        results.set("manifest", "abcdefgh12")
+        results.flush()
+        self.assertEqual(
+            [["action-set", "manifest.0=abcdefgh"],
+             ["action-set", "manifest.1=12"]],
+            self.commands)
+
+    def test_chunks_keep_characters_whole(self):
+        """
+        Chunks hold up to max_value_bytes bytes of UTF-8, and multi-byte
+        characters are never split between two chunks.
+        """
+        results = ActionResults(command_runner=self.commands.append,
+                                max_value_bytes=8)
+        results.set("name", "\u00e9" * 5)
+        results.flush()
+        self.assertEqual(
+            [["action-set", "name.0=" + "\u00e9" * 4, "name.1=\u00e9"]],
+            self.commands)
+
+
+class ActionProgressTest(TestCase):
+
+    def test_reports_are_rate_limited(self):
+        """
+        Messages sent within interval seconds of the previous one are
+        dropped, unless forced.
+        """
+        commands = []
+        progress = ActionProgress(command_runner=commands.append,
+                                  interval=60)
+        self.assertTrue(progress.report("Dumping", 1, 4))
+        self.assertFalse(progress.report("Dumping", 2, 4))
+        self.assertTrue(progress.report("Done", force=True))
+        self.assertEqual(
+            [["action-log", "Dumping (1/4, 25%)"], ["action-log", "Done"]],
+            commands)
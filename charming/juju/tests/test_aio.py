@@ -0,0 +1,161 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from charming.juju import hookenv, replay, trace
+from charming.juju.aio import AsyncEnvironment
+from charming.juju.hooks import Hooks
+
+
+class AsyncEnvironmentTest(TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self.running = 0
+        self.max_running = 0
+
+    async def fake_runner(self, command):
+        self.commands.append(command)
+        self.running += 1
+        self.max_running = max(self.running, self.max_running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if command[0] == "relation-ids":
+            return json.dumps(["db:1"])
+        if command[0] == "relation-list":
+            return json.dumps(["mysql/0"])
+        if command[0] == "relation-get":
+            return json.dumps({"host": "10.0.0.1"})
+        return json.dumps("10.0.0.1")
+
+    def test_queries_run_concurrently(self):
+        """
+        Independent queries gathered together run at the same time, within
+        the concurrency limit.
+        """
+        env = AsyncEnvironment({}, command_runner=self.fake_runner,
+                               concurrency=2)
+
+        async def query():
+            return await asyncio.gather(
+                env.unit_get("public-address"),
+                env.unit_get("private-address"),
+                env.get_related_units("db:1"))
+
+        self.assertEqual(["10.0.0.1", "10.0.0.1", ["mysql/0"]],
+                         asyncio.run(query()))
+        self.assertEqual(3, len(self.commands))
+        self.assertEqual(2, self.max_running)
+
+    def test_sync_command_runner(self):
+        """
+        Regular command runners are run in worker threads.
+        """
+        env = AsyncEnvironment(
+            {}, command_runner=lambda command: json.dumps("10.0.0.2"))
+        self.assertEqual(
+            "10.0.0.2", asyncio.run(env.unit_get("public-address")))
+
+
+    def test_sync_methods(self):
+        """
+        The methods that aren't coroutines run the hook tools synchronously,
+        with the same command runner.
+        """
+        env = AsyncEnvironment({"JUJU_UNIT_NAME": "wordpress/0"},
+                               command_runner=self.fake_runner)
+        env.metadata = {"requires": {"db": {"interface": "mysql"}}}
+        self.assertEqual(
+            ["mysql/0"], list(env.get_relation_index().units["db:1"]))
+        self.assertEqual(["mysql/0"], env.changed_units("db:1"))
+        self.assertEqual(
+            {"db": {"db:1": {"wordpress/0": {"host": "10.0.0.1"},
+                             "mysql/0": {"host": "10.0.0.1"}}}},
+            hookenv.relations(environment=env))
+
+    def test_cached_reads(self):
+        """
+        With caching enabled, coroutines and synchronous methods share the
+        cache of the wrapped Environment.
+        """
+        env = AsyncEnvironment({}, command_runner=self.fake_runner,
+                               cache=True)
+        self.assertEqual(
+            "10.0.0.1", asyncio.run(env.unit_get("public-address")))
+        self.assertEqual(
+            "10.0.0.1", asyncio.run(env.unit_get("public-address")))
+        self.assertEqual("10.0.0.1", env.sync.unit_get("public-address"))
+        self.assertEqual(1, len(self.commands))
+
+    def test_buffered_writes(self):
+        """
+        With buffered writes, relation_set() only runs relation-set when the
+        buffer is flushed.
+        """
+        env = AsyncEnvironment({"JUJU_UNIT_NAME": "wordpress/0"},
+                               command_runner=self.fake_runner,
+                               buffer_writes=True)
+        env.capabilities.has = lambda capability: False
+        asyncio.run(env.relation_set("db:1", {"host": "10.0.0.2"}))
+        self.assertEqual([], [command for command in self.commands
+                              if command[0] == "relation-set"])
+        env.flush()
+        self.assertEqual(
+            ["relation-set", "-r", "db:1", "host=10.0.0.2"],
+            self.commands[-1])
+
+    def test_traced(self):
+        """
+        Calls made by coroutines are traced like the synchronous ones.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        os.environ[trace.TRACE_ENV_KEY] = "1"
+        self.addCleanup(os.environ.pop, trace.TRACE_ENV_KEY)
+        self.addCleanup(setattr, trace, "_tracer", None)
+        env = AsyncEnvironment({}, command_runner=self.fake_runner)
+        asyncio.run(env.unit_get("public-address"))
+        env.sync.unit_get("private-address")
+        self.assertEqual(
+            ["unit-get", "unit-get"],
+            [call["tool"] for call in trace.get_tracer().calls])
+
+    def test_recorded(self):
+        """
+        Calls made by coroutines are recorded when CHARMING_RECORD is set.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "transcript.jsonl")
+        self.addCleanup(replay._transcripts.clear)
+        env = AsyncEnvironment({replay.RECORD_ENV_KEY: path},
+                               command_runner=self.fake_runner)
+        asyncio.run(env.get_related_units("db:1"))
+        replay._transcripts[path].close()
+        _, calls = replay.load_transcript(path)
+        self.assertEqual(
+            [["relation-list", "--format=json", "-r", "db:1"]],
+            [call["argv"] for call in calls])
+
+
+class AsyncHooksTest(TestCase):
+
+    def test_execute_coroutine_hook(self):
+        """
+        Hooks defined as coroutine functions are run to completion, and the
+        atexit callbacks run afterwards.
+        """
+        events = []
+        hooks = Hooks()
+
+        @hooks.hook("install")
+        async def install():
+            await asyncio.sleep(0)
+            events.append("install")
+
+        hookenv.atexit(events.append, "atexit")
+        hooks.execute(["hooks/install"])
+        self.assertEqual(["install", "atexit"], events)
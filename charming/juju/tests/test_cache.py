@@ -0,0 +1,54 @@
+import json
+from unittest import TestCase
+
+from charming.juju.hookenv import Environment
+
+
+class EnvironmentCacheTest(TestCase):
+
+    def setUp(self):
+        self.commands = []
+
+    def fake_runner(self, command):
+        self.commands.append(command)
+        if command[-1] == "--help":
+            return ""
+        return json.dumps({"foo": "bar"})
+
+    def test_cache_disabled_by_default(self):
+        """
+        Without opting in, every query runs the hook tool.
+        """
+        env = Environment({}, command_runner=self.fake_runner)
+        env.relation_get(unit="mysql/0", relation_id="db:1")
+        env.relation_get(unit="mysql/0", relation_id="db:1")
+        self.assertEqual(2, len(self.commands))
+        self.assertIsNone(env.cache_stats())
+
+    def test_identical_queries_run_once(self):
+        """
+        Identical queries made during a hook only run the hook tool once.
+        """
+        env = Environment({}, command_runner=self.fake_runner, cache=True)
+        first = env.relation_get(unit="mysql/0", relation_id="db:1")
+        second = env.relation_get(unit="mysql/0", relation_id="db:1")
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(self.commands))
+        self.assertEqual({"hits": 1, "misses": 1, "size": 1},
+                         env.cache_stats())
+
+    def test_relation_set_invalidates_relation(self):
+        """
+        Setting data on a relation drops the cached reads of that relation
+        only.
+        """
+        env = Environment({}, command_runner=self.fake_runner, cache=True)
+        env.relation_get(unit="mysql/0", relation_id="db:1")
+        env.relation_get(unit="mysql/0", relation_id="db:2")
+        env.relation_set(relation_id="db:1", data={"foo": "baz"})
+        del self.commands[:]
+        env.relation_get(unit="mysql/0", relation_id="db:1")
+        env.relation_get(unit="mysql/0", relation_id="db:2")
+        self.assertEqual(
+            [["relation-get", "--format=json", "-r", "db:1", "-", "mysql/0"]],
+            self.commands)
@@ -0,0 +1,44 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from charming.juju.capabilities import Capabilities
+
+
+class CapabilitiesTest(TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+
+    def fake_runner(self, command):
+        self.commands.append(command)
+        return "usage: relation-set [options] key=value...\n--file  ..."
+
+    def make_capabilities(self, version="2.0.1"):
+        return Capabilities(self.charm_dir, self.fake_runner,
+                            {"JUJU_VERSION": version})
+
+    def test_probe_results_are_persisted(self):
+        """
+        A probe runs once; later hooks on the same Juju version read the
+        result from the charm directory.
+        """
+        self.assertTrue(self.make_capabilities().has("relation-set-file"))
+        self.assertTrue(self.make_capabilities().has("relation-set-file"))
+        self.assertEqual([["relation-set", "--help"]], self.commands)
+
+    def test_probes_rerun_on_juju_upgrade(self):
+        """
+        Probe results recorded for another Juju version are discarded.
+        """
+        self.make_capabilities().has("relation-set-file")
+        self.make_capabilities("2.1.0").has("relation-set-file")
+        self.assertEqual(2, len(self.commands))
+
+    def test_juju_version_from_environment(self):
+        """
+        The Juju version is read from the hook environment when available.
+        """
+        self.assertEqual("2.0.1", self.make_capabilities().juju_version())
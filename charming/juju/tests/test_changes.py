@@ -0,0 +1,138 @@
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+from charming.juju import hookenv
+from charming.juju.changes import ConfigInput, RelationInput
+from charming.juju.hookenv import Environment
+from charming.juju.hooks import Hooks
+
+
+class ChangeDrivenHooksTest(TestCase):
+
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        self.config = {"port": 80, "title": "Hello"}
+        self.relation_data = {"host": "10.0.0.1"}
+        self.runs = []
+        self.commands = []
+
+    def fake_runner(self, command):
+        self.commands.append(command)
+        if command[0] == "config-get":
+            return json.dumps(self.config)
+        if command[0] == "relation-ids":
+            return json.dumps(["db:1"])
+        if command[0] == "relation-list":
+            return json.dumps(["mysql/0"])
+        if command[0] == "relation-get":
+            return json.dumps(self.relation_data)
+        return ""
+
+    def execute(self, hook_name, fail=False):
+        environment = Environment(
+            {"CHARM_DIR": self.charm_dir, "JUJU_UNIT_NAME": "wordpress/0"},
+            command_runner=self.fake_runner)
+        environment.metadata = {"requires": {"db": {"interface": "mysql"}},
+                                "provides": {"website": {"interface": "http"}}}
+        hooks = Hooks(environment=environment)
+
+        @hooks.hook("config-changed", inputs=[ConfigInput("port")])
+        def render():
+            self.runs.append("render")
+            if fail:
+                raise RuntimeError()
+
+        @hooks.hook("db-relation-changed", inputs=[RelationInput("db")])
+        def configure_db():
+            self.runs.append("configure_db")
+
+        hooks.execute([hook_name])
+
+    def test_handler_skipped_when_inputs_unchanged(self):
+        """
+        A handler only runs when one of its inputs changed since its last
+        successful run.
+        """
+        self.execute("config-changed")
+        self.config["title"] = "Changed, but not an input"
+        self.execute("config-changed")
+        self.config["port"] = 8080
+        self.execute("config-changed")
+        self.assertEqual(["render", "render"], self.runs)
+
+    def test_relation_input(self):
+        """
+        A relation input changes when the data of a remote unit on a relation
+        of its type changes. Only the relations of that type are queried.
+        """
+        self.execute("db-relation-changed")
+        self.execute("db-relation-changed")
+        self.relation_data["host"] = "10.0.0.2"
+        self.execute("db-relation-changed")
+        self.assertEqual(["configure_db", "configure_db"], self.runs)
+        self.assertEqual(
+            set([("relation-ids", "db")]),
+            set((command[0], command[-1]) for command in self.commands
+                if command[0] == "relation-ids"))
+
+    def test_failed_run_is_not_recorded(self):
+        """
+        Digests are only recorded when the hook succeeds, so a failed handler
+        runs again in the next hook.
+        """
+        with self.assertRaises(RuntimeError):
+            self.execute("config-changed", fail=True)
+        self.execute("config-changed")
+        self.assertEqual(["render", "render"], self.runs)
+
+
+class ChangedUnitsTest(TestCase):
+
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        self.addCleanup(hookenv._atexit.__delitem__, slice(None))
+        self.units = {"mysql/0": {"host": "10.0.0.1"},
+                      "mysql/1": {"host": "10.0.0.2"}}
+
+    def fake_runner(self, command):
+        if command[0] == "relation-list":
+            return json.dumps(sorted(self.units))
+        if command[0] == "relation-get":
+            return json.dumps(self.units[command[-1]])
+        return ""
+
+    def make_environment(self):
+        return Environment(
+            {"CHARM_DIR": self.charm_dir, "JUJU_RELATION_ID": "db:1"},
+            command_runner=self.fake_runner)
+
+    def test_changed_new_and_departed_units(self):
+        """
+        Units are compared with the digests recorded by the last successful
+        hook.
+        """
+        env = self.make_environment()
+        self.assertEqual(["mysql/0", "mysql/1"], env.changed_units())
+        self.assertEqual(["mysql/0", "mysql/1"], env.new_units())
+        hookenv._run_atexit()
+
+        self.units["mysql/1"]["host"] = "10.0.0.3"
+        del self.units["mysql/0"]
+        self.units["mysql/2"] = {}
+        env = self.make_environment()
+        self.assertEqual(["mysql/1", "mysql/2"], env.changed_units())
+        self.assertEqual(["mysql/2"], env.new_units())
+        self.assertEqual(["mysql/0"], env.departed_units("db:1"))
+
+    def test_digests_not_updated_on_failure(self):
+        """
+        Digests are only recorded when the hook succeeds.
+        """
+        self.make_environment().changed_units()
+        hookenv._run_atfailure()
+        self.assertEqual(["mysql/0", "mysql/1"],
+                         self.make_environment().changed_units())
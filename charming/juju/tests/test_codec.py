@@ -0,0 +1,121 @@
+import base64
+import json
+import zlib
+from unittest import TestCase
+
+from charming.juju.codec import CODEC_KEY, COMPRESSED, RelationCodec
+from charming.juju.hookenv import Environment
+
+
+class RelationCodecTest(TestCase):
+
+    def test_round_trip(self):
+        """
+        Large values are compressed and chunked, and decoded back. Small and
+        plain values are left as they are.
+        """
+        codec = RelationCodec(threshold=10, chunk_size=20)
+        big = "certificate " * 50
+        encoded = codec.encode({"cert": big, "host": "10.0.0.1"})
+        self.assertEqual("10.0.0.1", encoded["host"])
+        self.assertTrue(encoded["cert"].startswith("charming-codec:1:"))
+        chunks = [value for key, value in encoded.items()
+                  if key.startswith("cert.")]
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(value) <= 20 for value in chunks))
+        self.assertEqual({"cert": big, "host": "10.0.0.1"},
+                         codec.decode(encoded))
+
+    def test_marker_lookalikes_are_escaped(self):
+        """
+        A plain value looking like an encoded one is encoded, so it can't be
+        misread.
+        """
+        codec = RelationCodec()
+        value = "charming-codec:1:z:not really"
+        self.assertEqual(value, codec.decode(codec.encode({"k": value}))["k"])
+
+    def test_stale_chunks_are_unset(self):
+        """
+        Chunk keys of the previous value that the new one doesn't use are
+        unset.
+        """
+        codec = RelationCodec(threshold=10, chunk_size=20)
+        current = codec.encode({"cert": "x" * 5000 + "y" * 5000})
+        encoded = codec.encode({"cert": None}, current)
+        self.assertEqual(set(current) - {CODEC_KEY}, set(encoded))
+        self.assertEqual({None}, set(encoded.values()))
+
+    def test_undecodable_values_are_returned_as_stored(self):
+        """
+        Corrupted values, and values decompressing to more than max_size
+        bytes, are returned as they are stored.
+        """
+        codec = RelationCodec(max_size=1000)
+        bomb = COMPRESSED + base64.b64encode(
+            zlib.compress(b"x" * 100000)).decode("ascii")
+        for value in (COMPRESSED + "not base64!", COMPRESSED + "bm90IHpsaWI=",
+                      COMPRESSED + base64.b64encode(
+                          zlib.compress(b"\xff")).decode("ascii"),
+                      bomb):
+            self.assertEqual(value, codec.decode_value(value))
+        self.assertEqual({"k": "charming-codec:1:chunks:many"},
+                         codec.decode({"k": "charming-codec:1:chunks:many"}))
+
+
+class EnvironmentCodecTest(TestCase):
+
+    def setUp(self):
+        # The settings of each unit on the certs:1 relation.
+        self.settings = {"vault/0": {}, "client/0": {}}
+
+    def runner(self, command):
+        if command[0] == "relation-set" and "--help" not in command:
+            for argument in command[3:]:
+                key, value = argument.split("=", 1)
+                self.settings["vault/0"][key] = value or None
+            return ""
+        if command[0] == "relation-list":
+            return json.dumps(["client/0"])
+        if command[0] == "relation-get":
+            data = dict((key, value)
+                        for key, value in self.settings[command[5]].items()
+                        if value is not None)
+            if command[4] != "-":
+                return json.dumps(data.get(command[4]))
+            return json.dumps(data)
+        return ""
+
+    def environment(self):
+        return Environment(
+            {"JUJU_UNIT_NAME": "vault/0"}, command_runner=self.runner,
+            relation_codec=RelationCodec(threshold=10, chunk_size=50))
+
+    def test_relation_data_is_decoded_transparently(self):
+        """
+        With a codec, relation_set encodes large values once the remote units
+        advertised the codec, and relation_get decodes them, including single
+        attributes split over chunks.
+        """
+        self.settings["client/0"][CODEC_KEY] = "1"
+        environment = self.environment()
+        bundle = "".join(str(number) for number in range(500))
+        environment.relation_set("certs:1", {"bundle": bundle, "ok": "yes"})
+        self.assertGreater(len(self.settings["vault/0"]), 3)
+        self.assertEqual(
+            {"bundle": bundle, "ok": "yes"},
+            environment.relation_get(unit="vault/0", relation_id="certs:1"))
+        self.assertEqual(
+            bundle, environment.relation_get(
+                "bundle", unit="vault/0", relation_id="certs:1"))
+
+    def test_plain_values_until_remote_units_advertise_the_codec(self):
+        """
+        Values are written as they are, along with the advertisement of the
+        codec, until every remote unit advertised it.
+        """
+        environment = self.environment()
+        bundle = "".join(str(number) for number in range(500))
+        environment.relation_set("certs:1", {"bundle": bundle})
+        self.assertEqual({"bundle": bundle, CODEC_KEY: "1"},
+                         self.settings["vault/0"])
@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from charming.juju import hookenv
+from charming.juju.config import Config
+from charming.juju.hookenv import Environment
+
+
+class ConfigChangesTest(TestCase):
+
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        self.addCleanup(hookenv._run_atexit)
+        self.environment = Environment({"CHARM_DIR": self.charm_dir})
+        self.path = os.path.join(self.charm_dir, Config.CONFIG_FILE_NAME)
+
+    def test_changes_since_previous_hook(self):
+        """
+        The changes since the config saved by the previous hook are computed
+        when loading, and previous values are available.
+        """
+        Config(self.environment, {"port": 80, "old": "x"}).save()
+        config = Config(self.environment, {"port": 8080, "vhost": "a"})
+        config["mykey"] = "stored"
+        self.assertEqual(["port", "vhost"], config.changes.changed_keys())
+        self.assertEqual({"vhost"}, config.changes.added)
+        self.assertEqual({"old"}, config.changes.removed)
+        self.assertTrue(config.changed("port"))
+        self.assertFalse(config.changed("old"))
+        self.assertTrue(config.changed("mykey"))
+        self.assertEqual(80, config.previous("port"))
+
+    def test_values_changed_during_the_hook(self):
+        """
+        changed() compares with the current value, including config values
+        the charm replaced after loading.
+        """
+        Config(self.environment, {"port": 80, "vhost": "a"}).save()
+        config = Config(self.environment, {"port": 8080, "vhost": "a"})
+        config["port"] = 80
+        config["vhost"] = "b"
+        self.assertFalse(config.changed("port"))
+        self.assertTrue(config.changed("vhost"))
+
+    def test_stored_values_are_not_removed(self):
+        """
+        Only the keys config-get returned are reported as removed, not the
+        values stored by the charm.
+        """
+        config = Config(self.environment, {"port": 80})
+        config["mykey"] = "stored"
+        config.save()
+        config = Config(self.environment, {})
+        self.assertEqual({"port"}, config.changes.removed)
+        self.assertEqual("stored", config["mykey"])
+        self.assertNotIn(Config.CONFIG_KEYS_KEY, config)
+
+    def test_save_skipped_when_unchanged(self):
+        """
+        Saving rewrites the file atomically, and not at all when nothing
+        changed.
+        """
+        Config(self.environment, {"port": 80}).save()
+        os.utime(self.path, (0, 0))
+        config = Config(self.environment, {"port": 80})
+        config.save()
+        self.assertEqual(0, os.stat(self.path).st_mtime)
+        config["port"] = 81
+        config.save()
+        self.assertNotEqual(0, os.stat(self.path).st_mtime)
+        with open(self.path) as f:
+            self.assertEqual(
+                {"port": 81, Config.CONFIG_KEYS_KEY: ["port"]}, json.load(f))
+        self.assertEqual([Config.CONFIG_FILE_NAME],
+                         os.listdir(self.charm_dir))
+
+    def test_values_changed_in_place(self):
+        """
+        A stored value changed in place during the hook is reported as
+        changed, and its previous value is left alone.
+        """
+        config = Config(self.environment, {})
+        config["hosts"] = ["10.0.0.1"]
+        config.save()
+        config = Config(self.environment, {})
+        self.assertFalse(config.changed("hosts"))
+        config["hosts"].append("10.0.0.2")
+        self.assertTrue(config.changed("hosts"))
+        self.assertEqual(["10.0.0.1"], config.previous("hosts"))
+
+    def test_save_keeps_file_mode(self):
+        """
+        Replacing the saved config keeps the mode of the file.
+        """
+        Config(self.environment, {"port": 80}).save()
+        os.chmod(self.path, 0o640)
+        Config(self.environment, {"port": 81}).save()
+        self.assertEqual(0o640, os.stat(self.path).st_mode & 0o777)
@@ -0,0 +1,199 @@
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from unittest import TestCase
+
+import charming
+from charming.juju import dispatcher
+
+SCRIPT = textwrap.dedent("""\
+    import os
+    import sys
+    import time
+
+    from charming.juju import dispatcher
+    from charming.juju.hooks import Hooks
+
+    hooks = Hooks()
+
+
+    @hooks.hook("update-status")
+    def update_status():
+        print("{} {} {}".format(
+            os.environ["MARKER"], os.path.basename(sys.argv[0]),
+            os.getppid()))
+
+
+    @hooks.hook("stop")
+    def stop():
+        sys.exit(3)
+
+
+    @hooks.hook("leader-elected")
+    def leader_elected():
+        with open(os.environ["MARKER"], "a") as f:
+            f.write("run\\n")
+        if dispatcher.serving:
+            # The dispatcher dies while the hook runs.
+            os.kill(os.getppid(), 9)
+
+
+    @hooks.hook("upgrade-charm")
+    def upgrade_charm():
+        with open(os.environ["MARKER"], "w") as f:
+            f.write(str(os.getpid()))
+        time.sleep(60)
+
+
+    if __name__ == "__main__":
+        hooks.execute(sys.argv)
+    """)
+
+
+class DispatcherTest(TestCase):
+
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        self.script = os.path.join(self.charm_dir, "hooks.py")
+        with open(self.script, "w") as f:
+            f.write(SCRIPT)
+        self.dispatcher_pids = set()
+        self.addCleanup(self.stop_dispatchers)
+
+    def stop_dispatchers(self):
+        for pid in self.dispatcher_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def start_hook(self, hook_name, marker="-", enabled=True, **env):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(
+            charming.__file__)))
+        env = dict(os.environ, CHARM_DIR=self.charm_dir, PYTHONPATH=root,
+                   MARKER=marker, **env)
+        if enabled:
+            env[dispatcher.DISPATCHER_ENV_KEY] = "1"
+        hook = os.path.join(self.charm_dir, hook_name)
+        if not os.path.exists(hook):
+            os.symlink(self.script, hook)
+        return subprocess.Popen(
+            [sys.executable, hook, hook_name], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True)
+
+    def run_hook(self, hook_name, marker="-", enabled=True, **env):
+        process = self.start_hook(hook_name, marker, enabled, **env)
+        output = process.communicate()[0]
+        return process.returncode, output.split()
+
+    def test_hooks_run_in_the_dispatcher(self):
+        """
+        Hooks run in children of a single dispatcher, with their own argv,
+        environment and stdio, and exit codes are forwarded.
+        """
+        status, (marker, argv0, first_pid) = self.run_hook(
+            "update-status", "first")
+        self.dispatcher_pids.add(int(first_pid))
+        self.assertEqual((0, "first", "update-status"),
+                         (status, marker, argv0))
+        status, (marker, _, second_pid) = self.run_hook(
+            "update-status", "second")
+        self.assertEqual((0, "second", first_pid),
+                         (status, marker, second_pid))
+        self.assertEqual(3, self.run_hook("stop")[0])
+
+    def test_dispatcher_restarts_when_code_changes(self):
+        """
+        A dispatcher whose code changed on disk is replaced.
+        """
+        _, (_, _, first_pid) = self.run_hook("update-status")
+        self.dispatcher_pids.add(int(first_pid))
+        os.utime(self.script, (0, 0))
+        _, (_, _, second_pid) = self.run_hook("update-status")
+        self.dispatcher_pids.add(int(second_pid))
+        self.assertNotEqual(first_pid, second_pid)
+
+    def test_hook_state_is_reset(self):
+        """
+        Hooks don't inherit the tracing settings of the hook that started the
+        dispatcher.
+        """
+        _, (_, _, pid) = self.run_hook(
+            "update-status", CHARMING_TRACE="1")
+        self.dispatcher_pids.add(int(pid))
+        self.run_hook("update-status")
+        with open(os.path.join(self.charm_dir, ".charming-trace.jsonl")) as f:
+            self.assertEqual(1, len(f.readlines()))
+
+    def test_accepted_hooks_never_run_again(self):
+        """
+        When the dispatcher dies while running a hook, the hook fails rather
+        than run a second time.
+        """
+        marker = os.path.join(self.charm_dir, "runs")
+        status, _ = self.run_hook("leader-elected", marker)
+        self.assertEqual(1, status)
+        for _ in range(100):
+            if os.path.exists(marker):
+                break
+            time.sleep(0.05)
+        with open(marker) as f:
+            self.assertEqual(["run"], f.read().split())
+
+    def test_child_killed_with_the_hook_process(self):
+        """
+        The child running a hook is killed when the hook process goes away,
+        for instance because Juju killed it.
+        """
+        marker = os.path.join(self.charm_dir, "pid")
+        process = self.start_hook("upgrade-charm", marker)
+        for _ in range(200):
+            if os.path.exists(marker) and os.path.getsize(marker):
+                break
+            time.sleep(0.05)
+        with open(marker) as f:
+            pid = int(f.read())
+        self.dispatcher_pids.add(int(subprocess.check_output(
+            ["ps", "-o", "ppid=", "-p", str(pid)])))
+        process.kill()
+        process.wait()
+        for _ in range(100):
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                break
+            time.sleep(0.05)
+        else:
+            self.fail("The hook still runs")
+
+    def test_in_process_without_dispatcher(self):
+        """
+        Without the opt-in, hooks run in the hook process.
+        """
+        status, (_, _, parent_pid) = self.run_hook(
+            "update-status", "x", enabled=False)
+        self.assertEqual((0, str(os.getpid())), (status, parent_pid))
+
+    def test_main_falls_back_to_in_process(self):
+        """
+        The main() entry point runs the charm script in-process, with the
+        hook name in argv[0], when the dispatcher isn't enabled.
+        """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(
+            charming.__file__)))
+        env = dict(os.environ, CHARM_DIR=self.charm_dir, PYTHONPATH=root,
+                   MARKER="main")
+        env.pop(dispatcher.DISPATCHER_ENV_KEY, None)
+        output = subprocess.check_output(
+            [sys.executable, "-c",
+             "from charming.juju.dispatcher import main; "
+             "main('hooks.py', ['update-status'])"],
+            env=env, universal_newlines=True)
+        self.assertEqual(["main", "update-status"], output.split()[:2])
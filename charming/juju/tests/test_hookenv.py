@@ -1,5 +1,9 @@
+import logging
 from unittest import TestCase
-from charming.juju.hookenv import log
+
+from charming.juju import hookenv
+from charming.juju.hooks import Hooks
+from charming.juju.log import JujuLogHandler, log
 
 
 class LogTest(TestCase):
@@ -19,3 +23,86 @@ class LogTest(TestCase):
         log("Test", command_runner=self.fake_runner)
         expected = [["juju-log", "-l", "INFO", "Test"]]
         self.assertEqual(expected, self.commands)
+
+
+class JujuLogHandlerTest(TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self.logger = logging.getLogger("charming-test")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = JujuLogHandler(
+            level=logging.INFO, command_runner=self.fake_runner)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def fake_runner(self, command):
+        self.commands.append(command)
+
+    def test_records_are_batched_per_level(self):
+        """
+        Records are buffered and written with one juju-log call per level,
+        and records below the handler level are dropped.
+        """
+        self.logger.debug("dropped")
+        self.logger.info("one")
+        self.logger.warning("careful")
+        self.logger.info("two")
+        self.assertEqual([], self.commands)
+        self.handler.flush()
+        self.assertEqual(
+            [["juju-log", "-l", "WARNING", "careful"],
+             ["juju-log", "-l", "INFO", "one\ntwo"]],
+            self.commands)
+
+    def test_capacity_triggers_flush(self):
+        """
+        Reaching the buffer capacity flushes the buffered records.
+        """
+        self.handler.capacity = 2
+        self.logger.info("one")
+        self.logger.info("two")
+        self.assertEqual([["juju-log", "-l", "INFO", "one\ntwo"]],
+                         self.commands)
+
+    def test_errors_are_flushed_when_hook_fails(self):
+        """
+        Buffered records are written before an exception escapes
+        Hooks.execute.
+        """
+        hooks = Hooks()
+
+        @hooks.hook("install")
+        def install():
+            self.logger.error("broken")
+            self.assertEqual([], self.commands)
+            raise RuntimeError()
+
+        with self.assertRaises(RuntimeError):
+            hooks.execute(["install"])
+        self.assertEqual([["juju-log", "-l", "ERROR", "broken"]],
+                         self.commands)
+        self.assertEqual([], hookenv._atexit)
+
+    def test_records_are_flushed_after_every_hook(self):
+        """
+        The handler outlives hooks run in the same process, and writes the
+        records buffered in each of them when that hook ends.
+        """
+        hooks = Hooks()
+
+        @hooks.hook("install")
+        def install():
+            self.logger.info("installed")
+
+        @hooks.hook("start")
+        def start():
+            self.logger.info("started")
+
+        hooks.execute(["install"])
+        hooks.execute(["start"])
+        self.assertEqual([["juju-log", "-l", "INFO", "installed"],
+                          ["juju-log", "-l", "INFO", "started"]],
+                         self.commands)
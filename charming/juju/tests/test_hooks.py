@@ -0,0 +1,238 @@
+import asyncio
+import threading
+from unittest import TestCase
+
+from charming.juju import hookenv
+from charming.juju.changes import ConfigInput
+from charming.juju.hookenv import HookExecutionError
+from charming.juju.hooks import Hooks
+
+
+class MultipleHandlersTest(TestCase):
+
+    def setUp(self):
+        self.addCleanup(hookenv._run_atexit)
+        self.runs = []
+
+    def test_handlers_run_in_dependency_order(self):
+        """
+        All the handlers of a hook run, each after the handlers it was
+        declared to run after.
+        """
+        hooks = Hooks()
+
+        @hooks.hook("config-changed", after=["render"])
+        def restart():
+            self.runs.append("restart")
+
+        @hooks.hook("config-changed")
+        def render():
+            self.runs.append("render")
+
+        @hooks.hook("config-changed")
+        def open_ports():
+            self.runs.append("open_ports")
+
+        hooks.execute(["config-changed"])
+        self.assertEqual(["render", "restart", "open_ports"], self.runs)
+
+    def test_independent_handlers_run_concurrently(self):
+        """
+        With several workers, independent handlers run at the same time.
+        """
+        hooks = Hooks(workers=2)
+        barrier = threading.Barrier(2, timeout=5)
+
+        @hooks.hook("install")
+        def install_packages():
+            barrier.wait()
+            self.runs.append("packages")
+
+        @hooks.hook("install")
+        def install_users():
+            barrier.wait()
+            self.runs.append("users")
+
+        @hooks.hook("install", after=[install_packages, install_users])
+        def start():
+            self.runs.append("start")
+
+        hooks.execute(["install"])
+        self.assertEqual("start", self.runs[-1])
+        self.assertEqual(3, len(self.runs))
+
+    def test_errors_are_aggregated(self):
+        """
+        A failing handler doesn't prevent the unrelated ones from running, but
+        the handlers depending on it are skipped. The failures are reported
+        together once every handler ran.
+        """
+        for workers in (1, 4):
+            self.runs = []
+            hooks = Hooks(workers=workers)
+
+            @hooks.hook("start")
+            def first():
+                raise ValueError("first")
+
+            @hooks.hook("start", after=[first])
+            def dependent():
+                self.runs.append("dependent")
+
+            @hooks.hook("start")
+            def second():
+                raise KeyError("second")
+
+            @hooks.hook("start")
+            def unrelated():
+                self.runs.append("unrelated")
+
+            with self.assertRaises(HookExecutionError) as context:
+                hooks.execute(["start"])
+            self.assertEqual(["unrelated"], self.runs)
+            self.assertEqual(
+                ["first", "second"],
+                [name for name, _ in context.exception.errors])
+
+    def test_execute_async_aggregates_errors(self):
+        """
+        execute_async() orders the handlers and reports their failures like
+        execute() does.
+        """
+        hooks = Hooks()
+
+        @hooks.hook("start", after=["third"])
+        async def first():
+            self.runs.append("first")
+            raise ValueError("first")
+
+        @hooks.hook("start", after=[first])
+        def dependent():
+            self.runs.append("dependent")
+
+        @hooks.hook("start")
+        def second():
+            raise KeyError("second")
+
+        @hooks.hook("start")
+        async def third():
+            self.runs.append("third")
+
+        with self.assertRaises(HookExecutionError) as context:
+            asyncio.run(hooks.execute_async(["start"]))
+        self.assertEqual(["third", "first"], self.runs)
+        self.assertEqual(
+            ["first", "second"],
+            [name for name, _ in context.exception.errors])
+
+    def test_interrupts_are_not_aggregated(self):
+        """
+        A KeyboardInterrupt stops the hook right away, instead of being
+        reported along with the handler failures.
+        """
+        hooks = Hooks()
+
+        @hooks.hook("start")
+        def first():
+            raise KeyboardInterrupt()
+
+        @hooks.hook("start")
+        def second():
+            self.runs.append("second")
+
+        self.assertRaises(KeyboardInterrupt, hooks.execute, ["start"])
+        self.assertEqual([], self.runs)
+
+    def test_single_error_propagates(self):
+        """
+        When a single handler fails, its own exception is raised, and
+        successful sys.exit() calls are not failures.
+        """
+        hooks = Hooks()
+
+        @hooks.hook("stop")
+        def failing():
+            raise ValueError("failed")
+
+        @hooks.hook("stop")
+        def exiting():
+            raise SystemExit(0)
+
+        self.assertRaises(ValueError, hooks.execute, ["stop"])
+
+    def test_circular_dependencies(self):
+        """
+        Handlers depending on each other are refused.
+        """
+        hooks = Hooks()
+
+        @hooks.hook("stop", after=["second"])
+        def first():
+            pass
+
+        @hooks.hook("stop", after=[first])
+        def second():
+            pass
+
+        self.assertRaises(ValueError, hooks.execute, ["stop"])
+
+
+class HookPreparationTest(TestCase):
+
+    def setUp(self):
+        self.addCleanup(hookenv._run_atexit)
+        self.failures = []
+
+    def test_atfailure_runs_when_hook_is_unregistered(self):
+        """
+        Preparing the hook is part of it: the atfailure callbacks run when
+        the hook has no registered handler.
+        """
+        hooks = Hooks()
+        hookenv.atfailure(self.failures.append, "failed")
+        self.assertRaises(
+            hookenv.UnregisteredHookError, hooks.execute, ["install"])
+        self.assertEqual(["failed"], self.failures)
+
+    def test_atfailure_runs_when_atstart_fails(self):
+        """
+        The atfailure callbacks run when an atstart callback fails, whether
+        the hook is executed synchronously or in an event loop.
+        """
+        hooks = Hooks()
+
+        @hooks.hook("install")
+        def install():
+            pass
+
+        for execute in (hooks.execute,
+                        lambda args: asyncio.run(hooks.execute_async(args))):
+            hookenv.atstart(int, "not a number")
+            hookenv.atfailure(self.failures.append, "failed")
+            self.assertRaises(ValueError, execute, ["install"])
+        self.assertEqual(["failed", "failed"], self.failures)
+
+    def test_inputs_without_charm_dir(self):
+        """
+        Without a charm directory to record the inputs of a handler in, the
+        handler runs every time.
+        """
+        runs = []
+        environment = hookenv.Environment(
+            {}, command_runner=lambda command: '{"port": 80}')
+        hooks = Hooks(environment=environment)
+
+        @hooks.hook("config-changed", inputs=[ConfigInput("port")])
+        def render():
+            runs.append("render")
+
+        hooks.execute(["config-changed"])
+        hooks.execute(["config-changed"])
+        self.assertEqual(["render", "render"], runs)
+
+    def test_unexpected_hook_arguments(self):
+        """
+        Only the inputs and after keyword arguments are accepted by hook().
+        """
+        hooks = Hooks()
+        self.assertRaises(TypeError, hooks.hook, "install", input=[])
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+import charming
+
+# Modules that a hook must not pay for unless it uses them.
+LAZY_MODULES = ("yaml", "distutils", "tempfile", "glob", "subprocess",
+                "concurrent.futures", "asyncio", "socket", "threading", "copy")
+
+# Cold import budget of charming.juju.hooks, in microseconds. It is generous
+# on purpose: it is meant to catch a heavy import slipping in (importing
+# distutils alone takes hundreds of milliseconds), not small variations.
+IMPORT_BUDGET_US = 150000
+
+
+def cold_import(module, statement):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(
+        charming.__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    return subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c",
+         "import {}; {}".format(module, statement)],
+        stderr=subprocess.STDOUT, universal_newlines=True, env=env)
+
+
+class ImportTimeTest(TestCase):
+
+    def test_heavy_modules_are_lazy(self):
+        """
+        Importing the hooks framework doesn't import modules only some code
+        paths need.
+        """
+        output = cold_import(
+            "charming.juju.hooks",
+            "import sys; print([m for m in {!r} if m in sys.modules])".format(
+                LAZY_MODULES))
+        self.assertEqual("[]", output.splitlines()[-1])
+
+    def test_import_budget(self):
+        """
+        The cold import of charming.juju.hooks stays within budget, taking
+        the best of a few runs to smooth out noise.
+        """
+        best = None
+        for _ in range(3):
+            for line in cold_import("charming.juju.hooks", "").splitlines():
+                if line.endswith("| charming.juju.hooks"):
+                    cumulative = int(line.split("|")[1])
+                    best = cumulative if best is None else min(
+                        best, cumulative)
+        self.assertLess(best, IMPORT_BUDGET_US)
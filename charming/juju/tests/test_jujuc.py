@@ -0,0 +1,104 @@
+import io
+import json
+import sys
+from subprocess import CalledProcessError
+from unittest import TestCase
+
+from charming.juju.hookenv import Environment
+from charming.juju.jujuc import JujucError, SocketCommandRunner
+from charming.juju.testing.agent import FakeAgentServer
+
+
+class SocketCommandRunnerTest(TestCase):
+
+    def setUp(self):
+        self.fallback_commands = []
+        self.agent = FakeAgentServer(self.handler)
+        self.agent.start()
+        self.addCleanup(self.agent.stop)
+
+    def handler(self, command_name, args, stdin):
+        if command_name == "relation-get":
+            return 0, json.dumps({"args": args}).encode("utf-8"), b""
+        if command_name == "relation-set":
+            # The agent goes away after receiving the request.
+            return None
+        return 2, b"", b"error: no such thing"
+
+    def fake_fallback(self, command):
+        self.fallback_commands.append(command)
+        return "fallback"
+
+    def test_hook_tools_go_through_the_socket(self):
+        """
+        Hook tools are sent to the agent, reusing a single connection.
+        """
+        runner = SocketCommandRunner(
+            self.agent.environment(), fallback=self.fake_fallback)
+        env = Environment({}, command_runner=runner)
+        for unit in ("mysql/0", "mysql/1"):
+            result = env.relation_get(unit=unit, relation_id="db:1")
+            self.assertEqual(
+                {"args": ["--format=json", "-r", "db:1", "-", unit]}, result)
+        self.assertEqual([], self.fallback_commands)
+        self.assertEqual(
+            ["unit-test-0-1", "unit-test-0-1"],
+            [request["ContextId"] for request in self.agent.requests])
+
+    def test_failing_tool_raises(self):
+        """
+        A non-zero return code from the agent raises CalledProcessError, like
+        the subprocess runner does.
+        """
+        runner = SocketCommandRunner(
+            self.agent.environment(), fallback=self.fake_fallback)
+        with self.assertRaises(CalledProcessError) as error:
+            runner(["unit-get", "--format=json", "public-address"])
+        self.assertEqual(2, error.exception.returncode)
+
+    def test_stderr_is_forwarded(self):
+        """
+        What the tool writes to stderr is written to the hook's stderr, like
+        the jujuc tool does.
+        """
+        runner = SocketCommandRunner(
+            self.agent.environment(), fallback=self.fake_fallback)
+        stderr = io.StringIO()
+        self.addCleanup(setattr, sys, "stderr", sys.stderr)
+        sys.stderr = stderr
+        self.assertRaises(CalledProcessError, runner, ["unit-get", "x"])
+        self.assertEqual("error: no such thing", stderr.getvalue())
+
+    def test_no_fallback_once_sent(self):
+        """
+        A request failing after it was sent to the agent isn't run again by
+        the fallback runner.
+        """
+        runner = SocketCommandRunner(
+            self.agent.environment(), fallback=self.fake_fallback)
+        self.assertRaises(JujucError, runner, ["relation-set", "a=b"])
+        self.assertEqual([], self.fallback_commands)
+
+    def test_fallback_without_agent(self):
+        """
+        Without an agent socket in the environment, or for commands that are
+        not hook tools, the fallback runner is used.
+        """
+        runner = SocketCommandRunner({}, fallback=self.fake_fallback)
+        self.assertEqual("fallback", runner(["relation-ids", "db"]))
+        runner = SocketCommandRunner(
+            self.agent.environment(), fallback=self.fake_fallback)
+        self.assertEqual("fallback", runner(["ls", "-l"]))
+        self.assertEqual([["relation-ids", "db"], ["ls", "-l"]],
+                         self.fallback_commands)
+        self.assertEqual([], self.agent.requests)
+
+    def test_fallback_when_agent_unreachable(self):
+        """
+        If the agent socket cannot be reached, the fallback runner is used.
+        """
+        environment = self.agent.environment()
+        self.agent.stop()
+        runner = SocketCommandRunner(environment, fallback=self.fake_fallback)
+        self.assertEqual("fallback", runner(["relation-ids", "db"]))
+        self.assertIsNone(runner.client)
@@ -0,0 +1,52 @@
+import json
+from unittest import TestCase
+
+from charming.juju.hookenv import Environment
+from charming.juju.leadership import Leadership
+
+
+class LeadershipTest(TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self.settings = {"password": "secret", "vip": "10.0.0.10"}
+
+    def fake_runner(self, command):
+        self.commands.append(command)
+        if command[0] == "is-leader":
+            return "true"
+        if command[0] == "leader-get":
+            return json.dumps(self.settings)
+        return ""
+
+    def make_leadership(self):
+        return Leadership(Environment({}, command_runner=self.fake_runner))
+
+    def test_reads_are_served_from_memory(self):
+        """
+        is-leader and leader-get only run once, however many reads are made.
+        """
+        leadership = self.make_leadership()
+        self.assertTrue(leadership.is_leader())
+        self.assertTrue(leadership.is_leader())
+        self.assertEqual("secret", leadership.leader_get("password"))
+        self.assertEqual(self.settings, leadership.leader_get())
+        self.assertIsNone(leadership.leader_get("missing"))
+        self.assertEqual(["is-leader", "leader-get"],
+                         [command[0] for command in self.commands])
+
+    def test_leader_set_sends_changes_only(self):
+        """
+        leader-set only carries the changed and removed keys, and isn't run
+        when nothing changed.
+        """
+        leadership = self.make_leadership()
+        leadership.leader_set(
+            {"password": "secret", "vip": None, "port": 8080})
+        leadership.leader_set(password="secret", port="8080")
+        self.assertEqual(
+            [["leader-get", "--format=json", "-"],
+             ["leader-set", "port=8080", "vip="]],
+            self.commands)
+        self.assertEqual({"password": "secret", "port": "8080"},
+                         leadership.leader_get())
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from charming.juju import metadata
+from charming.juju.metadata import MetadataIndex, load_metadata
+
+METADATA = """
+name: wordpress
+provides:
+  website:
+    interface: http
+requires:
+  db:
+    interface: mysql
+  cache:
+    interface: memcache
+peers:
+  cluster:
+    interface: http
+"""
+
+
+class LoadMetadataTest(TestCase):
+
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        with open(os.path.join(self.charm_dir, "metadata.yaml"), "w") as f:
+            f.write(METADATA)
+        self.parsed = []
+        original = metadata._parse_yaml
+
+        def counting_parse(path):
+            self.parsed.append(path)
+            return original(path)
+        metadata._parse_yaml = counting_parse
+        self.addCleanup(setattr, metadata, "_parse_yaml", original)
+
+    def test_parsed_metadata_is_cached(self):
+        """
+        The YAML is only parsed once as long as metadata.yaml is unchanged.
+        """
+        first = load_metadata(self.charm_dir)
+        second = load_metadata(self.charm_dir)
+        self.assertEqual("wordpress", first["name"])
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(self.parsed))
+
+    def test_changed_metadata_is_parsed_again(self):
+        """
+        Changing metadata.yaml invalidates the cache.
+        """
+        load_metadata(self.charm_dir)
+        with open(os.path.join(self.charm_dir, "metadata.yaml"), "a") as f:
+            f.write("subordinate: false\n")
+        self.assertFalse(load_metadata(self.charm_dir)["subordinate"])
+        self.assertEqual(2, len(self.parsed))
+
+    def test_metadata_changed_by_json_is_not_cached(self):
+        """
+        Metadata that doesn't survive a JSON round-trip unchanged, such as
+        integer keys, is parsed from the YAML every time.
+        """
+        with open(os.path.join(self.charm_dir, "metadata.yaml"), "a") as f:
+            f.write("resources:\n  1: first\n")
+        for _ in range(2):
+            self.assertEqual(
+                {1: "first"}, load_metadata(self.charm_dir)["resources"])
+        self.assertEqual(2, len(self.parsed))
+
+
+class MetadataIndexTest(TestCase):
+
+    def setUp(self):
+        import yaml
+        self.index = MetadataIndex(yaml.safe_load(METADATA))
+
+    def test_lookups(self):
+        """
+        Relations are looked up by name, interface, and role and interface,
+        in the order they are declared in.
+        """
+        self.assertEqual(["website", "db", "cache", "cluster"],
+                         self.index.relation_types)
+        self.assertEqual(("requires", "mysql"),
+                         self.index.relation_to_role_and_interface("db"))
+        self.assertEqual((None, None),
+                         self.index.relation_to_role_and_interface("nope"))
+        self.assertEqual(["website", "cluster"],
+                         self.index.interface_to_relations("http"))
+        self.assertEqual(
+            ["cluster"],
+            self.index.role_and_interface_to_relations("peers", "http"))
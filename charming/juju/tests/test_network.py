@@ -0,0 +1,63 @@
+import json
+import shutil
+import tempfile
+from subprocess import CalledProcessError
+from unittest import TestCase
+
+from charming.juju.hookenv import Environment
+from charming.juju.network import Network, port_spec
+
+
+class EnsurePortsTest(TestCase):
+
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        self.commands = []
+        self.opened = ["80/tcp", "8000-8100/tcp", "icmp"]
+
+    def make_network(self, opened_ports=True):
+        def runner(command):
+            self.commands.append(command)
+            if command[0] == "opened-ports":
+                if not opened_ports:
+                    raise CalledProcessError(1, command)
+                return json.dumps(self.opened)
+            return ""
+        return Network(Environment({"CHARM_DIR": self.charm_dir},
+                                   command_runner=runner))
+
+    def test_port_spec(self):
+        """
+        Ports, ranges and protocols are normalized.
+        """
+        self.assertEqual("80/tcp", port_spec(80))
+        self.assertEqual("53/udp", port_spec("53", "UDP"))
+        self.assertEqual("8000-8100/tcp", port_spec((8000, 8100)))
+        self.assertEqual("icmp", port_spec("ICMP"))
+
+    def test_only_changes_are_applied(self):
+        """
+        Only the missing ports are opened and the unwanted ones closed.
+        """
+        network = self.make_network()
+        opened, closed = network.ensure_ports(
+            {80, (8000, 8100), "53/udp"})
+        self.assertEqual(({"53/udp"}, {"icmp"}), (opened, closed))
+        self.assertEqual(
+            [["opened-ports", "--format=json"], ["close-port", "icmp"],
+             ["open-port", "53/udp"]],
+            self.commands)
+
+    def test_persisted_record_without_opened_ports(self):
+        """
+        Without opened-ports, the ports opened by the previous hook are read
+        from the record ensure_ports() keeps.
+        """
+        self.make_network(opened_ports=False).ensure_ports([80, 443])
+        self.commands = []
+        network = self.make_network(opened_ports=False)
+        self.assertEqual((set(), {"443/tcp"}), network.ensure_ports([80]))
+        self.assertEqual(
+            [["opened-ports", "--format=json"], ["close-port", "443/tcp"]],
+            self.commands)
@@ -0,0 +1,58 @@
+import json
+from unittest import TestCase
+
+from charming.juju import hookenv
+from charming.juju.hookenv import Environment
+
+
+class BufferedRelationSetTest(TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self.addCleanup(hookenv._atexit.__delitem__, slice(None))
+
+    def fake_runner(self, command):
+        self.commands.append(command)
+        if command[-1] == "--help":
+            return ""
+        if command[0] == "relation-get":
+            return json.dumps({"host": "10.0.0.1", "port": "3306"})
+        return ""
+
+    def make_environment(self):
+        return Environment(
+            {"JUJU_UNIT_NAME": "mysql/0", "JUJU_RELATION_ID": "db:1"},
+            command_runner=self.fake_runner, buffer_writes=True)
+
+    def test_writes_are_merged_per_relation(self):
+        """
+        Buffered writes to the same relation ID are merged and published
+        with a single relation-set at the end of the hook.
+        """
+        env = self.make_environment()
+        env.relation_set(data={"user": "wordpress"})
+        env.relation_set(relation_id="db:1", password="secret")
+        env.relation_set(relation_id="db:2", user="other")
+        self.assertEqual([], self.commands)
+
+        hookenv._run_atexit()
+        relation_sets = [command for command in self.commands
+                         if command[0] == "relation-set" and
+                         command[-1] != "--help"]
+        self.assertEqual(
+            [["relation-set", "-r", "db:1", "password=secret",
+              "user=wordpress"],
+             ["relation-set", "-r", "db:2", "user=other"]],
+            [command[:3] + sorted(command[3:])
+             for command in relation_sets])
+
+    def test_unchanged_keys_are_skipped(self):
+        """
+        Keys already holding the same value on the relation are not sent, and
+        nothing is run when no key changed.
+        """
+        env = self.make_environment()
+        env.relation_set(host="10.0.0.1", port=3306)
+        env.flush()
+        self.assertEqual(
+            ["relation-get"], [command[0] for command in self.commands])
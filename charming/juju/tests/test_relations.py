@@ -0,0 +1,122 @@
+import json
+from unittest import TestCase
+
+from charming.juju.hookenv import Environment
+
+
+class RelationViewsTest(TestCase):
+
+    def setUp(self):
+        self.commands = []
+
+    def fake_runner(self, command):
+        self.commands.append(command)
+        if command[0] == "relation-ids":
+            return json.dumps(["cluster:1"])
+        if command[0] == "relation-list":
+            return json.dumps(["db/{}".format(n) for n in range(500)])
+        if command[0] == "relation-get":
+            unit = command[-1]
+            return json.dumps({"name": unit, "port": "5432",
+                               "hosts-list": "10.0.0.1 10.0.0.2"})
+        return ""
+
+    def make_environment(self):
+        return Environment({"JUJU_UNIT_NAME": "app/0"},
+                           command_runner=self.fake_runner)
+
+    def test_views_are_lazy(self):
+        """
+        Getting a relation view runs nothing, and only the units whose data
+        is accessed are fetched.
+        """
+        environment = self.make_environment()
+        relation = environment.get_relation("cluster:1")
+        self.assertEqual([], self.commands)
+        self.assertEqual("cluster", relation.relation_type)
+        units = list(relation)
+        self.assertEqual(500, len(units))
+        self.assertEqual("db/3", units[3]["name"])
+        self.assertEqual("db/7", units[7].get("name"))
+        self.assertEqual(
+            ["relation-list", "relation-get", "relation-get"],
+            [command[0] for command in self.commands])
+        self.assertFalse(units[8].loaded)
+
+    def test_typed_accessors(self):
+        """
+        List and integer values are parsed on access, without altering the
+        data.
+        """
+        environment = self.make_environment()
+        unit = environment.get_relation_for_unit("db/1", "cluster:1")
+        self.assertEqual(["10.0.0.1", "10.0.0.2"], unit.get_list("hosts-list"))
+        self.assertEqual([], unit.get_list("missing-list"))
+        self.assertEqual(5432, unit.get_int("port"))
+        self.assertEqual("10.0.0.1 10.0.0.2", unit["hosts-list"])
+        with self.assertRaises(TypeError):
+            unit.data["port"] = "1"
+
+    def test_relations_of_type(self):
+        """
+        Every relation of a type yields its remote units.
+        """
+        environment = self.make_environment()
+        relations = environment.get_relations("cluster")
+        self.assertEqual(["cluster:1"],
+                         [relation.relation_id for relation in relations])
+        self.assertEqual(500, len(relations[0]))
+
+
+class RelationIndexTest(TestCase):
+
+    def setUp(self):
+        self.commands = []
+
+    def fake_runner(self, command):
+        self.commands.append(command)
+        if command[0] == "relation-ids":
+            return json.dumps({"db": ["db:1", "db:2"],
+                               "cache": ["cache:3"]}[command[-1]])
+        if command[0] == "relation-list":
+            return json.dumps({"db:1": ["mysql/0", "mysql/1"],
+                               "db:2": ["pg/0"], "cache:3": []}[
+                                   command[-1]])
+        return ""
+
+    def count(self, tool):
+        return len([command for command in self.commands
+                    if command[0] == tool])
+
+    def test_lookups_share_one_sweep(self):
+        """
+        Resolving relation IDs and remote services only lists every relation
+        once, however many lookups are made.
+        """
+        environment = Environment({}, command_runner=self.fake_runner)
+        environment.metadata = {"requires": {"db": {"interface": "sql"},
+                                             "cache": {"interface": "redis"}}}
+        self.assertEqual("db:2", environment.get_relation_id("db", "pg/0"))
+        self.assertEqual("db:1", environment.get_relation_id("db", "mysql"))
+        self.assertIsNone(environment.get_relation_id("db", "redis"))
+        self.assertEqual("pg", environment.get_remote_service_name("db:2"))
+        self.assertIsNone(environment.get_remote_service_name("cache:3"))
+        self.assertEqual(["mysql/0", "mysql/1"],
+                         environment.get_related_units("db:1"))
+        self.assertEqual(2, self.count("relation-ids"))
+        self.assertEqual(3, self.count("relation-list"))
+
+    def test_lookups_without_metadata(self):
+        """
+        Without a charm directory to read the relation types from, lookups
+        query the requested relation only.
+        """
+        environment = Environment({}, command_runner=self.fake_runner)
+        self.assertEqual("db:2", environment.get_relation_id("db", "pg/0"))
+        self.assertEqual("pg", environment.get_remote_service_name("db:2"))
+        self.assertIsNone(environment.get_remote_service_name("cache:3"))
+        self.assertEqual(1, self.count("relation-ids"))
+        self.assertEqual(
+            ["db:1", "db:2", "db:2", "cache:3"],
+            [command[-1] for command in self.commands
+             if command[0] == "relation-list"])
@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import tempfile
+from subprocess import CalledProcessError
+from unittest import TestCase
+
+from charming.juju.hookenv import Environment
+from charming.juju.replay import (
+    RecordingRunner, ReplayError, ReplayRunner, Transcript, load_segments,
+    load_transcript)
+
+
+class RecordReplayTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "transcript.jsonl")
+
+    def settings(self, contents):
+        """Return the path of a new relation-set --file holding contents."""
+        fd, path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, "w") as f:
+            f.write(contents)
+        return path
+
+    def fake_runner(self, command):
+        if command[0] == "relation-get":
+            return json.dumps({"host": "10.0.0.1"})
+        if command[0] == "relation-ids":
+            raise CalledProcessError(2, command, output="")
+        if command[0] == "missing-tool":
+            raise OSError(2, "No such file")
+        return ""
+
+    def record(self):
+        transcript = Transcript(self.path, {"JUJU_UNIT_NAME": "app/0",
+                                            "HOME": "/root"})
+        runner = RecordingRunner(transcript, self.fake_runner)
+        environment = Environment({}, command_runner=runner)
+        environment.relation_get(unit="db/0", relation_id="db:1")
+        self.assertRaises(CalledProcessError, runner, ["relation-ids", "x"])
+        self.assertRaises(OSError, runner, ["missing-tool"])
+        runner(["relation-set", "--file", self.settings("host: a\n"),
+                "-r", "db:1"])
+        transcript.close()
+        return environment
+
+    def test_transcript(self):
+        """
+        Every call is recorded with its argv, output and status, after the
+        hook environment.
+        """
+        self.record()
+        environment, calls = load_transcript(self.path)
+        self.assertEqual({"JUJU_UNIT_NAME": "app/0"}, environment)
+        self.assertEqual(
+            [0, 2, -1, 0], [call["status"] for call in calls])
+        self.assertEqual('{"host": "10.0.0.1"}', calls[0]["stdout"])
+        self.assertEqual(
+            ["relation-set", "--file", "<file>", "-r", "db:1"],
+            calls[3]["argv"])
+        self.assertEqual("host: a\n", calls[3]["file"])
+
+    def test_replay(self):
+        """
+        Replayed calls return the recorded output and raise the recorded
+        errors, without running anything.
+        """
+        self.record()
+        runner = ReplayRunner.from_file(self.path, latency=0.001)
+        environment = Environment({}, command_runner=runner)
+        self.assertEqual(
+            {"host": "10.0.0.1"},
+            environment.relation_get(unit="db/0", relation_id="db:1"))
+        with self.assertRaises(CalledProcessError) as context:
+            runner(["relation-ids", "x"])
+        self.assertEqual(2, context.exception.returncode)
+        self.assertRaises(OSError, runner, ["missing-tool"])
+        self.assertRaises(
+            ReplayError, runner,
+            ["relation-set", "--file", self.settings("host: b\n"),
+             "-r", "db:1"])
+        runner(["relation-set", "--file", self.settings("host: a\n"),
+                "-r", "db:1"])
+        self.assertRaises(ReplayError, runner, ["config-get"])
+        self.assertEqual([], runner.unused())
+
+    def test_one_segment_per_hook(self):
+        """
+        Every hook appends its own segment to the transcript, which is only
+        readable by its owner. A hook is selected by its index, or by its
+        name for its last run.
+        """
+        for hook_name in ("install", "config-changed", "config-changed"):
+            transcript = Transcript(self.path, {"JUJU_HOOK_NAME": hook_name})
+            RecordingRunner(transcript, self.fake_runner)(
+                ["status-set", "active", hook_name])
+            transcript.close()
+        self.assertEqual(0o600, os.stat(self.path).st_mode & 0o777)
+        self.assertEqual(
+            ["install", "config-changed", "config-changed"],
+            [header["hook"] for header, _ in load_segments(self.path)])
+        environment, calls = load_transcript(self.path, "install")
+        self.assertEqual({"JUJU_HOOK_NAME": "install"}, environment)
+        self.assertEqual([["status-set", "active", "install"]],
+                         [call["argv"] for call in calls])
+        self.assertEqual(1, len(load_transcript(self.path, 1)[1]))
+        self.assertEqual(1, len(load_transcript(self.path)[1]))
+        self.assertRaises(ReplayError, load_transcript, self.path, "start")
+        self.assertRaises(ReplayError, load_transcript, self.path, 3)
@@ -0,0 +1,79 @@
+import json
+import threading
+from unittest import TestCase
+
+from charming.juju.hookenv import Environment, is_relation_made, relations
+
+
+class SnapshotRelationsTest(TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self.lock = threading.Lock()
+
+    def fake_runner(self, command):
+        with self.lock:
+            self.commands.append(command)
+        if command[0] == "relation-ids":
+            return json.dumps(["{}:1".format(command[-1])])
+        if command[0] == "relation-list":
+            return json.dumps(["mysql/0", "mysql/1"])
+        if command[0] == "relation-get":
+            unit = command[-1]
+            if unit == "mysql/1":
+                return json.dumps({"private-address": "10.0.0.2"})
+            return json.dumps({"unit": unit})
+        return ""
+
+    def make_environment(self):
+        env = Environment({"JUJU_UNIT_NAME": "wordpress/0"},
+                          command_runner=self.fake_runner)
+        env.metadata = {"requires": {"db": {"interface": "mysql"}}}
+        return env
+
+    def test_snapshot_relations(self):
+        """
+        The snapshot holds the data of the local and remote units for every
+        relation ID, and is reused by later calls.
+        """
+        env = self.make_environment()
+        snapshot = env.snapshot_relations()
+        self.assertEqual(
+            {"wordpress/0": {"unit": "wordpress/0"},
+             "mysql/0": {"unit": "mysql/0"},
+             "mysql/1": {"private-address": "10.0.0.2"}},
+            snapshot["db"]["db:1"])
+        self.assertEqual(5, len(self.commands))
+        self.assertIs(snapshot, env.snapshot_relations())
+        self.assertEqual(5, len(self.commands))
+
+    def test_snapshot_is_read_only(self):
+        """The snapshot can't be modified by callers."""
+        snapshot = self.make_environment().snapshot_relations()
+        with self.assertRaises(TypeError):
+            snapshot["db"]["db:1"]["mysql/0"]["unit"] = "changed"
+
+    def test_is_relation_made(self):
+        """
+        A relation is made when a remote unit set all the expected keys.
+        """
+        env = self.make_environment()
+        self.assertTrue(is_relation_made("db", environment=env))
+        self.assertFalse(
+            is_relation_made("db", keys=["private-address", "password"],
+                             environment=env))
+
+    def test_relations_is_a_plain_copy(self):
+        """
+        relations() returns plain dicts that can be modified and serialized,
+        without changing the cached snapshot.
+        """
+        env = self.make_environment()
+        data = relations(environment=env)
+        self.assertIs(dict, type(data["db"]["db:1"]["mysql/0"]))
+        data["db"]["db:1"]["mysql/0"]["unit"] = "changed"
+        json.dumps(data)
+        snapshot = env.snapshot_relations()
+        self.assertEqual("mysql/0", snapshot["db"]["db:1"]["mysql/0"]["unit"])
+        data = relations(environment=env)
+        self.assertEqual("mysql/0", data["db"]["db:1"]["mysql/0"]["unit"])
@@ -0,0 +1,59 @@
+import json
+from unittest import TestCase
+
+from charming.juju import hookenv
+from charming.juju.hookenv import Environment
+from charming.juju.status import StatusManager
+
+
+class StatusManagerTest(TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self.addCleanup(hookenv._atexit.__delitem__, slice(None))
+        self.status = StatusManager(
+            Environment({}, command_runner=self.fake_runner))
+
+    def fake_runner(self, command):
+        self.commands.append(command)
+        if command[0] == "status-get":
+            return json.dumps({"status": "active", "message": "Ready"})
+        return ""
+
+    def test_most_severe_state_published_once(self):
+        """
+        A single status-set with the most severe state is run at the end of
+        the hook.
+        """
+        self.status.report("web", "active", "Serving")
+        self.status.report("db", "waiting", "Waiting for the database")
+        self.status.report("cache", "waiting", "Waiting for memcache")
+        self.status.report("db", "waiting", "Waiting for the db password")
+        self.assertEqual([], self.commands)
+        hookenv._run_atexit()
+        self.assertEqual(
+            [["status-get", "--format=json", "--include-data"],
+             ["status-set", "waiting",
+              "Waiting for the db password; Waiting for memcache"]],
+            self.commands)
+
+    def test_unchanged_status_is_not_set(self):
+        """
+        Nothing is set when the aggregated status is the current one.
+        """
+        self.status.report("web", "active", "Ready")
+        self.status.publish()
+        self.assertEqual(["status-get"],
+                         [command[0] for command in self.commands])
+
+    def test_immediate_publish_is_rate_limited(self):
+        """
+        Immediate publications are skipped if the previous one was too
+        recent.
+        """
+        self.status.report("install", "maintenance", "Step 1", publish=True)
+        self.status.report("install", "maintenance", "Step 2", publish=True)
+        self.assertEqual(
+            [["status-set", "maintenance", "Step 1"]],
+            [command for command in self.commands
+             if command[0] == "status-set"])
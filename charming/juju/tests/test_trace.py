@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import tempfile
+from subprocess import CalledProcessError
+from unittest import TestCase
+
+from charming.juju import execute, trace
+from charming.juju.hookenv import Environment
+from charming.juju.hooks import Hooks
+
+
+class CallTracerTest(TestCase):
+
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+
+    def fake_runner(self, command):
+        if command[0] == "relation-get":
+            raise CalledProcessError(2, command)
+        return "10.0.0.1"
+
+    def test_disabled_tracing_leaves_runner_alone(self):
+        """
+        Without CHARMING_TRACE, command runners are not wrapped.
+        """
+        self.assertIsNone(trace._tracer)
+        env = Environment({}, command_runner=self.fake_runner)
+        self.assertEqual(self.fake_runner, env.command_runner)
+
+    def test_report(self):
+        """
+        The report appends a per tool summary of the recorded calls to the
+        trace file.
+        """
+        tracer = trace.CallTracer()
+        runner = tracer.wrap(self.fake_runner)
+        runner(["unit-get", "private-address"])
+        runner(["unit-get", "public-address"])
+        with self.assertRaises(CalledProcessError):
+            runner(["relation-get", "-"])
+        tracer.report("install", self.charm_dir)
+
+        with open(os.path.join(self.charm_dir, trace.TRACE_FILE_NAME)) as f:
+            summary = json.loads(f.readline())
+        self.assertEqual("install", summary["hook"])
+        self.assertEqual(3, summary["calls"])
+        self.assertEqual(2, summary["tools"]["unit-get"]["calls"])
+        self.assertEqual(16, summary["tools"]["unit-get"]["output_bytes"])
+        self.assertEqual(1, summary["tools"]["relation-get"]["failures"])
+
+    def test_argv_bytes(self):
+        """
+        The size of the arguments is counted in encoded bytes.
+        """
+        tracer = trace.CallTracer()
+        tracer.wrap(self.fake_runner)(["juju-log", "\u00e9t\u00e9"])
+        self.assertEqual(13, tracer.calls[0]["argv_bytes"])
+
+    def test_failed_hooks_are_reported(self):
+        """
+        Hooks that fail are reported too, flagged as failed.
+        """
+        os.environ[trace.TRACE_ENV_KEY] = "1"
+        self.addCleanup(os.environ.pop, trace.TRACE_ENV_KEY)
+        os.environ["CHARM_DIR"] = self.charm_dir
+        self.addCleanup(os.environ.pop, "CHARM_DIR")
+        self.addCleanup(setattr, trace, "_tracer", None)
+        hooks = Hooks()
+
+        @hooks.hook("install")
+        def install():
+            raise ValueError("failed")
+
+        self.assertRaises(ValueError, hooks.execute, ["install"])
+        with open(os.path.join(self.charm_dir, trace.TRACE_FILE_NAME)) as f:
+            summary = json.loads(f.readline())
+        self.assertEqual("install", summary["hook"])
+        self.assertTrue(summary["failed"])
+
+    def test_default_runner_wrapped_once(self):
+        """
+        The default hook tool runner is wrapped once per process, and isn't
+        wrapped again by Environment.
+        """
+        os.environ[trace.TRACE_ENV_KEY] = "1"
+        self.addCleanup(os.environ.pop, trace.TRACE_ENV_KEY)
+        self.addCleanup(setattr, trace, "_tracer", None)
+        self.addCleanup(setattr, execute, "_runner", None)
+        runner = execute._hook_tool_runner()
+        self.assertTrue(trace.is_traced(runner))
+        self.assertIs(runner, execute._hook_tool_runner())
+        env = Environment({})
+        self.assertIs(execute.execute_command, env.command_runner)
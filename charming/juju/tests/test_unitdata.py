@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from charming.juju import hookenv, unitdata
+from charming.juju.hookenv import Environment
+from charming.juju.hooks import Hooks
+from charming.juju.unitdata import Storage, kv
+
+
+class StorageTest(TestCase):
+
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        self.addCleanup(hookenv._run_atexit)
+
+    def open(self, hook_name="config-changed"):
+        environment = Environment({"CHARM_DIR": self.charm_dir,
+                                   "JUJU_HOOK_NAME": hook_name})
+        storage = Storage(environment=environment)
+        self.addCleanup(storage.close)
+        return storage
+
+    def test_typed_values_and_prefix_scans(self):
+        """
+        Values keep their type, and keys can be read by prefix.
+        """
+        storage = self.open()
+        storage.set("members.mysql/0", {"address": "10.0.0.1", "weight": 3})
+        storage.set("members.mysql/1", {"address": "10.0.0.2", "weight": 1})
+        storage.set("membersx", True)
+        storage.set("port", 8080)
+        self.assertEqual(8080, storage.get("port"))
+        self.assertIs(True, storage.get("membersx"))
+        self.assertEqual("default", storage.get("missing", "default"))
+        self.assertEqual(
+            {"mysql/0": {"address": "10.0.0.1", "weight": 3},
+             "mysql/1": {"address": "10.0.0.2", "weight": 1}},
+            storage.getrange("members.", strip=True))
+        storage.unsetrange("members.")
+        self.assertEqual({}, storage.getrange("members."))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.charm_dir, ".unit-state.db")))
+
+    def test_hook_transactions(self):
+        """
+        Writes are committed when the hook succeeds, and rolled back when it
+        fails.
+        """
+        storage = self.open()
+        storage.set("kept", 1)
+        hookenv._run_atexit()
+        storage.close()
+
+        storage = self.open()
+        storage.set("discarded", 2)
+        hookenv._run_atfailure()
+        storage.close()
+
+        storage = self.open()
+        self.assertEqual(1, storage.get("kept"))
+        self.assertIsNone(storage.get("discarded"))
+
+    def test_change_log(self):
+        """
+        The changes made since a revision are reported as (old, new) pairs.
+        """
+        storage = self.open()
+        storage.set("a", 1)
+        storage.set("b", 1)
+        first = storage.revision
+        hookenv._run_atexit()
+
+        storage.set("a", 2)
+        storage.set("b", 2)
+        storage.set("b", 1)
+        storage.unset("a")
+        storage.set("c", [1])
+        self.assertEqual({"a": (1, None), "c": (None, [1])},
+                         storage.changes())
+        hookenv._run_atexit()
+
+        storage.set("c", [2])
+        self.assertEqual({"a": (1, None), "c": (None, [2])},
+                         storage.changes(since=first))
+        self.assertEqual({"c": ([1], [2])}, storage.changes(prefix="c"))
+
+    def test_prune_is_committed(self):
+        """
+        Pruning the change log is committed with the hook, like writes.
+        """
+        storage = self.open()
+        for value in range(3):
+            storage.set("a", value)
+            hookenv._run_atexit()
+        storage.prune(keep=1)
+        hookenv._run_atexit()
+        storage.close()
+
+        storage = self.open()
+        self.assertEqual({"a": (1, 2)}, storage.changes(since=0))
+
+    def test_handlers_on_several_threads(self):
+        """
+        The handlers of a hook running on several threads share the process
+        wide store, whose writes are committed by the main thread.
+        """
+        environment = Environment({"CHARM_DIR": self.charm_dir,
+                                   "JUJU_HOOK_NAME": "config-changed"})
+        self.addCleanup(setattr, unitdata, "_storage", None)
+        self.addCleanup(lambda: unitdata._storage.close())
+        hooks = Hooks(workers=2)
+
+        @hooks.hook("config-changed")
+        def render():
+            kv(environment).set("rendered", True)
+
+        @hooks.hook("config-changed")
+        def restart():
+            kv(environment).set("restarted", True)
+
+        hooks.execute(["config-changed"])
+        storage = self.open()
+        self.assertEqual({"rendered": True, "restarted": True},
+                         storage.getrange(""))
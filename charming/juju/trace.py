@@ -0,0 +1,165 @@
+"""Tracing of hook tool calls, to find out what makes a hook slow.
+
+Tracing is enabled by setting CHARMING_TRACE in the hook environment:
+
+    - "1": every hook appends a JSON summary of its hook tool calls to
+      $CHARM_DIR/.charming-trace.jsonl.
+    - "log": same, and a one line digest is also sent to juju-log.
+
+When tracing is disabled, command runners are used as they are, unwrapped.
+"""
+import json
+import os
+import time
+import weakref
+
+TRACE_ENV_KEY = "CHARMING_TRACE"
+TRACE_FILE_NAME = ".charming-trace.jsonl"
+
+# The number of slowest calls listed in a hook summary.
+SLOWEST_CALLS = 5
+
+_tracer = None
+
+# The command runners whose calls are already traced, whether by a wrapper
+# or by themselves: they are never wrapped again.
+_traced_runners = weakref.WeakSet()
+
+
+class CallTracer(object):
+    """Records hook tool calls made through wrapped command runners."""
+
+    def __init__(self, log_digest=False):
+        self.log_digest = log_digest
+        self.started = time.time()
+        self.calls = []
+        import threading
+        self._lock = threading.Lock()
+
+    def wrap(self, command_runner):
+        """Return a command runner recording every call to command_runner.
+
+        Command runners that are coroutine functions (see charming.juju.aio)
+        are wrapped by a coroutine function.
+        """
+        import inspect
+        if inspect.iscoroutinefunction(command_runner):
+            from charming.juju.aio import trace_coroutine
+            return trace_coroutine(self, command_runner)
+
+        def traced_runner(command):
+            start = time.time()
+            output = None
+            status = -1
+            try:
+                output = command_runner(command)
+                status = 0
+                return output
+            except Exception as e:
+                status = _status(e)
+                raise
+            finally:
+                self.record(command, time.time() - start, output, status)
+        _traced_runners.add(traced_runner)
+        return traced_runner
+
+    def record(self, command, duration, output, status):
+        """Record a single hook tool call."""
+        call = {
+            "tool": os.path.basename(command[0]),
+            "argv_bytes": sum(len(arg.encode("utf-8")) for arg in command),
+            "duration": duration,
+            "output_bytes": len(output) if output else 0,
+            "status": status,
+        }
+        with self._lock:
+            self.calls.append(call)
+
+    def summary(self, hook_name, failed=False):
+        """Return a dict summarizing the calls recorded so far, per tool."""
+        with self._lock:
+            calls = list(self.calls)
+        tools = {}
+        for call in calls:
+            tool = tools.setdefault(call["tool"], {
+                "calls": 0, "duration": 0.0, "max_duration": 0.0,
+                "argv_bytes": 0, "output_bytes": 0, "failures": 0})
+            tool["calls"] += 1
+            tool["duration"] += call["duration"]
+            tool["max_duration"] = max(tool["max_duration"], call["duration"])
+            tool["argv_bytes"] += call["argv_bytes"]
+            tool["output_bytes"] += call["output_bytes"]
+            if call["status"]:
+                tool["failures"] += 1
+        return {
+            "hook": hook_name,
+            "failed": failed,
+            "started": self.started,
+            "duration": time.time() - self.started,
+            "calls": len(calls),
+            "tool_duration": sum(call["duration"] for call in calls),
+            "tools": tools,
+            "slowest": sorted(
+                calls, key=lambda call: call["duration"],
+                reverse=True)[:SLOWEST_CALLS],
+        }
+
+    def report(self, hook_name, charm_dir, failed=False):
+        """Append the summary of this hook to the trace file in charm_dir,
+        and send a digest to juju-log if asked to.
+
+        @param failed: Whether the hook failed.
+        """
+        summary = self.summary(hook_name, failed)
+        if charm_dir:
+            with open(os.path.join(charm_dir, TRACE_FILE_NAME), "a") as f:
+                f.write(json.dumps(summary, sort_keys=True) + "\n")
+        if self.log_digest:
+            from charming.juju.log import DEBUG, log
+            log(digest(summary), level=DEBUG)
+
+
+def _status(error):
+    """Return the status recorded for a call failing with error: the exit
+    code of the hook tool, or -1 if it couldn't be run."""
+    from subprocess import CalledProcessError
+    if isinstance(error, CalledProcessError):
+        return error.returncode
+    return -1
+
+
+def digest(summary):
+    """Return a one line, human readable version of a hook summary."""
+    tools = sorted(summary["tools"].items(),
+                   key=lambda item: item[1]["duration"], reverse=True)
+    return "{}{} made {} hook tool calls in {:.3f}s: {}".format(
+        summary["hook"], " (failed)" if summary.get("failed") else "",
+        summary["calls"], summary["tool_duration"],
+        ", ".join("{} x{} {:.3f}s".format(name, tool["calls"],
+                                          tool["duration"])
+                  for name, tool in tools))
+
+
+def get_tracer(environment_dict=os.environ):
+    """Return the process wide tracer, or None if tracing is disabled."""
+    global _tracer
+    if _tracer is None:
+        setting = environment_dict.get(TRACE_ENV_KEY)
+        if setting:
+            _tracer = CallTracer(log_digest=(setting == "log"))
+    return _tracer
+
+
+def traced(command_runner):
+    """Return command_runner wrapped by the tracer, or command_runner itself
+    if tracing is disabled or it is already traced."""
+    tracer = get_tracer()
+    if tracer is None or is_traced(command_runner):
+        return command_runner
+    return tracer.wrap(command_runner)
+
+
+def is_traced(command_runner):
+    """Are the calls to command_runner already traced?"""
+    return command_runner in _traced_runners
+
@@ -0,0 +1,282 @@
+"""A persistent key/value store for unit data, backed by sqlite.
+
+Values are stored as JSON, so they are read back with the type they were
+written with. Keys sharing a prefix can be read and removed with a single
+indexed range query, so charms tracking thousands of records only read and
+write the records they need.
+
+The writes made by a hook are a single transaction: it is committed when the
+hook succeeds and rolled back when it fails. Every committed hook is a
+revision, and the change log records the keys each revision changed, so a
+hook can ask what changed since an earlier revision.
+
+The store can be used from the handlers of a hook running on several
+threads (see Hooks' workers parameter): they share its connection, which is
+only used by one thread at a time.
+
+Example::
+
+    from charming.juju.unitdata import kv
+
+    db = kv()
+    db.set("members.mysql/0", {"address": "10.0.0.1", "weight": 3})
+    members = db.getrange("members.", strip=True)
+    changes = db.changes(since=db.get("last-rendered-revision", 0))
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from charming.juju.hookenv import Environment, atexit, atfailure
+
+UNIT_STATE_FILE_NAME = ".unit-state.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS revisions (
+    revision INTEGER PRIMARY KEY AUTOINCREMENT,
+    hook TEXT,
+    date REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    revision INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    old TEXT,
+    new TEXT,
+    PRIMARY KEY (revision, key)
+);
+CREATE INDEX IF NOT EXISTS changes_by_key ON changes (key, revision);
+"""
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def _decode(data):
+    return None if data is None else json.loads(data)
+
+
+def _prefix_end(prefix):
+    """Return the smallest string greater than every string starting with
+    prefix, or None if there is none."""
+    while prefix:
+        last = ord(prefix[-1])
+        if last < 0x10ffff:
+            return prefix[:-1] + chr(last + 1)
+        prefix = prefix[:-1]
+    return None
+
+
+class Storage(object):
+    """A sqlite backed key/value store, whose writes are committed at the end
+    of a successful hook and rolled back when it fails.
+
+    @param path: The database file. Defaults to .unit-state.db in the charm
+        directory, or to the UNIT_STATE_DB environment variable if set.
+    @param environment: The Environment giving the charm directory and hook
+        name.
+    """
+
+    def __init__(self, path=None, environment=None):
+        self.environment = environment or Environment()
+        if path is None:
+            path = self.environment.environment.get("UNIT_STATE_DB") or \
+                os.path.join(self.environment.get_charm_dir(),
+                             UNIT_STATE_FILE_NAME)
+        self.path = path
+        # Reentrant, so that compound operations hold it around the queries
+        # they run.
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(_SCHEMA)
+        self._revision = None
+        self._in_transaction = False
+
+    def _execute(self, query, parameters=()):
+        """Run query and return the rows it selected."""
+        with self._lock:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def _begin(self):
+        """Start the transaction of the current hook, unless it started
+        already: it is committed when the hook succeeds, and rolled back
+        when it fails. Every write calls this first."""
+        if not self._in_transaction:
+            atexit(self.commit)
+            atfailure(self.rollback)
+            self._in_transaction = True
+
+    @property
+    def revision(self):
+        """The revision of the current hook, created by its first write."""
+        with self._lock:
+            if self._revision is None:
+                self._begin()
+                cursor = self.connection.execute(
+                    "INSERT INTO revisions (hook, date) VALUES (?, ?)",
+                    (self.environment.get_juju_hook_name(), time.time()))
+                self._revision = cursor.lastrowid
+            return self._revision
+
+    def last_revision(self):
+        """Return the revision of the last committed hook that wrote
+        anything, or 0 if there is none."""
+        query = "SELECT MAX(revision) FROM revisions"
+        parameters = ()
+        if self._revision is not None:
+            query += " WHERE revision < ?"
+            parameters = (self._revision,)
+        return self._execute(query, parameters)[0][0] or 0
+
+    def get(self, key, default=None):
+        """Return the value of key, or default if it is not set."""
+        data = self._raw(key)
+        return default if data is None else _decode(data)
+
+    def getrange(self, prefix, strip=False):
+        """Return a {key: value} dict of every key starting with prefix.
+
+        @param strip: If True, the prefix is removed from the returned keys.
+        """
+        query = "SELECT key, data FROM kv WHERE key >= ?"
+        parameters = [prefix]
+        end = _prefix_end(prefix)
+        if end is not None:
+            query += " AND key < ?"
+            parameters.append(end)
+        start = len(prefix) if strip else 0
+        return dict((key[start:], _decode(data)) for key, data in
+                    self._execute(query, parameters))
+
+    def set(self, key, value):
+        """Set the value of key. Setting a value to None unsets the key."""
+        if value is None:
+            self.unset(key)
+            return
+        data = json.dumps(value, sort_keys=True)
+        with self._lock:
+            previous = self._raw(key)
+            if previous == data:
+                return
+            self._execute(
+                "INSERT OR REPLACE INTO kv (key, data) VALUES (?, ?)",
+                (key, data))
+            self._log(key, previous, data)
+
+    def update(self, mapping, prefix=""):
+        """Set several keys at once, optionally prefixing them."""
+        for key, value in mapping.items():
+            self.set(prefix + key, value)
+
+    def unset(self, key):
+        """Remove key from the store."""
+        with self._lock:
+            previous = self._raw(key)
+            if previous is None:
+                return
+            self._execute("DELETE FROM kv WHERE key = ?", (key,))
+            self._log(key, previous, None)
+
+    def unsetrange(self, prefix):
+        """Remove every key starting with prefix."""
+        for key in self.getrange(prefix):
+            self.unset(key)
+
+    def _raw(self, key):
+        rows = self._execute("SELECT data FROM kv WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def _log(self, key, old, new):
+        """Record in the change log that key went from old to new (both
+        encoded) during the current hook. The caller holds the lock."""
+        revision = self.revision
+        rows = self._execute(
+            "SELECT old FROM changes WHERE revision = ? AND key = ?",
+            (revision, key))
+        if rows:
+            old = rows[0][0]
+        if old == new:
+            # Changed back to its value at the start of the hook.
+            self._execute(
+                "DELETE FROM changes WHERE revision = ? AND key = ?",
+                (revision, key))
+            return
+        self._execute(
+            "INSERT OR REPLACE INTO changes (revision, key, old, new) "
+            "VALUES (?, ?, ?, ?)", (revision, key, old, new))
+
+    def changes(self, since=None, prefix=""):
+        """Return the keys changed after revision since, as a
+        {key: (old value, new value)} dict; None stands for unset keys.
+
+        @param since: The last revision not to include. Defaults to the
+            last committed revision, giving the changes of the current hook.
+        @param prefix: Only return the keys starting with prefix.
+        """
+        if since is None:
+            since = self.last_revision()
+        query = ("SELECT key, old, new FROM changes WHERE revision > ?"
+                 " AND key >= ?")
+        parameters = [since, prefix]
+        end = _prefix_end(prefix)
+        if end is not None:
+            query += " AND key < ?"
+            parameters.append(end)
+        query += " ORDER BY revision"
+        changes = {}
+        for key, old, new in self._execute(query, parameters):
+            if key in changes:
+                old = changes[key][0]
+            changes[key] = (old, new)
+        return dict((key, (_decode(old), _decode(new)))
+                    for key, (old, new) in changes.items() if old != new)
+
+    def prune(self, keep=100):
+        """Forget the change log of all but the last keep revisions."""
+        with self._lock:
+            self._begin()
+            last = self._execute(
+                "SELECT MAX(revision) FROM revisions")[0][0] or 0
+            self._execute(
+                "DELETE FROM changes WHERE revision <= ?", (last - keep,))
+            self._execute(
+                "DELETE FROM revisions WHERE revision <= ?", (last - keep,))
+
+    def commit(self):
+        """Commit the writes of the hook."""
+        with self._lock:
+            if self.connection is None:
+                return
+            self.connection.commit()
+            self._revision = None
+            self._in_transaction = False
+
+    def rollback(self):
+        """Discard the writes of the hook."""
+        with self._lock:
+            if self.connection is None:
+                return
+            self.connection.rollback()
+            self._revision = None
+            self._in_transaction = False
+
+    def close(self):
+        """Close the database, discarding the uncommitted writes."""
+        with self._lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def kv(environment=None):
+    """Return the process wide Storage of the unit."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = Storage(environment=environment)
+        return _storage